@@ -51,14 +51,15 @@ class BackendAdminSite(AdminSite):
     def dashboard(self, request):
         # Total sales
         from orders.models import Order, OrderItem
-        from store.models import Product
+        from store.models import Product, ProductVariant
+        from store.stock import LOW_STOCK_THRESHOLD
         from django.db.models import Sum, Count
         from users.models import AdminActionLog  # Ensure import for audit log
         total_revenue = Order.objects.filter(status__in=['paid', 'shipped', 'delivered']).aggregate(Sum('total'))['total__sum'] or 0
         recent_orders = Order.objects.order_by('-created_at')[:5]
         best_sellers = Product.objects.annotate(sold=Sum('orderitem__quantity')).order_by('-sold')[:5]
         order_statuses = Order.objects.values('status').annotate(count=Count('id'))
-        low_stock = Product.objects.filter(stock__lt=5).order_by('stock')[:5]
+        low_stock = ProductVariant.objects.filter(stock__lt=LOW_STOCK_THRESHOLD).select_related('product', 'size').order_by('stock')[:5]
         recent_admin_actions = AdminActionLog.objects.select_related('user').order_by('-timestamp')[:5]
         context = dict(
             self.each_context(request),
@@ -110,6 +110,23 @@ else:
         }
     }
 
+# Cache: shared Redis (so every worker sees the same entries and counters) unless
+# running the local SQLite setup, which uses per-process memory.
+CACHE_BACKEND = env('DJANGO_CACHE_BACKEND', default='locmem' if DB_ENGINE == 'sqlite' else 'redis')
+if CACHE_BACKEND == 'redis':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': f"redis://{env('REDIS_HOST')}:{env('REDIS_PORT')}/1",
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator'},
@@ -145,6 +162,31 @@ REST_FRAMEWORK = {
     'DEFAULT_SCHEMA_CLASS': 'rest_framework.schemas.openapi.AutoSchema',
 }
 
+# Product full-text search backend (see store/search.py). When unset it is picked
+# from the database: tsvector/GIN on PostgreSQL, FTS5 on SQLite.
+STORE_SEARCH_BACKEND = env('STORE_SEARCH_BACKEND', default=None)
+
+# Background threads generating product image renditions (see store/images.py)
+STORE_IMAGE_WORKERS = env.int('STORE_IMAGE_WORKERS', default=2)
+
+# Flash sale stock counters (see store/hot_stock.py): Redis, or process memory with the local SQLite setup
+STORE_HOT_STOCK_BACKEND = env(
+    'STORE_HOT_STOCK_BACKEND',
+    default='store.hot_stock.LocMemHotStockBackend' if CACHE_BACKEND == 'locmem' else 'store.hot_stock.RedisHotStockBackend',
+)
+STORE_HOT_STOCK_REDIS_URL = env('STORE_HOT_STOCK_REDIS_URL', default=f"redis://{env('REDIS_HOST')}:{env('REDIS_PORT')}/2")
+
+# Guest carts of anonymous shoppers (see orders/guest_cart.py): Redis, or process memory with the local SQLite setup
+ORDERS_GUEST_CART_BACKEND = env(
+    'ORDERS_GUEST_CART_BACKEND',
+    default='orders.guest_cart.LocMemGuestCartBackend' if CACHE_BACKEND == 'locmem' else 'orders.guest_cart.RedisGuestCartBackend',
+)
+ORDERS_GUEST_CART_REDIS_URL = env('ORDERS_GUEST_CART_REDIS_URL', default=f"redis://{env('REDIS_HOST')}:{env('REDIS_PORT')}/3")
+ORDERS_GUEST_CART_TTL = env.int('ORDERS_GUEST_CART_TTL', default=60 * 60 * 24 * 7)  # Seconds since the last change
+
+# How long responses of requests sent with an Idempotency-Key are replayed, in seconds (see orders/idempotency.py)
+ORDERS_IDEMPOTENCY_TTL = env.int('ORDERS_IDEMPOTENCY_TTL', default=60 * 60 * 24)
+
 SWAGGER_SETTINGS = {
     'DEFAULT_MODEL_RENDERING': 'example',
     'USE_SESSION_AUTH': False,
@@ -157,19 +199,32 @@ SWAGGER_SETTINGS = {
 
 # ASGI/Channels configuration
 ASGI_APPLICATION = 'backend.asgi.application'
-CHANNEL_LAYERS = {
-    'default': {
-        'BACKEND': 'channels_redis.core.RedisChannelLayer',
-        'CONFIG': {
-            'hosts': [(env('REDIS_HOST'), env('REDIS_PORT'))],
+if CACHE_BACKEND == 'redis':
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels_redis.core.RedisChannelLayer',
+            'CONFIG': {
+                'hosts': [(env('REDIS_HOST'), env('REDIS_PORT'))],
+            },
         },
-    },
-}
+    }
+else:
+    # Single process (local SQLite setup)
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels.layers.InMemoryChannelLayer',
+        },
+    }
 
 # Stripe payment settings (set these in your .env for production)
 STRIPE_PUBLISHABLE_KEY = 'pk_test_your_publishable_key'
 STRIPE_SECRET_KEY = 'sk_test_your_secret_key'
 STRIPE_WEBHOOK_SECRET = 'whsec_your_webhook_secret'
+# Stripe API host (point at stripe-mock, e.g. http://localhost:12111, for local testing)
+STRIPE_API_BASE = env('STRIPE_API_BASE', default='https://api.stripe.com')
+# PaymentIntent creation tries per payment attempt (transient errors only) and the first retry delay in seconds (doubles)
+STRIPE_MAX_TRIES = env.int('STRIPE_MAX_TRIES', default=3)
+STRIPE_RETRY_DELAY = env.float('STRIPE_RETRY_DELAY', default=0.5)
 
 # JWT authentication settings
 from datetime import timedelta
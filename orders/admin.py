@@ -5,7 +5,9 @@ from django.db.models import Sum, Count
 from django.utils import timezone
 from django.http import HttpResponseRedirect
 from django.contrib import messages
-from .models import Order, OrderItem, Cart, CartItem
+from .models import Order, OrderItem, Cart, CartItem, PaymentAttempt, StripeEvent
+from .fulfillment import bulk_transition
+from .pricing import pricing_aggregates
 from .pdf_services import PDFService
 from django import forms
 from django.utils.safestring import mark_safe
@@ -75,16 +77,22 @@ class CartAdmin(admin.ModelAdmin):
     readonly_fields = ['created_at']
     ordering = ['-created_at']
 
+    def get_queryset(self, request):
+        # Item count and total of every row in the changelist query (see orders.pricing)
+        aggregates = pricing_aggregates(prefix='items__')
+        return super().get_queryset(request).select_related('user').annotate(item_count=aggregates['item_count'], total_value=aggregates['items_total'])
+
     def item_count(self, obj):
         """Return the number of items in the cart."""
-        return obj.items.count()
+        return obj.item_count
     item_count.short_description = 'Items'
+    item_count.admin_order_field = 'item_count'
 
     def total_value(self, obj):
-        """Return the total value of all items in the cart."""
-        total = sum(item.product.get_discounted_price() * item.quantity for item in obj.items.all())
-        return f"${total:.2f}"
+        """Return the total value of all items in the cart (discounted prices)."""
+        return f"${obj.total_value:.2f}"
     total_value.short_description = 'Total Value'
+    total_value.admin_order_field = 'total_value'
 
 class OrderItemInline(admin.TabularInline):
     model = OrderItem
@@ -92,6 +100,35 @@ class OrderItemInline(admin.TabularInline):
     fields = ['product', 'size', 'quantity', 'price']
     readonly_fields = ['price']
 
+@admin.register(StripeEvent)
+class StripeEventAdmin(admin.ModelAdmin):
+    """
+    Admin interface for the Stripe webhook inbox.
+    Failed events can be queued again after the cause is fixed.
+    """
+    list_display = ['event_id', 'type', 'order_id', 'status', 'attempts', 'received_at', 'processed_at']
+    list_filter = ['status', 'type']
+    search_fields = ['event_id', 'order_id']
+    readonly_fields = ['event_id', 'type', 'payload', 'order_id', 'stripe_created', 'attempts', 'last_error', 'received_at', 'processed_at']
+    ordering = ['-received_at']
+    actions = ['requeue_events']
+
+    def requeue_events(self, request, queryset):
+        count = queryset.filter(status='failed').update(status='pending', attempts=0, next_attempt_at=timezone.now())
+        self.message_user(request, f"{count} events queued for processing.")
+    requeue_events.short_description = "Process selected failed events again"
+
+class PaymentAttemptInline(admin.TabularInline):
+    """Stripe PaymentIntent attempts of an order (read-only)."""
+    model = PaymentAttempt
+    extra = 0
+    can_delete = False
+    fields = ['status', 'payment_intent_id', 'tries', 'last_error', 'created_at']
+    readonly_fields = fields
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
 class TotalRangeFilter(SimpleListFilter):
     title = 'Total Amount'
     parameter_name = 'total_range'
@@ -126,7 +163,7 @@ class OrderAdmin(admin.ModelAdmin):
     readonly_fields = ['created_at', 'updated_at', 'total']
     ordering = ['-created_at']
     date_hierarchy = 'created_at'
-    inlines = [OrderItemInline]
+    inlines = [OrderItemInline, PaymentAttemptInline]
 
     fieldsets = (
         ('Order Information', {
@@ -155,56 +192,29 @@ class OrderAdmin(admin.ModelAdmin):
 
     actions = ['mark_as_paid', 'mark_as_shipped', 'mark_as_delivered', 'mark_as_cancelled', 'send_status_email', 'download_receipts', 'export_orders_csv']
 
+    def transition_selected(self, request, queryset, new_status):
+        """Move the selected orders to new_status in bulk (see orders.fulfillment)."""
+        updated, rejected = bulk_transition(queryset.values_list('pk', flat=True), new_status, user=request.user)
+        for order_id, error in list(rejected.items())[:10]:
+            self.message_user(request, f"Order {order_id}: {error}", level='ERROR')
+        if len(rejected) > 10:
+            self.message_user(request, f"{len(rejected) - 10} more orders could not be marked as {new_status}.", level='ERROR')
+        self.message_user(request, f"{len(updated)} orders marked as {new_status}.")
+
     def mark_as_paid(self, request, queryset):
-        count = 0
-        for order in queryset:
-            old_status = order.status
-            try:
-                order.transition_status('paid')
-                count += 1
-                log_admin_action(request.user, 'update', order, {'status': [old_status, 'paid']})
-            except ValueError as e:
-                self.message_user(request, f"Order {order.id}: {e}", level='ERROR')
-        self.message_user(request, f"{count} orders marked as paid.")
+        self.transition_selected(request, queryset, 'paid')
     mark_as_paid.short_description = "Mark selected orders as paid"
 
     def mark_as_shipped(self, request, queryset):
-        count = 0
-        for order in queryset:
-            old_status = order.status
-            try:
-                order.transition_status('shipped')
-                count += 1
-                log_admin_action(request.user, 'update', order, {'status': [old_status, 'shipped']})
-            except ValueError as e:
-                self.message_user(request, f"Order {order.id}: {e}", level='ERROR')
-        self.message_user(request, f"{count} orders marked as shipped.")
+        self.transition_selected(request, queryset, 'shipped')
     mark_as_shipped.short_description = "Mark selected orders as shipped"
 
     def mark_as_delivered(self, request, queryset):
-        count = 0
-        for order in queryset:
-            old_status = order.status
-            try:
-                order.transition_status('delivered')
-                count += 1
-                log_admin_action(request.user, 'update', order, {'status': [old_status, 'delivered']})
-            except ValueError as e:
-                self.message_user(request, f"Order {order.id}: {e}", level='ERROR')
-        self.message_user(request, f"{count} orders marked as delivered.")
+        self.transition_selected(request, queryset, 'delivered')
     mark_as_delivered.short_description = "Mark selected orders as delivered"
 
     def mark_as_cancelled(self, request, queryset):
-        count = 0
-        for order in queryset:
-            old_status = order.status
-            try:
-                order.transition_status('cancelled')
-                count += 1
-                log_admin_action(request.user, 'update', order, {'status': [old_status, 'cancelled']})
-            except ValueError as e:
-                self.message_user(request, f"Order {order.id}: {e}", level='ERROR')
-        self.message_user(request, f"{count} orders marked as cancelled.")
+        self.transition_selected(request, queryset, 'cancelled')
     mark_as_cancelled.short_description = "Mark selected orders as cancelled"
 
     def send_status_email(self, request, queryset):
@@ -3,6 +3,7 @@ WebSocket consumer for real-time order status updates using Django Channels.
 Handles user authentication, group management, and event broadcasting.
 """
 import json
+from collections import deque
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
 from django.contrib.auth.models import AnonymousUser
@@ -11,7 +12,8 @@ from .models import Order
 class OrderStatusConsumer(AsyncWebsocketConsumer):
     """
     Handles real-time order status updates for users via WebSocket.
-    Receives 'order_status_update' events from the channel layer and sends them to the client.
+    Receives 'order_status_update' / 'order_status_batch' events from the channel layer
+    (published by orders.events) and sends them to the client.
     """
     async def connect(self):
         self.user = self.scope["user"]
@@ -20,6 +22,8 @@ class OrderStatusConsumer(AsyncWebsocketConsumer):
             await self.close()
             return
         self.room_name = f"user_{self.user.id}_orders"
+        # Ids of recent events: an event sent to both our user and order groups is delivered once
+        self.sent_events = deque(maxlen=200)
         self.room_group_name = f"orders_{self.user.id}"
         # Join the user's order group for status updates
         await self.channel_layer.group_add(
@@ -41,7 +45,7 @@ class OrderStatusConsumer(AsyncWebsocketConsumer):
         message_type = text_data_json.get('type', 'message')
         if message_type == 'subscribe_order':
             order_id = text_data_json.get('order_id')
-            if order_id:
+            if order_id and await self.can_follow(order_id):
                 # Join a group for a specific order (optional granularity)
                 await self.channel_layer.group_add(
                     f"order_{order_id}",
@@ -54,6 +58,10 @@ class OrderStatusConsumer(AsyncWebsocketConsumer):
 
     async def order_status_update(self, event):
         # Send order status update to WebSocket client
+        if event.get('id'):
+            if event['id'] in self.sent_events:
+                return
+            self.sent_events.append(event['id'])
         await self.send(text_data=json.dumps({
             'type': 'order_status_update',
             'order_id': event['order_id'],
@@ -61,6 +69,18 @@ class OrderStatusConsumer(AsyncWebsocketConsumer):
             'message': event.get('message', '')
         }))
 
+    async def order_status_batch(self, event):
+        # Status updates of several of the user's orders (see orders.events)
+        for update in event['updates']:
+            await self.order_status_update(update)
+
+    @database_sync_to_async
+    def can_follow(self, order_id):
+        """Whether the user may subscribe to an order's updates (own order, or staff)."""
+        if not str(order_id).isdigit():
+            return False
+        return self.user.is_staff or Order.objects.filter(pk=order_id, user=self.user).exists()
+
     @database_sync_to_async
     def get_user_orders(self):
         """Return a list of the user's orders and their statuses."""
@@ -0,0 +1,106 @@
+"""
+Order status events for WebSocket clients (Channels).
+
+Every order status change (Order.save, transition_status, bulk
+transitions) is published here instead of calling group_send in the
+request. Events are queued when the transaction commits (nothing is sent
+for changes that roll back) and a background publisher thread sends them:
+it takes everything queued so far, keeps the latest event per order, and
+sends one 'order_status_batch' message per user group (orders_<user id>)
+plus one 'order_status_update' per order group (order_<order id>, joined
+by clients with subscribe_order). All messages of a batch are sent
+concurrently on the thread's event loop, so the Redis round trips overlap
+and requests never wait on the channel layer. Each event has an id, so a
+client in both groups of an order receives it once (see
+OrderStatusConsumer).
+"""
+import asyncio
+import logging
+import queue
+import threading
+import uuid
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+def status_message(order_id, status):
+    return f'Order #{order_id} status updated to {status}'
+
+class OrderEventPublisher:
+    """
+    Queue of committed order status events, sent in batches by a daemon
+    thread (background=False leaves them queued until drain() is called).
+    """
+    def __init__(self, background=True):
+        self.background = background
+        self.queue = queue.SimpleQueue()
+        self.lock = threading.Lock()
+        self.worker = None
+
+    def publish(self, changes):
+        """Send [(order_id, user_id, status)] once the current transaction commits."""
+        events = [
+            {'id': uuid.uuid4().hex, 'order_id': order_id, 'user_id': user_id, 'status': status, 'message': status_message(order_id, status)}
+            for order_id, user_id, status in changes
+        ]
+        if events:
+            transaction.on_commit(lambda: self.enqueue(events), robust=True)
+
+    def enqueue(self, events):
+        for event in events:
+            self.queue.put(event)
+        if self.background:
+            with self.lock:
+                if self.worker is None or not self.worker.is_alive():
+                    self.worker = threading.Thread(target=self.run, name='order-events', daemon=True)
+                    self.worker.start()
+
+    def take(self, first=None):
+        """Return the queued events (after first) without waiting."""
+        events = [] if first is None else [first]
+        while True:
+            try:
+                events.append(self.queue.get_nowait())
+            except queue.Empty:
+                return events
+
+    def messages(self, events):
+        """Coalesce events (latest per order) into [(group, message)]."""
+        latest = {}
+        for event in events:
+            latest.pop(event['order_id'], None)
+            latest[event['order_id']] = event
+        by_user = {}
+        for event in latest.values():
+            by_user.setdefault(event['user_id'], []).append(event)
+        messages = [(f"orders_{user_id}", {'type': 'order_status_batch', 'updates': updates}) for user_id, updates in by_user.items()]
+        messages += [(f"order_{event['order_id']}", {'type': 'order_status_update', **event}) for event in latest.values()]
+        return messages
+
+    async def send(self, events):
+        channel_layer = get_channel_layer()
+        messages = self.messages(events)
+        await asyncio.gather(*(channel_layer.group_send(group, message) for group, message in messages))
+        return len(messages)
+
+    def drain(self):
+        """Send the queued events from the calling thread; returns the number of channel messages."""
+        events = self.take()
+        return async_to_sync(self.send)(events) if events else 0
+
+    def run(self):
+        loop = asyncio.new_event_loop()  # Kept for the thread's lifetime, so channel layer connections are reused
+        while True:
+            events = self.take(self.queue.get())
+            try:
+                loop.run_until_complete(self.send(events))
+            except Exception:
+                logger.exception('Could not publish %d order events', len(events))
+
+publisher = OrderEventPublisher()
+
+def publish_status_changes(changes):
+    """Publish [(order_id, user_id, status)] to WebSocket clients after the current transaction commits."""
+    publisher.publish(changes)
@@ -0,0 +1,147 @@
+"""
+Bulk order status transitions (admin actions and the bulk-transition API).
+
+Orders are moved in batches of BATCH_SIZE, one transaction per batch, with
+a fixed number of statements per batch instead of a transaction, stock
+loop, save and audit insert per order:
+
+- the orders of the batch are locked in id order and their transitions
+  are validated against Order.TRANSITIONS in memory;
+- stock moves once for the whole batch with quantities summed per product
+  and size (see store.stock); when paying and a product is short, its stock
+  is allocated to the orders in id order, the orders it no longer covers
+  are rejected and the rest is reserved again;
+- statuses change with one UPDATE and the audit rows (AdminActionLog) are
+  inserted with one bulk INSERT;
+- after the commit, customer emails go out over one mail connection and
+  the WebSocket updates are handed to the batched publisher (orders.events).
+
+Status changes made here do not send Order post_save; the notifications
+above replace the per-order signal emails.
+"""
+from collections import defaultdict
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
+from store.stock import InsufficientStock, available_stock, release_hot_stock, release_stock, reserve_stock
+from users.models import AdminActionLog
+from .events import publish_status_changes
+from .models import Order, OrderItem
+from .signals import status_email
+
+BATCH_SIZE = 500  # Orders per transaction
+
+def _quantities(order_ids):
+    """Return {(product_id, size_id): total quantity} over the items of order_ids."""
+    rows = OrderItem.objects.filter(order_id__in=order_ids).values('product_id', 'size_id').annotate(total=Sum('quantity')).order_by()
+    return {(row['product_id'], row['size_id']): row['total'] for row in rows}
+
+def _reject_short(moving, rejected, product_id, error):
+    """
+    Allocate the available stock of product_id to the moving orders containing it,
+    in id order, and reject the orders past the point where a variant runs out.
+    """
+    rows = OrderItem.objects.filter(order_id__in=list(moving), product_id=product_id).values('order_id', 'size_id').annotate(total=Sum('quantity')).order_by('order_id')
+    lines = defaultdict(list)
+    for row in rows:
+        lines[row['order_id']].append((row['size_id'], row['total']))
+    if not lines:
+        return False
+    available = available_stock({(product_id, size_id) for order_lines in lines.values() for size_id, _ in order_lines})
+    left = {variant.pk: units for variant, units in available.values()}
+    short = []
+    for order_id in sorted(lines):
+        needed = defaultdict(int)
+        for size_id, quantity in lines[order_id]:
+            variant = available.get((product_id, size_id), (None, 0))[0]
+            needed[variant.pk if variant else None] += quantity
+        if None not in needed and all(left[pk] >= quantity for pk, quantity in needed.items()):
+            for pk, quantity in needed.items():
+                left[pk] -= quantity
+        else:
+            short.append(order_id)
+    for order_id in short or [max(lines)]:  # Nothing short any more: the stock moved since, give up the last order
+        rejected[order_id] = error
+        del moving[order_id]
+    return True
+
+def _reserve(moving, rejected):
+    """Reserve the stock of the moving orders at once, rejecting the orders short products cannot cover. Returns hot lines taken."""
+    while moving:
+        try:
+            return reserve_stock(_quantities(list(moving)))
+        except InsufficientStock as e:
+            if not _reject_short(moving, rejected, e.product_id, str(e)):
+                raise
+    return []
+
+def _notify(orders, new_status):
+    """Send the customer emails of orders ([(id, user_id, email)]) that moved to new_status."""
+    messages = []
+    for order_id, _, address in orders:
+        email = status_email(order_id, new_status)
+        if email and address:
+            messages.append(EmailMessage(*email, settings.DEFAULT_FROM_EMAIL, [address]))
+    if messages:
+        get_connection(fail_silently=True).send_messages(messages)
+
+def _transition_batch(order_ids, new_status, user):
+    sources = {status for status, targets in Order.TRANSITIONS.items() if new_status in targets}
+    reserved, committed = None, []
+    try:
+        with transaction.atomic():
+            # Registered first, so it runs before any hook that could raise after the commit
+            transaction.on_commit(lambda: committed.append(True))
+            rows = Order.objects.select_for_update(of=('self',)).filter(pk__in=order_ids).order_by('pk').values_list(
+                'pk', 'status', 'user_id', 'user__username', 'user__email',
+            )
+            moving, rejected = {}, {order_id: 'Order not found' for order_id in order_ids}
+            for order_id, status, user_id, username, email in rows:
+                del rejected[order_id]
+                if status in sources:
+                    moving[order_id] = (status, user_id, username, email)
+                else:
+                    rejected[order_id] = f"Invalid status transition: {status} → {new_status}"
+            if new_status == 'paid':
+                reserved = _reserve(moving, rejected)
+            restock = [order_id for order_id, (status, *_) in moving.items() if status in ['paid', 'shipped']]
+            if new_status == 'cancelled' and restock:
+                release_stock(_quantities(restock))
+            if moving:
+                now = timezone.now()
+                Order.objects.filter(pk__in=list(moving)).update(status=new_status, updated_at=now)
+                AdminActionLog.objects.bulk_create([
+                    AdminActionLog(
+                        user=user if user is not None and user.is_authenticated else None,
+                        action='update', model='Order', object_id=str(order_id),
+                        object_repr=f"Order {order_id} by {username}",
+                        changes={'status': [status, new_status]}, timestamp=now,
+                    )
+                    for order_id, (status, _, username, _) in moving.items()
+                ])
+                notified = [(order_id, user_id, email) for order_id, (_, user_id, _, email) in moving.items()]
+                transaction.on_commit(lambda: _notify(notified, new_status), robust=True)
+                publish_status_changes([(order_id, user_id, new_status) for order_id, user_id, _ in notified])
+    except Exception:
+        if reserved and not committed:
+            release_hot_stock(reserved)
+        raise
+    return list(moving), rejected
+
+def bulk_transition(order_ids, new_status, user=None, batch_size=BATCH_SIZE):
+    """
+    Move the orders order_ids to new_status, skipping orders whose
+    transition is invalid (or that are short of stock when paying).
+    Call outside of a transaction. Returns (ids of moved orders, {order id: error}).
+    """
+    if new_status not in Order.TRANSITIONS:
+        raise ValueError(f"Invalid status: {new_status}")
+    order_ids = sorted(set(order_ids))
+    updated, rejected = [], {}
+    for start in range(0, len(order_ids), batch_size):
+        moved, errors = _transition_batch(order_ids[start:start + batch_size], new_status, user)
+        updated += moved
+        rejected.update(errors)
+    return updated, rejected
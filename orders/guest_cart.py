@@ -0,0 +1,214 @@
+"""
+Guest carts for anonymous shoppers.
+
+A guest cart is a Redis hash keyed by an opaque cart token (sent by the
+client in the X-Cart-Token header), mapping line ids ('<product id>-<size
+id or 0>') to quantities. Every write refreshes its TTL, so abandoned carts
+expire on their own and cart churn never reaches the database.
+
+When the shopper logs in or registers with a cart token, merge_guest_cart()
+takes the guest cart out of Redis (read and delete in one step, so a token
+is merged once) and adds its lines to the user's Cart with one upsert
+(CartItem.objects.upsert_lines).
+
+The backend is set with the ORDERS_GUEST_CART_BACKEND setting (dotted path):
+RedisGuestCartBackend (ORDERS_GUEST_CART_REDIS_URL) or the single-process
+LocMemGuestCartBackend used by the local SQLite setup.
+"""
+import secrets
+import threading
+import time
+import redis
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+from store.models import Product, Size
+from .models import Cart, CartItem
+from .pricing import invalidate_cart_pricing
+
+TOKEN_HEADER = 'X-Cart-Token'
+MAX_LINES = 100  # Lines per guest cart
+
+def new_token():
+    return secrets.token_urlsafe(24)
+
+def line_id(product_id, size_id):
+    return f'{product_id}-{size_id or 0}'
+
+def parse_line_id(value):
+    """Return (product_id, size_id or None) for a line id, or None if it is malformed."""
+    product_id, _, size_id = str(value).partition('-')
+    if not (product_id.isdigit() and size_id.isdigit()):
+        return None
+    return int(product_id), int(size_id) or None
+
+class GuestCartItem:
+    """A guest cart line with its product and size (rendered by GuestCartItemSerializer)."""
+    def __init__(self, product, size, quantity):
+        self.id = line_id(product.pk, size.pk if size else None)
+        self.product = product
+        self.size = size
+        self.quantity = quantity
+
+def load_items(lines, products):
+    """
+    Return the GuestCartItems of lines ({line_id: quantity}) in line order, with
+    products taken from the products queryset; lines of deleted products are skipped.
+    """
+    keys = {line: parse_line_id(line) for line in lines}
+    keys = {line: key for line, key in keys.items() if key}
+    products = products.in_bulk({product_id for product_id, _ in keys.values()})
+    sizes = Size.objects.in_bulk({size_id for _, size_id in keys.values() if size_id})
+    return [
+        GuestCartItem(products[product_id], sizes.get(size_id), lines[line])
+        for line, (product_id, size_id) in keys.items()
+        if product_id in products and (size_id is None or size_id in sizes)
+    ]
+
+class BaseGuestCartBackend:
+    """
+    Interface for guest cart stores.
+    Carts are {line_id: quantity}; writes refresh the cart's TTL (ORDERS_GUEST_CART_TTL).
+    """
+    def lines(self, token):
+        """Return {line_id: quantity} of the cart ({} if it does not exist or expired)."""
+        raise NotImplementedError
+
+    def add(self, token, line, quantity):
+        """Add quantity to a line (created if missing); returns the new quantity."""
+        raise NotImplementedError
+
+    def set(self, token, line, quantity):
+        """Set the quantity of a line."""
+        raise NotImplementedError
+
+    def remove(self, token, line):
+        """Remove a line; returns whether it existed."""
+        raise NotImplementedError
+
+    def pop(self, token):
+        """Atomically return the lines of the cart and delete it."""
+        raise NotImplementedError
+
+class LocMemGuestCartBackend(BaseGuestCartBackend):
+    """
+    Process-local carts (development and tests); not shared between workers.
+    """
+    lock = threading.Lock()
+    carts = {}  # token -> (expires at, {line_id: quantity})
+
+    def _cart(self, token, touch=False):
+        """Return the live lines of a cart; touch=True (writes) creates it and refreshes its TTL."""
+        now = time.monotonic()
+        expires, lines = self.carts.get(token, (now, {}))
+        if expires <= now:
+            self.carts.pop(token, None)
+            lines = {}
+        if touch:
+            self.carts[token] = (now + settings.ORDERS_GUEST_CART_TTL, lines)
+        return lines
+
+    def lines(self, token):
+        with self.lock:
+            return dict(self._cart(token))
+
+    def add(self, token, line, quantity):
+        with self.lock:
+            lines = self._cart(token, touch=True)
+            lines[line] = lines.get(line, 0) + quantity
+            return lines[line]
+
+    def set(self, token, line, quantity):
+        with self.lock:
+            self._cart(token, touch=True)[line] = quantity
+
+    def remove(self, token, line):
+        with self.lock:
+            lines = self._cart(token, touch=True)
+            return lines.pop(line, None) is not None
+
+    def pop(self, token):
+        with self.lock:
+            lines = self._cart(token)
+            self.carts.pop(token, None)
+            return lines
+
+class RedisGuestCartBackend(BaseGuestCartBackend):
+    """
+    Redis hashes ('guest_cart:<token>'); each write runs in one MULTI with the EXPIRE.
+    """
+    def __init__(self):
+        self.client = redis.Redis.from_url(settings.ORDERS_GUEST_CART_REDIS_URL)
+        self.ttl = settings.ORDERS_GUEST_CART_TTL
+
+    def key(self, token):
+        return f'guest_cart:{token}'
+
+    def lines(self, token):
+        return {line.decode(): int(quantity) for line, quantity in self.client.hgetall(self.key(token)).items()}
+
+    def add(self, token, line, quantity):
+        pipe = self.client.pipeline()
+        pipe.hincrby(self.key(token), line, quantity)
+        pipe.expire(self.key(token), self.ttl)
+        return pipe.execute()[0]
+
+    def set(self, token, line, quantity):
+        pipe = self.client.pipeline()
+        pipe.hset(self.key(token), line, quantity)
+        pipe.expire(self.key(token), self.ttl)
+        pipe.execute()
+
+    def remove(self, token, line):
+        pipe = self.client.pipeline()
+        pipe.hdel(self.key(token), line)
+        pipe.expire(self.key(token), self.ttl)
+        return bool(pipe.execute()[0])
+
+    def pop(self, token):
+        pipe = self.client.pipeline()
+        pipe.hgetall(self.key(token))
+        pipe.delete(self.key(token))
+        lines = pipe.execute()[0]
+        return {line.decode(): int(quantity) for line, quantity in lines.items()}
+
+def get_guest_cart_backend():
+    """Return the configured guest cart backend instance."""
+    return import_string(settings.ORDERS_GUEST_CART_BACKEND)()
+
+def merge_guest_cart(token, user, backend=None):
+    """
+    Move the guest cart of token into the user's Cart: quantities are added to
+    matching lines, other lines are inserted. Lines of deleted products or sizes are dropped.
+    Returns the number of merged lines.
+    """
+    if not token:
+        return 0
+    backend = backend or get_guest_cart_backend()
+    lines = backend.pop(token)
+    try:
+        return _merge_lines(lines, user)
+    except Exception:
+        for line, quantity in lines.items():  # Give the lines back, so the shopper keeps them
+            backend.add(token, line, quantity)
+        raise
+
+def _merge_lines(lines, user):
+    quantities = {}
+    for line, quantity in lines.items():
+        key = parse_line_id(line)
+        if key and quantity > 0:
+            quantities[key] = quantities.get(key, 0) + quantity
+    existing_products = set(Product.objects.filter(pk__in={product_id for product_id, _ in quantities}).values_list('pk', flat=True))
+    existing_sizes = set(Size.objects.filter(pk__in={size_id for _, size_id in quantities if size_id}).values_list('pk', flat=True))
+    quantities = {
+        (product_id, size_id): quantity for (product_id, size_id), quantity in quantities.items()
+        if product_id in existing_products and (size_id is None or size_id in existing_sizes)
+    }
+    if not quantities:
+        return 0
+    with transaction.atomic():
+        cart = Cart.objects.get_or_create(user=user)[0]
+        CartItem.objects.upsert_lines(cart.id, quantities)
+        invalidate_cart_pricing(cart.id)  # The upsert sends no CartItem signals
+    return len(quantities)
@@ -0,0 +1,91 @@
+"""
+Idempotency-Key support for order-mutating endpoints.
+
+A client that retries a POST (e.g. checkout after a timeout) sends the same
+Idempotency-Key header; the first response is stored in the shared cache
+under the user and key, and retries get it back with one cache read instead
+of running the view (and its transaction) again. Replayed responses carry
+Idempotent-Replayed: true. A retry that arrives while the first request is
+still running gets 409 (the key is locked with an atomic cache.add), and a
+key reused for a different request (method, path or body) gets 422.
+Requests without the header are not affected.
+"""
+import hashlib
+import json
+from functools import wraps
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse, JsonResponse
+from django.http.request import RawPostDataException
+from rest_framework.request import Request
+from rest_framework.response import Response
+
+HEADER = 'Idempotency-Key'
+RESPONSE_KEY = 'idempotency_{}_{}'  # user id, key digest
+LOCK_KEY = 'idempotency_lock_{}_{}'  # user id, key digest
+LOCK_TIMEOUT = 60  # Longest a request may hold its key
+MAX_KEY_LENGTH = 255
+
+def _body(request):
+    """Request payload for the fingerprint (DRF may have consumed the raw body already)."""
+    if isinstance(request, Request):
+        return json.dumps(request.data, sort_keys=True, default=str).encode()
+    try:
+        return request.body
+    except RawPostDataException:
+        return request.POST.urlencode().encode()
+
+def _error(request, message, code):
+    if isinstance(request, Request):
+        return Response({'error': message}, status=code)
+    return JsonResponse({'error': message}, status=code)
+
+def _replay(stored):
+    if 'data' in stored:
+        response = Response(stored['data'], status=stored['status'])
+    else:
+        response = HttpResponse(stored['content'], status=stored['status'], content_type=stored['content_type'])
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+def _stored(response):
+    """Cacheable form of a response (DRF responses keep their data, so replays are rendered per request)."""
+    if isinstance(response, Response):
+        return {'status': response.status_code, 'data': response.data}
+    return {'status': response.status_code, 'content': response.content, 'content_type': response['Content-Type']}
+
+def idempotent(view):
+    """
+    Decorator honoring the Idempotency-Key header on a view function or view
+    method (DRF or plain Django); apply it below @action/@api_view so the user
+    is authenticated.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        request = args[0] if hasattr(args[0], 'META') else args[1]
+        key = request.META.get('HTTP_IDEMPOTENCY_KEY')
+        if not key:
+            return view(*args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            return _error(request, f'{HEADER} must be at most {MAX_KEY_LENGTH} characters.', 400)
+        digest = hashlib.sha1(key.encode()).hexdigest()
+        user_id = request.user.pk
+        fingerprint = hashlib.sha1(b'|'.join([request.method.encode(), request.get_full_path().encode(), _body(request)])).hexdigest()
+        response_key = RESPONSE_KEY.format(user_id, digest)
+        stored = cache.get(response_key)
+        if stored is None:
+            lock_key = LOCK_KEY.format(user_id, digest)
+            if not cache.add(lock_key, True, LOCK_TIMEOUT):
+                return _error(request, f'A request with this {HEADER} is still in progress.', 409)
+            try:
+                stored = cache.get(response_key)  # Finished between the first read and the lock
+                if stored is None:
+                    response = view(*args, **kwargs)
+                    cache.set(response_key, {'fingerprint': fingerprint, **_stored(response)}, settings.ORDERS_IDEMPOTENCY_TTL)
+                    return response
+            finally:
+                cache.delete(lock_key)
+        if stored['fingerprint'] != fingerprint:
+            return _error(request, f'This {HEADER} was used for a different request.', 422)
+        return _replay(stored)
+    return wrapper
@@ -0,0 +1,90 @@
+"""
+Low stock admin digest.
+
+Stock changes only enqueue product ids (a few cache operations, no email):
+the queue lives in the shared cache as numbered slots (the tail is an
+atomic incr), and a product already waiting in the queue is not queued
+again. A slot is reserved (incr) before it is written, so a drain stops at
+a reserved slot that is not written yet and picks it up next time; a slot
+still missing then (its writer died) is skipped.
+
+send_low_stock_digest() (the send_low_stock_digest command, run
+periodically) drains the queue and sends one email listing every variant
+(product size) of the queued products that dropped below
+LOW_STOCK_THRESHOLD, so one sold out size is not hidden by the stock of
+the others. A variant is reported once until it is restocked; the notified
+flags are cache keys too, so deduplication works across workers.
+"""
+from django.core.cache import cache
+from django.core.mail import mail_admins
+from django.db.models import Prefetch
+from store.models import Product, ProductVariant
+from store.stock import LOW_STOCK_THRESHOLD, stock_variants
+
+LOW_STOCK_CACHE_KEY = 'notified_low_stock_{}_{}'  # product id, size id or 0
+QUEUED_KEY = 'low_stock_queued_{}'  # product id
+SLOT_KEY = 'low_stock_queue_{}'  # slot number
+HEAD_KEY = 'low_stock_queue_head'  # Last drained slot
+TAIL_KEY = 'low_stock_queue_tail'  # Last reserved slot
+MISSING_KEY = 'low_stock_queue_missing'  # Unwritten slot the last drain stopped at
+NOTIFIED_TIMEOUT = 60 * 60 * 24  # 24h, or until restocked
+QUEUE_TIMEOUT = 60 * 60 * 24  # Slots older than this are dropped
+
+def enqueue_low_stock_check(product_ids):
+    """Queue product ids for the next digest (once per product until drained)."""
+    for product_id in product_ids:
+        if cache.add(QUEUED_KEY.format(product_id), True, QUEUE_TIMEOUT):
+            try:
+                cache.add(TAIL_KEY, 0, None)
+                cache.set(SLOT_KEY.format(cache.incr(TAIL_KEY)), product_id, QUEUE_TIMEOUT)
+            except Exception:
+                cache.delete(QUEUED_KEY.format(product_id))  # Not queued: let the next change queue it
+                raise
+
+def drain_queue():
+    """Return the queued product ids and empty the queue up to the first slot still being written."""
+    head = cache.get(HEAD_KEY, 0)
+    tail = cache.get(TAIL_KEY, 0)
+    if tail <= head:
+        return []
+    values = cache.get_many([SLOT_KEY.format(slot) for slot in range(head + 1, tail + 1)])
+    missing = cache.get(MISSING_KEY)
+    drained = head
+    for slot in range(head + 1, tail + 1):
+        if SLOT_KEY.format(slot) not in values and slot != missing:
+            cache.set(MISSING_KEY, slot, QUEUE_TIMEOUT)  # Skipped if still missing at the next drain
+            break
+        drained = slot
+    slots = [SLOT_KEY.format(slot) for slot in range(head + 1, drained + 1)]
+    product_ids = {values[slot] for slot in slots if slot in values}
+    cache.set(HEAD_KEY, drained, None)
+    cache.delete_many(slots + [QUEUED_KEY.format(product_id) for product_id in product_ids])
+    return sorted(product_ids)
+
+def send_low_stock_digest():
+    """
+    Send one admin email for the variants of the queued products that are low
+    in stock and were not reported yet; clear the flags of restocked ones.
+    Returns the variants listed in the email.
+    """
+    product_ids = drain_queue()
+    if not product_ids:
+        return []
+    low = []
+    products = Product.objects.filter(pk__in=product_ids).only('id', 'name', 'stock').prefetch_related(
+        Prefetch('variants', queryset=ProductVariant.objects.select_related('size')),
+    )
+    for product in products:
+        for variant in stock_variants(product):
+            cache_key = LOW_STOCK_CACHE_KEY.format(product.id, variant.size_id or 0)
+            if variant.stock >= LOW_STOCK_THRESHOLD:
+                cache.delete(cache_key)  # Restocked: report again next time it runs low
+            elif cache.add(cache_key, True, NOTIFIED_TIMEOUT):
+                low.append(variant)
+    low.sort(key=lambda variant: (variant.stock, str(variant)))
+    if low:
+        subject = f"[YD Bloom] Low Stock Alert: {len(low)} product{'s' if len(low) != 1 else ''}"
+        lines = [f"- {variant} (ID: {variant.product_id}): {variant.stock} left" for variant in low]
+        message = f"These products are low in stock (below {LOW_STOCK_THRESHOLD}):\n" + '\n'.join(lines) + "\nPlease restock soon."
+        mail_admins(subject, message, fail_silently=True)
+    return low
@@ -0,0 +1,98 @@
+import random
+import statistics
+import time
+from urllib.parse import parse_qs, urlsplit
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIRequestFactory, force_authenticate
+from orders.models import Order, OrderItem
+from orders.views import OrderViewSet
+from store.models import Category, Product, ProductImage, Review, Size
+
+class Rollback(Exception):
+    pass
+
+class Command(BaseCommand):
+    help = 'Compare order history (item snapshots) against the full nested order list for a customer with many orders.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=500, help='Orders of the synthetic customer')
+        parser.add_argument('--items', type=int, default=3, help='Items per order')
+        parser.add_argument('--products', type=int, default=300, help='Distinct products bought')
+        parser.add_argument('--reviews', type=int, default=20, help='Reviews per product')
+        parser.add_argument('--repeat', type=int, default=3, help='Timed runs per representation')
+        parser.add_argument('--keep', action='store_true', help='Keep the synthetic data instead of rolling back')
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                user = self.generate(options)
+                self.run_benchmark(user, options['repeat'])
+                if not options['keep']:
+                    raise Rollback
+        except Rollback:
+            self.stdout.write('Synthetic orders rolled back.')
+
+    def generate(self, options):
+        rng = random.Random(42)
+        User = get_user_model()
+        self.stdout.write(f"Generating {options['orders']} orders of {options['items']} items...")
+        customer = User.objects.create_user('benchmark-customer', 'benchmark@example.com')
+        reviewers = User.objects.bulk_create([User(username=f'benchmark-reviewer-{i}') for i in range(options['reviews'])])
+        category = Category.objects.create(name='Benchmark')
+        size = Size.objects.get_or_create(name='M')[0]
+        products = Product.objects.bulk_create([
+            Product(name=f'Benchmark product {i}', description='Lorem ipsum ' * 40, price=rng.randint(5, 100), category=category)
+            for i in range(options['products'])
+        ])
+        ProductImage.objects.bulk_create([ProductImage(product=product, image=f'products/benchmark-{product.pk}.jpg') for product in products])
+        Review.objects.bulk_create([
+            Review(product=product, user=reviewer, rating=rng.randint(1, 5), review='Great product, would buy again. ' * 5)
+            for product in products for reviewer in reviewers
+        ])
+        orders = Order.objects.bulk_create([Order(user=customer, total=0, status='delivered') for _ in range(options['orders'])])
+        items = []
+        for order in orders:
+            for product in rng.sample(products, options['items']):
+                items.append(OrderItem(order=order, product=product, size=size, quantity=1, price=product.price, product_name=product.name, size_name=size.name, thumbnail=f'products/benchmark-{product.pk}.jpg'))
+        OrderItem.objects.bulk_create(items)
+        return customer
+
+    def measure(self, user, action, params, repeat):
+        """Page through all orders; returns (queries, bytes, median ms) for the whole walk."""
+        factory = APIRequestFactory()
+        view = OrderViewSet.as_view({'get': action})
+        def walk():
+            queries, size, cursor = 0, 0, None
+            while True:
+                request = factory.get('/api/orders/', {**params, **({'cursor': cursor} if cursor else {})})
+                force_authenticate(request, user=user)
+                with CaptureQueriesContext(connection) as captured:
+                    response = view(request)
+                    response.render()
+                queries += len(captured)
+                size += len(response.content)
+                if not response.data['next']:
+                    return queries, size
+                cursor = parse_qs(urlsplit(response.data['next']).query)['cursor'][0]
+        queries, size = walk()  # warm up
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            walk()
+            timings.append((time.perf_counter() - start) * 1000)
+        return queries, size, statistics.median(timings)
+
+    def run_benchmark(self, user, repeat):
+        runs = [
+            ('list (full products)', 'list', {'product_expand': 'category,sizes,images,reviews,variants,coupon,description'}),
+            ('list (compact products)', 'list', {}),
+            ('history (snapshots)', 'history', {}),
+            ('history ?item_expand=product', 'history', {'item_expand': 'product'}),
+        ]
+        self.stdout.write(f'{"representation":<32}{"queries":>10}{"KiB":>10}{"ms":>10}')
+        for label, action, params in runs:
+            queries, size, ms = self.measure(user, action, params, repeat)
+            self.stdout.write(f'{label:<32}{queries:>10}{size / 1024:>10.0f}{ms:>10.0f}')
@@ -0,0 +1,21 @@
+import time
+from django.core.management.base import BaseCommand
+from orders.webhooks import process_stripe_events
+
+class Command(BaseCommand):
+    help = (
+        'Process the Stripe webhook events stored by the webhook endpoint (order status, notifications). '
+        'Run as a worker with --interval; several workers may run side by side.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100, help='Events handled per run.')
+        parser.add_argument('--interval', type=float, default=0, help='Keep processing every N seconds (0: process once).')
+
+    def handle(self, *args, **options):
+        while True:
+            processed = process_stripe_events(options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(f'Processed {processed} Stripe events.'))
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,20 @@
+import time
+from django.core.management.base import BaseCommand
+from orders.low_stock import send_low_stock_digest
+
+class Command(BaseCommand):
+    help = (
+        'Email admins one digest of the products that dropped below the low stock threshold since the last run. '
+        'Run periodically, e.g. every few minutes with --interval.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=0, help='Keep sending every N seconds (0: send once).')
+
+    def handle(self, *args, **options):
+        while True:
+            low = send_low_stock_digest()
+            self.stdout.write(self.style.SUCCESS(f'Low stock digest: {len(low)} products reported.'))
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
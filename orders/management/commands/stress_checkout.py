@@ -0,0 +1,89 @@
+import threading
+import time
+import uuid
+from collections import Counter
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connections
+from django.test.utils import override_settings
+from orders.models import Order, OrderItem
+from store.models import Category, Product
+from store.hot_stock import flush_journal
+from store.stock import InsufficientStock
+
+class Command(BaseCommand):
+    help = (
+        'Stress test stock reservation: pay many orders for one product from concurrent threads, '
+        'check that stock is never oversold and report orders/sec. Test rows are deleted afterwards.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8, help='Concurrent checkout threads.')
+        parser.add_argument('--orders', type=int, default=200, help='Orders competing for the product.')
+        parser.add_argument('--stock', type=int, default=50, help='Initial product stock.')
+        parser.add_argument('--quantity', type=int, default=1, help='Units per order.')
+        parser.add_argument('--hot', action='store_true', help='Flag the product hot_stock (flash sale counters, see store.hot_stock).')
+
+    def handle(self, *args, **options):
+        quantity, stock = options['quantity'], options['stock']
+        category, _ = Category.objects.get_or_create(name='Stress test')
+        product = Product.objects.create(
+            name=f'Stress test {uuid.uuid4().hex[:8]}', category=category, price=1, stock=stock, hot_stock=options['hot'],
+        )
+        user = User.objects.create_user(f'stress-{uuid.uuid4().hex[:12]}')
+        orders = Order.objects.bulk_create([Order(user=user, total=quantity) for _ in range(options['orders'])])
+        OrderItem.objects.bulk_create([OrderItem(order=order, product=product, quantity=quantity, price=1) for order in orders])
+        results = Counter()
+        results_lock = threading.Lock()
+
+        def checkout(batch):
+            try:
+                for order in batch:
+                    while True:
+                        try:
+                            order.transition_status('paid')
+                            outcome = 'paid'
+                        except InsufficientStock:
+                            outcome = 'sold_out'
+                        except OperationalError:
+                            # SQLite reports write contention as "database is locked"; PostgreSQL waits on the row lock
+                            with results_lock:
+                                results['lock_retries'] += 1
+                            time.sleep(0.001)
+                            continue
+                        with results_lock:
+                            results[outcome] += 1
+                        break
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=checkout, args=(orders[i::options['threads']],)) for i in range(options['threads'])]
+        # Order status emails go nowhere during the run
+        with override_settings(EMAIL_BACKEND='django.core.mail.backends.dummy.EmailBackend'):
+            started = time.monotonic()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.monotonic() - started
+
+        if options['hot']:
+            flush_journal()
+        product.refresh_from_db()
+        paid = Order.objects.filter(pk__in=[order.pk for order in orders], status='paid').count()
+        expected_paid = min(options['orders'], stock // quantity)
+        consistent = paid == results['paid'] == expected_paid and product.stock == stock - paid * quantity
+        Order.objects.filter(pk__in=[order.pk for order in orders]).delete()
+        user.delete()
+        product.delete()
+        if options['hot']:
+            flush_journal()  # Releases the deleted product's counters
+
+        self.stdout.write(
+            f"{results['paid']} paid, {results['sold_out']} sold out, {results['lock_retries']} lock retries, "
+            f"stock left {product.stock} in {elapsed:.2f}s ({len(orders) / elapsed:.0f} orders/s, "
+            f"{options['threads']} threads, {'hot counters' if options['hot'] else 'database'} stock)"
+        )
+        if not consistent:
+            raise CommandError(f'Stock inconsistency: {paid} orders paid for {stock} units (stock left {product.stock}).')
+        self.stdout.write(self.style.SUCCESS('No overselling.'))
@@ -0,0 +1,50 @@
+# Generated by Django 5.2.4 on 2026-10-17 08:12
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def snapshot_existing_items(apps, schema_editor):
+    # Existing items take the current product name, size and first image thumbnail
+    OrderItem = apps.get_model('orders', 'OrderItem')
+    Product = apps.get_model('store', 'Product')
+    Size = apps.get_model('store', 'Size')
+    ProductImage = apps.get_model('store', 'ProductImage')
+    OrderItem.objects.update(
+        product_name=Subquery(Product.objects.filter(pk=OuterRef('product_id')).values('name')[:1]),
+        size_name=Coalesce(Subquery(Size.objects.filter(pk=OuterRef('size_id')).values('name')[:1]), Value('')),
+    )
+    first_images = {}
+    for image in ProductImage.objects.filter(product__in=OrderItem.objects.values('product_id')).order_by('product_id', 'id').iterator():
+        first_images.setdefault(image.product_id, image)
+    for product_id, image in first_images.items():
+        rendition = image.derivatives.get('thumbnail') if image.derivatives_source == image.image.name else None
+        OrderItem.objects.filter(product_id=product_id).update(thumbnail=rendition['jpeg'] if rendition else image.image.name)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0006_stripeevent'),
+        ('store', '0010_hotstockflush_product_hot_stock'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orderitem',
+            name='product_name',
+            field=models.CharField(blank=True, max_length=200),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='size_name',
+            field=models.CharField(blank=True, max_length=20),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='thumbnail',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.RunPython(snapshot_existing_items, migrations.RunPython.noop),
+    ]
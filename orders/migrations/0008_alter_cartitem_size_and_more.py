@@ -0,0 +1,42 @@
+# Generated by Django 5.2.4 on 2026-10-17 08:27
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+def merge_duplicate_lines(apps, schema_editor):
+    # Duplicate lines of a product and size are merged into the oldest one
+    CartItem = apps.get_model('orders', 'CartItem')
+    duplicates = CartItem.objects.values('cart_id', 'product_id', 'size_id').annotate(
+        lines=Count('id'), first=Min('id'), total=Sum('quantity'),
+    ).filter(lines__gt=1).order_by()
+    for line in duplicates:
+        same = CartItem.objects.filter(cart_id=line['cart_id'], product_id=line['product_id'], size_id=line['size_id'])
+        same.filter(id=line['first']).update(quantity=line['total'])
+        same.exclude(id=line['first']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0007_orderitem_product_name_orderitem_size_name_and_more'),
+        ('store', '0010_hotstockflush_product_hot_stock'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_lines, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='cartitem',
+            name='size',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='store.size'),
+        ),
+        migrations.AddConstraint(
+            model_name='cartitem',
+            constraint=models.UniqueConstraint(condition=models.Q(('size__isnull', False)), fields=('cart', 'product', 'size'), name='cart_item_sized_line_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='cartitem',
+            constraint=models.UniqueConstraint(condition=models.Q(('size__isnull', True)), fields=('cart', 'product'), name='cart_item_unsized_line_uniq'),
+        ),
+    ]
@@ -1,6 +1,9 @@
-from django.db import models
+import uuid
+from django.db import connections, models
 from django.contrib.auth.models import User
+from django.db.models import Sum
 from store.models import Product, Size
+from store.stock import reserve_stock, release_stock, release_hot_stock
 from django.db import transaction
 
 class Order(models.Model):
@@ -21,40 +24,123 @@ class Order(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)  # When the order was created
     updated_at = models.DateTimeField(auto_now=True)      # When the order was last updated
 
+    class Meta:
+        indexes = [
+            # Keyset pagination of order history (see store.pagination)
+            models.Index(fields=['user', 'created_at', 'id'], name='order_user_created_idx'),
+            models.Index(fields=['created_at', 'id'], name='order_created_idx'),
+        ]
+
     def __str__(self):
         return f"Order {self.id} by {self.user.username}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.saved_status = instance.__dict__.get('status')  # Status changes are published on save (see orders.signals)
+        return instance
+
+    # Valid status transitions: current status -> allowed new statuses
+    TRANSITIONS = {
+        'pending': ['paid', 'cancelled'],
+        'paid': ['shipped', 'cancelled'],
+        'shipped': ['delivered'],
+        'delivered': [],
+        'cancelled': [],
+    }
+
     def can_transition(self, new_status):
         """Return True if transition from current status to new_status is valid."""
-        valid = {
-            'pending': ['paid', 'cancelled'],
-            'paid': ['shipped', 'cancelled'],
-            'shipped': ['delivered'],
-            'delivered': [],
-            'cancelled': [],
-        }
-        return new_status in valid[self.status]
-
-    @transaction.atomic
+        return new_status in self.TRANSITIONS[self.status]
+
+    def item_quantities(self):
+        """Return {(product_id, size_id): total quantity} for the items of this order."""
+        rows = self.items.values('product_id', 'size_id').annotate(total=Sum('quantity')).order_by('product_id', 'size_id')
+        return {(row['product_id'], row['size_id']): row['total'] for row in rows}
+
     def transition_status(self, new_status):
-        """Transition to new_status if valid, update stock if needed."""
-        if not self.can_transition(new_status):
-            raise ValueError(f"Invalid status transition: {self.status} → {new_status}")
-        # On payment, decrement stock
-        if self.status == 'pending' and new_status == 'paid':
-            for item in self.items.select_related('product'):
-                if item.product.stock < item.quantity:
-                    raise ValueError(f"Not enough stock for {item.product.name}")
-            for item in self.items.select_related('product'):
-                item.product.stock -= item.quantity
-                item.product.save()
-        # On cancellation, restock if previously paid
-        if self.status in ['paid', 'shipped'] and new_status == 'cancelled':
-            for item in self.items.select_related('product'):
-                item.product.stock += item.quantity
-                item.product.save()
-        self.status = new_status
-        self.save()
+        """
+        Transition to new_status if valid, update stock if needed.
+        The order row is locked so concurrent transitions of the same order
+        cannot both move stock; stock itself is changed with conditional UPDATEs
+        (see store.stock). Flash sale (hot stock) units taken for a payment
+        that does not commit are given back, so call this outside of an
+        enclosing transaction.
+        """
+        reserved, committed = None, []
+        try:
+            with transaction.atomic():
+                # Registered first, so it runs before any hook that could raise after the commit
+                transaction.on_commit(lambda: committed.append(True))
+                self.status = self.saved_status = Order.objects.select_for_update().values_list('status', flat=True).get(pk=self.pk)
+                if not self.can_transition(new_status):
+                    raise ValueError(f"Invalid status transition: {self.status} → {new_status}")
+                # On payment, decrement stock
+                if self.status == 'pending' and new_status == 'paid':
+                    reserved = reserve_stock(self.item_quantities())
+                # On cancellation, restock if previously paid
+                if self.status in ['paid', 'shipped'] and new_status == 'cancelled':
+                    release_stock(self.item_quantities())
+                self.status = new_status
+                self.save(update_fields=['status', 'updated_at'])
+        except Exception:
+            if reserved and not committed:
+                release_hot_stock(reserved)
+            raise
+
+class PaymentAttempt(models.Model):
+    """
+    One try at creating the Stripe PaymentIntent of an order (see orders.payments).
+    Recorded before Stripe is called, so a failed or interrupted call can be retried.
+    """
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),      # Saved, Stripe not reached yet
+        ('created', 'Created'),      # PaymentIntent created, waiting for the customer
+        ('succeeded', 'Succeeded'),  # Paid (Stripe webhook)
+        ('failed', 'Failed'),        # Stripe call failed; retry with a new attempt
+    ]
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='payment_attempts')  # Paid order
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')  # Attempt status
+    idempotency_key = models.CharField(max_length=64, unique=True, default=uuid.uuid4)  # Sent to Stripe, so retried calls create one PaymentIntent
+    payment_intent_id = models.CharField(max_length=255, blank=True, db_index=True)  # Stripe PaymentIntent id
+    tries = models.PositiveIntegerField(default=0)  # Stripe calls made
+    last_error = models.TextField(blank=True)  # Last Stripe error
+    created_at = models.DateTimeField(auto_now_add=True)  # When the attempt was created
+    updated_at = models.DateTimeField(auto_now=True)      # When the attempt was last updated
+
+    def __str__(self):
+        return f"Payment attempt {self.id} for order {self.order_id} ({self.status})"
+
+class StripeEvent(models.Model):
+    """
+    Inbox of verified Stripe webhook events, processed by the
+    process_stripe_events worker (see orders.webhooks).
+    """
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),      # Waiting for (another) processing try
+        ('processed', 'Processed'),  # Handled
+        ('failed', 'Failed'),        # Gave up; see last_error
+    ]
+    event_id = models.CharField(max_length=255, unique=True)  # Stripe event id: redeliveries are stored once
+    type = models.CharField(max_length=100)  # Stripe event type, e.g. payment_intent.succeeded
+    payload = models.JSONField()  # Verified event
+    order_id = models.PositiveIntegerField(null=True, blank=True)  # Order from the metadata; events of one order are processed in order
+    stripe_created = models.PositiveBigIntegerField()  # Stripe creation time (unix seconds)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')  # Processing status
+    attempts = models.PositiveIntegerField(default=0)  # Processing tries
+    last_error = models.TextField(blank=True)  # Last processing error
+    next_attempt_at = models.DateTimeField(auto_now_add=True)  # Not processed before this time (retry backoff, or the lease of the worker handling it)
+    received_at = models.DateTimeField(auto_now_add=True)  # When the webhook arrived
+    processed_at = models.DateTimeField(null=True, blank=True)  # When the event was handled
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='stripe_event_due_idx'),
+            models.Index(fields=['order_id', 'stripe_created', 'id'], name='stripe_event_order_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.type} {self.event_id} ({self.status})"
 
 class OrderItem(models.Model):
     """
@@ -66,10 +152,32 @@ class OrderItem(models.Model):
     size = models.ForeignKey(Size, on_delete=models.SET_NULL, null=True, blank=True)  # Size (if applicable)
     quantity = models.PositiveIntegerField(default=1)  # Quantity ordered
     price = models.DecimalField(max_digits=10, decimal_places=2)  # Price per item at order time
+    product_name = models.CharField(max_length=200, blank=True)  # Product name at order time
+    size_name = models.CharField(max_length=20, blank=True)  # Size name at order time
+    thumbnail = models.CharField(max_length=255, blank=True)  # Storage name of the product thumbnail at order time
 
     def __str__(self):
         return f"{self.quantity} x {self.product.name}"
 
+    def save(self, *args, **kwargs):
+        if not self.product_name:
+            for field, value in item_snapshot(self.product, self.size).items():
+                setattr(self, field, value)
+        super().save(*args, **kwargs)
+
+def item_snapshot(product, size):
+    """
+    Return the OrderItem snapshot fields (name, size, thumbnail) for product and size,
+    so order history renders without loading products (prefetch product images when
+    snapshotting many items).
+    """
+    images = product.images.all()
+    thumbnail = ''
+    if images:
+        rendition = images[0].derivatives.get('thumbnail') if not images[0].derivatives_pending else None
+        thumbnail = rendition['jpeg'] if rendition else images[0].image.name
+    return {'product_name': product.name, 'size_name': size.name if size else '', 'thumbnail': thumbnail}
+
 class Cart(models.Model):
     """
     Shopping cart for a user (one per user).
@@ -80,15 +188,46 @@ class Cart(models.Model):
     def __str__(self):
         return f"Cart for {self.user.username}"
 
+class CartItemQuerySet(models.QuerySet):
+    def upsert_lines(self, cart_id, quantities, increment=True):
+        """
+        Write the lines {(product_id, size_id): quantity} of a cart with one
+        INSERT ... ON CONFLICT DO UPDATE per kind of line (sized and unsized lines
+        have separate unique constraints). increment=True adds to the quantities of
+        existing lines, False replaces them. Sends no signals.
+        """
+        connection = connections[self.db]
+        table = connection.ops.quote_name(self.model._meta.db_table)
+        new_quantity = f'{table}.quantity + excluded.quantity' if increment else 'excluded.quantity'
+        targets = {True: '(cart_id, product_id, size_id) WHERE size_id IS NOT NULL', False: '(cart_id, product_id) WHERE size_id IS NULL'}
+        with connection.cursor() as cursor:
+            for sized, target in targets.items():
+                rows = [(cart_id, product_id, size_id, quantity) for (product_id, size_id), quantity in quantities.items() if (size_id is not None) == sized]
+                if rows:
+                    cursor.execute(
+                        f'INSERT INTO {table} (cart_id, product_id, size_id, quantity) VALUES {", ".join(["(%s, %s, %s, %s)"] * len(rows))} '
+                        f'ON CONFLICT {target} DO UPDATE SET quantity = {new_quantity}',
+                        [value for row in rows for value in row],
+                    )
+
 class CartItem(models.Model):
     """
     Represents a single item in a user's cart.
-    Links to product, size, and quantity.
+    Links to product, size, and quantity; a cart has one line per product and size.
     """
     cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name='items')  # Parent cart
     product = models.ForeignKey(Product, on_delete=models.CASCADE)  # Product in cart
-    size = models.ForeignKey(Size, on_delete=models.SET_NULL, null=True, blank=True)  # Size (if applicable)
+    size = models.ForeignKey(Size, on_delete=models.CASCADE, null=True, blank=True)  # Size (if applicable)
     quantity = models.PositiveIntegerField(default=1)  # Quantity in cart
 
+    objects = CartItemQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            # One line per product and size; NULL sizes are distinct in SQL, so unsized lines get their own constraint
+            models.UniqueConstraint(fields=['cart', 'product', 'size'], condition=models.Q(size__isnull=False), name='cart_item_sized_line_uniq'),
+            models.UniqueConstraint(fields=['cart', 'product'], condition=models.Q(size__isnull=True), name='cart_item_unsized_line_uniq'),
+        ]
+
     def __str__(self):
         return f"{self.quantity} x {self.product.name} in cart"
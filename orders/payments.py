@@ -0,0 +1,66 @@
+"""
+Stripe PaymentIntent creation for checkout.
+
+Checkout commits the order and a PaymentAttempt first, then calls Stripe
+after the commit, so no database transaction (or row lock) is held during
+the network round trip. Each attempt sends its own idempotency key: transient
+errors (network, rate limit, Stripe 5xx) are retried with backoff without
+ever creating a second PaymentIntent, and a failed attempt leaves the order
+pending so the customer can retry (POST /api/orders/orders/<id>/retry-payment/).
+
+The Stripe host is settings.STRIPE_API_BASE, so tests and local runs can use
+stripe-mock (or any stand-in serving /v1/payment_intents).
+"""
+import time
+import stripe
+from django.conf import settings
+from .models import PaymentAttempt
+
+TRANSIENT_ERRORS = (stripe.APIConnectionError, stripe.RateLimitError, stripe.APIError)
+
+def stripe_client():
+    """Return a Stripe client for the configured key and API host (retries are done by create_payment_intent)."""
+    return stripe.StripeClient(
+        settings.STRIPE_SECRET_KEY,
+        base_addresses={'api': settings.STRIPE_API_BASE},
+        max_network_retries=0,
+    )
+
+def create_payment_intent(attempt, client=None):
+    """
+    Create the PaymentIntent of a pending attempt; must run outside of a transaction.
+    Returns the PaymentIntent, or None if the attempt failed (see attempt.last_error).
+    """
+    client = client or stripe_client()
+    order = attempt.order
+    params = {'amount': int(order.total * 100), 'currency': 'usd', 'metadata': {'order_id': str(order.id)}}
+    delay = settings.STRIPE_RETRY_DELAY
+    intent = None
+    while attempt.tries < settings.STRIPE_MAX_TRIES:
+        attempt.tries += 1
+        try:
+            intent = client.payment_intents.create(params=params, options={'idempotency_key': str(attempt.idempotency_key)})
+            break
+        except TRANSIENT_ERRORS as e:
+            attempt.last_error = str(e)
+            if attempt.tries < settings.STRIPE_MAX_TRIES:
+                time.sleep(delay)
+                delay *= 2
+        except stripe.StripeError as e:
+            attempt.last_error = str(e)
+            break
+    if intent is not None:
+        attempt.status, attempt.payment_intent_id, attempt.last_error = 'created', intent.id, ''
+    else:
+        attempt.status = 'failed'
+    attempt.save(update_fields=['status', 'payment_intent_id', 'tries', 'last_error', 'updated_at'])
+    return intent
+
+def retrieve_payment_intent(attempt, client=None):
+    """Return the PaymentIntent of a created attempt (e.g. to hand its client secret out again)."""
+    client = client or stripe_client()
+    return client.payment_intents.retrieve(attempt.payment_intent_id)
+
+def start_payment(order):
+    """Record a new payment attempt for order (inside the checkout transaction)."""
+    return PaymentAttempt.objects.create(order=order)
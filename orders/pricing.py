@@ -0,0 +1,92 @@
+"""
+Cart pricing summary (cart total, cart admin and checkout).
+
+The summary is computed in one aggregate query over the cart lines, with
+every line priced like Product.get_discounted_price() (discount applied,
+rounded to cents). It is cached per cart and invalidated by:
+
+- CartItem saves and deletes (orders.signals; bulk updates call
+  invalidate_cart_pricing() themselves);
+- product price or discount changes, which bump the pricing version the
+  cached entries are stamped with (store.cache.bump_pricing_version).
+
+The session coupon is applied on top of the cached line totals, since its
+validity depends on time and usage.
+"""
+from decimal import Decimal, ROUND_HALF_UP
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import DecimalField, ExpressionWrapper, F, Sum, Value
+from django.db.models.functions import Coalesce, Round
+from django.utils import timezone
+from store.cache import get_pricing_version
+from store.models import Coupon
+from .models import CartItem
+
+CART_PRICING_KEY = 'cart_pricing_{}'  # cart id
+CART_PRICING_TIMEOUT = 60 * 60
+MONEY = DecimalField(max_digits=12, decimal_places=2)
+CENT = Decimal('0.01')
+HUNDREDTH = Value(CENT)  # Multiplied rather than dividing by 100, which SQLite does in integers
+
+def pricing_aggregates(prefix=''):
+    """
+    Return the aggregate expressions of the summary over cart lines.
+    prefix is the path from the queried model to CartItem ('items__' from Cart).
+    """
+    quantity = F(f'{prefix}quantity')
+    price = F(f'{prefix}product__price')
+    unit_price = Round(ExpressionWrapper(price * (100 - F(f'{prefix}product__discount')) * HUNDREDTH, output_field=MONEY), 2)
+    return {
+        'item_count': Coalesce(Sum(quantity), 0),
+        'subtotal': Coalesce(Sum(ExpressionWrapper(price * quantity, output_field=MONEY)), Value(Decimal('0.00')), output_field=MONEY),
+        'items_total': Coalesce(Sum(ExpressionWrapper(unit_price * quantity, output_field=MONEY)), Value(Decimal('0.00')), output_field=MONEY),
+    }
+
+def _money(value):
+    return Decimal(value).quantize(CENT, rounding=ROUND_HALF_UP)
+
+def _line_totals(cart_id, refresh):
+    key = CART_PRICING_KEY.format(cart_id)
+    version = get_pricing_version()
+    cached = None if refresh else cache.get(key)
+    if cached is not None and cached['version'] == version:
+        return cached['totals']
+    totals = CartItem.objects.filter(cart_id=cart_id).aggregate(**pricing_aggregates())
+    totals = {'item_count': totals['item_count'], 'subtotal': _money(totals['subtotal']), 'items_total': _money(totals['items_total'])}
+    cache.set(key, {'version': version, 'totals': totals}, timeout=CART_PRICING_TIMEOUT)
+    return totals
+
+def invalidate_cart_pricing(cart_id):
+    """Drop the cached summary of a cart (now and again on commit, like store.cache)."""
+    key = CART_PRICING_KEY.format(cart_id)
+    cache.delete(key)
+    transaction.on_commit(lambda: cache.delete(key))
+
+def valid_coupon(code):
+    """Return the active, unexpired coupon with code that still has uses left, or None."""
+    if not code:
+        return None
+    coupon = Coupon.objects.filter(code=code, active=True).first()
+    if coupon is None or (coupon.expiry and coupon.expiry < timezone.now()):
+        return None
+    if coupon.usage_limit and coupon.used_count >= coupon.usage_limit:
+        return None
+    return coupon
+
+def cart_pricing(cart_id, coupon=None, refresh=False):
+    """
+    Return the pricing summary of a cart: item_count, subtotal (list prices),
+    discount (product discounts), coupon, coupon_discount and total.
+    refresh=True recomputes the line totals instead of reading the cache (checkout).
+    """
+    totals = _line_totals(cart_id, refresh)
+    coupon_discount = _money(totals['items_total'] * coupon.discount / 100) if coupon else Decimal('0.00')
+    return {
+        'item_count': totals['item_count'],
+        'subtotal': totals['subtotal'],
+        'discount': totals['subtotal'] - totals['items_total'],
+        'coupon': coupon.code if coupon else None,
+        'coupon_discount': coupon_discount,
+        'total': totals['items_total'] - coupon_discount,
+    }
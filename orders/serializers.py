@@ -1,13 +1,16 @@
+from django.core.files.storage import default_storage
 from rest_framework import serializers
 from .models import Order, OrderItem, Cart, CartItem
-from store.serializers import ProductSerializer, SizeSerializer
+from store.models import Product, Size
+from store.serializers import ProductListSerializer, SizeSerializer, DynamicFieldsMixin
 
-class OrderItemSerializer(serializers.ModelSerializer):
+class OrderItemSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     """
     Serializer for OrderItem model.
-    Includes product and size details, and supports write via product_id/size_id.
+    Includes compact product and size details, and supports write via product_id/size_id.
+    Product fields can be shaped with ?product_fields= and ?product_expand=.
     """
-    product = ProductSerializer(read_only=True)
+    product = ProductListSerializer(read_only=True, query_prefix='product_')
     product_id = serializers.PrimaryKeyRelatedField(queryset=OrderItem._meta.get_field('product').related_model.objects.all(), source='product', write_only=True)
     size = SizeSerializer(read_only=True)
     size_id = serializers.PrimaryKeyRelatedField(queryset=OrderItem._meta.get_field('size').related_model.objects.all(), source='size', write_only=True, allow_null=True, required=False)
@@ -19,20 +22,53 @@ class OrderItemSerializer(serializers.ModelSerializer):
 class OrderSerializer(serializers.ModelSerializer):
     """
     Serializer for Order model.
-    Includes nested order items.
+    Includes nested order items (shaped with ?item_fields=).
     """
-    items = OrderItemSerializer(many=True, read_only=True)
+    items = OrderItemSerializer(many=True, read_only=True, query_prefix='item_')
 
     class Meta:
         model = Order
         fields = ['id', 'user', 'status', 'total', 'created_at', 'updated_at', 'items']
 
-class CartItemSerializer(serializers.ModelSerializer):
+class OrderHistoryItemSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    """
+    Serializer for order items in order history.
+    Renders the snapshot taken at order time (name, size, thumbnail, price) without
+    loading products; ?item_expand=product adds the compact product.
+    """
+    product = ProductListSerializer(read_only=True, query_prefix='product_')
+    thumbnail = serializers.SerializerMethodField()  # Absolute URL of the thumbnail at order time
+
+    class Meta:
+        model = OrderItem
+        fields = ['id', 'product_id', 'product_name', 'size_name', 'thumbnail', 'quantity', 'price']
+        expandable_fields = ['product']
+
+    def get_thumbnail(self, obj):
+        if not obj.thumbnail:
+            return None
+        url = default_storage.url(obj.thumbnail)
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request else url
+
+class OrderHistorySerializer(serializers.ModelSerializer):
+    """
+    Serializer for Order model in order history and order details.
+    Includes the item snapshots (shaped with ?item_fields= and ?item_expand=).
+    """
+    items = OrderHistoryItemSerializer(many=True, read_only=True, query_prefix='item_')
+
+    class Meta:
+        model = Order
+        fields = ['id', 'status', 'total', 'created_at', 'updated_at', 'items']
+
+class CartItemSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     """
     Serializer for CartItem model.
-    Includes product and size details, and supports write via product_id/size_id.
+    Includes compact product and size details, and supports write via product_id/size_id.
+    Product fields can be shaped with ?product_fields= and ?product_expand=.
     """
-    product = ProductSerializer(read_only=True)
+    product = ProductListSerializer(read_only=True, query_prefix='product_')
     product_id = serializers.PrimaryKeyRelatedField(queryset=CartItem._meta.get_field('product').related_model.objects.all(), source='product', write_only=True)
     size = SizeSerializer(read_only=True)
     size_id = serializers.PrimaryKeyRelatedField(queryset=CartItem._meta.get_field('size').related_model.objects.all(), source='size', write_only=True, allow_null=True, required=False)
@@ -40,14 +76,44 @@ class CartItemSerializer(serializers.ModelSerializer):
     class Meta:
         model = CartItem
         fields = ['id', 'cart', 'product', 'product_id', 'size', 'size_id', 'quantity']
+        validators = []  # Adding an existing line adds to it (see CartItemViewSet.create)
+
+    def validate(self, attrs):
+        # A line is keyed by cart, product and size: moving it could collide with another line
+        if self.instance is not None:
+            changed = [name for name, field in [('cart', 'cart'), ('product_id', 'product'), ('size_id', 'size')] if field in attrs and attrs[field] != getattr(self.instance, field)]
+            if changed:
+                raise serializers.ValidationError({name: 'A cart item only changes its quantity; add a new item instead.' for name in changed})
+        return attrs
+
+class CartLineSerializer(serializers.Serializer):
+    """
+    Serializer for one line of a set-lines request (quantity 0 removes the line).
+    Product and size ids are checked in bulk by the view.
+    """
+    product_id = serializers.IntegerField()
+    size_id = serializers.IntegerField(allow_null=True, required=False)
+    quantity = serializers.IntegerField(min_value=0)
 
 class CartSerializer(serializers.ModelSerializer):
     """
     Serializer for Cart model.
-    Includes nested cart items.
+    Includes nested cart items (shaped with ?item_fields=).
     """
-    items = CartItemSerializer(many=True, read_only=True)
+    items = CartItemSerializer(many=True, read_only=True, query_prefix='item_')
 
     class Meta:
         model = Cart
-        fields = ['id', 'user', 'created_at', 'items'] 
\ No newline at end of file
+        fields = ['id', 'user', 'created_at', 'items'] 
+
+class GuestCartItemSerializer(serializers.Serializer):
+    """
+    Serializer for the lines of a guest cart (orders.guest_cart.GuestCartItem),
+    in the shape of CartItemSerializer. The id is '<product id>-<size id or 0>'.
+    """
+    id = serializers.CharField(read_only=True)
+    product = ProductListSerializer(read_only=True, query_prefix='product_')
+    product_id = serializers.PrimaryKeyRelatedField(queryset=Product.objects.all(), source='product', write_only=True)
+    size = SizeSerializer(read_only=True)
+    size_id = serializers.PrimaryKeyRelatedField(queryset=Size.objects.all(), source='size', write_only=True, allow_null=True, required=False)
+    quantity = serializers.IntegerField(min_value=1, default=1)
@@ -5,13 +5,29 @@ from django.db.models.signals import post_save
 from django.dispatch import receiver
 from django.core.mail import send_mail
 from django.conf import settings
-from .models import Order
+from django.db.models.signals import post_delete
+from django.utils import timezone
+from .models import CartItem, Order, OrderItem
 from django.core.mail import mail_admins
+from django.db import transaction
 from store.models import Product
-from django.core.cache import cache
+from store.stock import stock_changed
+from .events import publish_status_changes
+from .low_stock import enqueue_low_stock_check
+from .pricing import invalidate_cart_pricing
 
-LOW_STOCK_THRESHOLD = 5
-LOW_STOCK_CACHE_KEY = 'notified_low_stock_{}'  # product id
+STATUS_EMAIL_MESSAGES = {
+    'paid': "Your order #{id} has been paid. We will ship it soon.",
+    'shipped': "Your order #{id} has been shipped!",
+    'delivered': "Your order #{id} has been delivered. Enjoy!",
+    'cancelled': "Your order #{id} has been cancelled. If you have questions, contact support.",
+}
+
+def status_email(order_id, status):
+    """Return (subject, message) of the customer email for an order status, or None."""
+    if status not in STATUS_EMAIL_MESSAGES:
+        return None
+    return f"Order #{order_id} status updated: {status.title()}", STATUS_EMAIL_MESSAGES[status].format(id=order_id)
 
 @receiver(post_save, sender=Order)
 def send_order_status_email(sender, instance, created, **kwargs):
@@ -25,17 +41,10 @@ def send_order_status_email(sender, instance, created, **kwargs):
         mail_admins(admin_subject, admin_message, fail_silently=True)
     else:
         # Status update
-        subject = f"Order #{instance.id} status updated: {instance.status.title()}"
-        if instance.status == 'paid':
-            message = f"Your order #{instance.id} has been paid. We will ship it soon."
-        elif instance.status == 'shipped':
-            message = f"Your order #{instance.id} has been shipped!"
-        elif instance.status == 'delivered':
-            message = f"Your order #{instance.id} has been delivered. Enjoy!"
-        elif instance.status == 'cancelled':
-            message = f"Your order #{instance.id} has been cancelled. If you have questions, contact support."
-        else:
+        email = status_email(instance.id, instance.status)
+        if email is None:
             return
+        subject, message = email
     send_mail(
         subject,
         message,
@@ -44,19 +53,34 @@ def send_order_status_email(sender, instance, created, **kwargs):
         fail_silently=True,
     )
 
-# --- Low stock admin notification ---
+# --- Real-time status updates (see orders.events) ---
+
+@receiver(post_save, sender=Order)
+def publish_order_status_change(sender, instance, created, raw=False, **kwargs):
+    if not created and not raw and instance.status != getattr(instance, 'saved_status', None):
+        publish_status_changes([(instance.id, instance.user_id, instance.status)])
+    instance.saved_status = instance.status
+
+# --- Order updated_at for conditional GETs ---
+
+@receiver([post_save, post_delete], sender=OrderItem)
+def touch_order_of_item(sender, instance, **kwargs):
+    Order.objects.filter(pk=instance.order_id).update(updated_at=timezone.now())
+
+# --- Cached cart pricing (see orders.pricing) ---
+
+@receiver([post_save, post_delete], sender=CartItem)
+def invalidate_pricing_of_cart(sender, instance, **kwargs):
+    invalidate_cart_pricing(instance.cart_id)
+
+# --- Low stock admin digest (see orders.low_stock) ---
+
+@receiver(stock_changed)
+def queue_low_stock_check_after_stock_change(sender, product_ids, **kwargs):
+    enqueue_low_stock_check(product_ids)
 
 @receiver(post_save, sender=Product)
-def notify_admins_low_stock(sender, instance, **kwargs):
-    if instance.stock < LOW_STOCK_THRESHOLD:
-        cache_key = LOW_STOCK_CACHE_KEY.format(instance.id)
-        if not cache.get(cache_key):
-            subject = f"[YD Bloom] Low Stock Alert: {instance.name} (ID: {instance.id})"
-            message = f"Product '{instance.name}' (ID: {instance.id}) is low in stock.\nCurrent stock: {instance.stock}\nPlease restock soon."
-            mail_admins(subject, message, fail_silently=True)
-            cache.set(cache_key, True, timeout=60*60*24)  # 24h, or until restocked
-    else:
-        # If restocked, clear the notification flag
-        cache_key = LOW_STOCK_CACHE_KEY.format(instance.id)
-        if cache.get(cache_key):
-            cache.delete(cache_key) 
\ No newline at end of file
+def queue_low_stock_check(sender, instance, created, raw=False, **kwargs):
+    # Later stock changes send stock_changed; products created without stock do not
+    if created and not raw:
+        transaction.on_commit(lambda: enqueue_low_stock_check([instance.pk]))
@@ -1,14 +1,107 @@
-from django.test import TestCase
+import hashlib
+import hmac
+import json
+import threading
+import time
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+from unittest.mock import patch
+from django.core.management import call_command
+from django.core import mail
+from django.core.cache import cache
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
 from django.urls import reverse
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from rest_framework.test import APIClient
-from store.models import Product, Category
-from orders.models import Cart, CartItem, Order
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from channels.testing import WebsocketCommunicator
+from django.db import transaction
+from store.models import Coupon, Product, ProductVariant, Category, Size
+from users.models import AdminActionLog
+from store.hot_stock import LocMemHotStockBackend, flush_journal, get_hot_stock_backend
+from store.stock import adjust_stock
+from orders.idempotency import LOCK_KEY
+from orders.consumers import OrderStatusConsumer
+from orders.events import OrderEventPublisher
+from orders.fulfillment import bulk_transition
+from orders.low_stock import send_low_stock_digest
+from orders.webhooks import MAX_ATTEMPTS, process_stripe_events
+from orders.guest_cart import LocMemGuestCartBackend
+from orders.pricing import cart_pricing
+from orders.models import Cart, CartItem, Order, OrderItem, PaymentAttempt, StripeEvent
+from orders.views import OrderStatusUpdateView
 from django.contrib.auth import get_user_model
 
 User = get_user_model()
 
-class OrderTests(TestCase):
+class StripeStandIn(BaseHTTPRequestHandler):
+    """
+    Minimal local stand-in for the Stripe PaymentIntents API (like stripe-mock).
+    Answers the first `failures` creations with a 500 and, like Stripe, replays
+    the stored response for an Idempotency-Key it has seen.
+    """
+    failures = 0
+    keys = []  # Idempotency-Key of every creation request
+    intents = {}  # id -> PaymentIntent
+    by_key = {}  # Idempotency-Key -> PaymentIntent
+
+    @classmethod
+    def reset(cls, failures=0):
+        cls.failures, cls.keys, cls.intents, cls.by_key = failures, [], {}, {}
+
+    def reply(self, code, body):
+        data = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        cls = type(self)
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        key = self.headers.get('Idempotency-Key')
+        cls.keys.append(key)
+        if cls.failures:
+            cls.failures -= 1
+            return self.reply(500, {'error': {'type': 'api_error', 'message': 'Stripe is unavailable'}})
+        if key not in cls.by_key:
+            intent_id = f'pi_{len(cls.intents) + 1}'
+            cls.by_key[key] = cls.intents[intent_id] = {
+                'id': intent_id, 'object': 'payment_intent', 'client_secret': f'{intent_id}_secret', 'status': 'requires_payment_method',
+            }
+        self.reply(200, cls.by_key[key])
+
+    def do_GET(self):
+        intent = type(self).intents.get(self.path.rsplit('/', 1)[-1])
+        if intent is None:
+            return self.reply(404, {'error': {'type': 'invalid_request_error', 'message': 'No such payment_intent'}})
+        self.reply(200, intent)
+
+    def log_message(self, *args):
+        pass
+
+class StripeStandInMixin:
+    """Run the tests against a StripeStandIn server (STRIPE_API_BASE points at it)."""
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        server = ThreadingHTTPServer(('127.0.0.1', 0), StripeStandIn)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        cls.addClassCleanup(server.server_close)
+        cls.addClassCleanup(server.shutdown)
+        cls.enterClassContext(override_settings(STRIPE_API_BASE=f'http://127.0.0.1:{server.server_port}', STRIPE_RETRY_DELAY=0))
+
+    def setUp(self):
+        super().setUp()
+        StripeStandIn.reset()
+
+class OrderTests(StripeStandInMixin, TestCase):
     def setUp(self):
+        super().setUp()
         self.client = APIClient()
         self.user = User.objects.create_user('user', 'user@example.com', 'userpass')
         self.category = Category.objects.create(name='Tops')
@@ -25,19 +118,76 @@ class OrderTests(TestCase):
         self.assertEqual(response.status_code, 201)
         self.assertTrue(CartItem.objects.filter(product=self.product, cart__user=self.user).exists())
 
+    def test_cart_item_product_is_compact_and_expandable(self):
+        cart = Cart.objects.get_or_create(user=self.user)[0]
+        CartItem.objects.create(cart=cart, product=self.product, quantity=1)
+        url = reverse('orders:cart-item-list')
+        response = self.client.get(url)
+        self.assertNotIn('reviews', response.data[0]['product'])
+        response = self.client.get(url, {'product_fields': 'id,name,description', 'product_expand': 'description'})
+        self.assertEqual(set(response.data[0]['product']), {'id', 'name', 'description'})
+
     def test_checkout_creates_order(self):
         # Add to cart first
         cart = Cart.objects.get_or_create(user=self.user)[0]
         CartItem.objects.create(cart=cart, product=self.product, quantity=1)
         url = reverse('orders:checkout')
-        from unittest.mock import patch, MagicMock
-        with patch('orders.views.stripe.PaymentIntent.create', return_value=MagicMock(id='pi_test', client_secret='secret')):
-            response = self.client.post(url)
+        response = self.client.post(url)
         if response.status_code not in [200, 201]:
             print('Checkout response:', response.status_code, response.content)
         self.assertIn(response.status_code, [200, 201])
         self.assertTrue(Order.objects.filter(user=self.user).exists())
 
+    def checkout_queries(self, lines):
+        cart = Cart.objects.get_or_create(user=self.user)[0]
+        for i in range(lines):
+            product = Product.objects.create(name=f'Item {i}', category=self.category, price=10, stock=5)
+            CartItem.objects.create(cart=cart, product=product, quantity=2)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post(reverse('orders:checkout'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['order']['items']), lines)
+        return len(ctx.captured_queries)
+
+    def test_checkout_query_count_does_not_grow_with_cart(self):
+        self.assertEqual(self.checkout_queries(1), self.checkout_queries(10))
+        order = Order.objects.latest('id')
+        self.assertEqual(order.total, 200)
+        self.assertEqual(sorted(set(order.items.values_list('price', 'quantity'))), [(10, 2)])
+        self.assertFalse(CartItem.objects.exists())
+
+    def test_checkout_retries_stripe_with_one_idempotency_key(self):
+        cart = Cart.objects.get_or_create(user=self.user)[0]
+        CartItem.objects.create(cart=cart, product=self.product, quantity=1)
+        StripeStandIn.reset(failures=2)
+        response = self.client.post(reverse('orders:checkout'))
+        self.assertEqual(response.status_code, 200)
+        attempt = PaymentAttempt.objects.get()
+        self.assertEqual((attempt.status, attempt.tries, attempt.payment_intent_id), ('created', 3, response.data['payment_intent_id']))
+        self.assertEqual(StripeStandIn.keys, [attempt.idempotency_key] * 3)
+        self.assertEqual(len(StripeStandIn.intents), 1)
+
+    def test_checkout_keeps_order_when_stripe_fails_and_payment_can_be_retried(self):
+        cart = Cart.objects.get_or_create(user=self.user)[0]
+        CartItem.objects.create(cart=cart, product=self.product, quantity=1)
+        StripeStandIn.reset(failures=3)
+        response = self.client.post(reverse('orders:checkout'))
+        self.assertEqual(response.status_code, 502)
+        order = Order.objects.get(user=self.user)
+        self.assertEqual(order.status, 'pending')
+        self.assertFalse(CartItem.objects.exists())
+        self.assertEqual(order.payment_attempts.get().status, 'failed')
+        url = reverse('orders:order-retry-payment', args=[order.id])
+        self.assertEqual(response.data['retry_url'], url)
+        response = self.client.post(url)
+        self.assertEqual(response.status_code, 200)
+        failed, created = order.payment_attempts.order_by('id')
+        self.assertNotEqual(failed.idempotency_key, created.idempotency_key)
+        self.assertEqual(created.payment_intent_id, response.data['payment_intent_id'])
+        # Retrying again hands out the same PaymentIntent
+        self.assertEqual(self.client.post(url).data['payment_intent_id'], created.payment_intent_id)
+        self.assertEqual(order.payment_attempts.count(), 2)
+
     def test_order_status_change(self):
         order = Order.objects.create(user=self.user, total=20, status='pending')
         url = reverse('orders:order-detail', args=[order.id])
@@ -49,9 +199,659 @@ class OrderTests(TestCase):
         order.refresh_from_db()
         self.assertEqual(order.status, 'paid')
 
+    def test_non_numeric_order_id_is_404(self):
+        self.assertEqual(self.client.get(reverse('orders:order-detail', args=['abc'])).status_code, 404)
+
+    def test_order_history_is_paginated(self):
+        for _ in range(12):
+            Order.objects.create(user=self.user, total=20)
+        url = reverse('orders:order-history')
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 10)
+        response = self.client.get(response.data['next'])
+        self.assertEqual(len(response.data['results']), 2)
+
+    def history_queries(self, orders):
+        for i in range(orders):
+            order = Order.objects.create(user=self.user, total=20)
+            product = Product.objects.create(name=f'Product {i}', category=self.product.category, price=10, stock=5)
+            OrderItem.objects.create(order=order, product=product, quantity=2, price=10)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(reverse('orders:order-history')).status_code, 200)
+        return len(queries)
+
+    def test_order_history_renders_item_snapshots_in_constant_queries(self):
+        self.assertEqual(self.history_queries(1), self.history_queries(5))
+        order = Order.objects.create(user=self.user, total=20)
+        OrderItem.objects.create(order=order, product=self.product, quantity=1, price=20)
+        Product.objects.filter(pk=self.product.pk).update(name='Renamed')
+        item = self.client.get(reverse('orders:order-order-details', args=[order.id])).data['items'][0]
+        self.assertEqual((item['product_id'], item['product_name'], item['size_name'], item['price']), (self.product.id, self.product.name, '', '20.00'))
+        self.assertNotIn('product', item)
+        response = self.client.get(reverse('orders:order-history'), {'item_expand': 'product'})
+        self.assertEqual(response.data['results'][0]['items'][0]['product']['name'], 'Renamed')
+
+    def test_order_list_conditional_get(self):
+        order = Order.objects.create(user=self.user, total=20, status='pending')
+        url = reverse('orders:order-list')
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        OrderItem.objects.create(order=order, product=self.product, quantity=1, price=20)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
     def test_pdf_receipt_download(self):
         order = Order.objects.create(user=self.user, total=20, status='paid')
         url = reverse('orders:order-download-receipt', args=[order.id])
         response = self.client.get(url)
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response['Content-Type'], 'application/pdf')
+
+class IdempotencyTests(StripeStandInMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user('user', 'user@example.com', 'userpass')
+        self.client.force_authenticate(user=self.user)
+        category = Category.objects.create(name='Tops')
+        self.product = Product.objects.create(name='Shirt', category=category, price=20, stock=10)
+        cart = Cart.objects.create(user=self.user)
+        CartItem.objects.create(cart=cart, product=self.product, quantity=1)
+
+    def test_checkout_retry_returns_the_first_response(self):
+        url = reverse('orders:checkout')
+        first = self.client.post(url, HTTP_IDEMPOTENCY_KEY='checkout-1')
+        self.assertEqual(first.status_code, 200)
+        retry = self.client.post(url, HTTP_IDEMPOTENCY_KEY='checkout-1')
+        self.assertEqual(retry.status_code, 200)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(retry.data, first.data)
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(len(StripeStandIn.intents), 1)
+        # Keys are per user
+        other = User.objects.create_user('other', 'other@example.com', 'otherpass')
+        self.client.force_authenticate(user=other)
+        self.assertEqual(self.client.post(url, HTTP_IDEMPOTENCY_KEY='checkout-1').status_code, 404)  # No cart
+
+    def test_key_in_flight_or_reused_for_another_request_is_rejected(self):
+        cache.add(LOCK_KEY.format(self.user.pk, hashlib.sha1(b'busy').hexdigest()), True)
+        response = self.client.post(reverse('orders:checkout'), HTTP_IDEMPOTENCY_KEY='busy')
+        self.assertEqual(response.status_code, 409)
+        self.assertFalse(Order.objects.exists())
+        url = reverse('orders:apply-coupon')
+        self.client.post(url, {'code': 'NOPE'}, HTTP_IDEMPOTENCY_KEY='coupon-1')
+        self.assertEqual(self.client.post(url, {'code': 'OTHER'}, HTTP_IDEMPOTENCY_KEY='coupon-1').status_code, 422)
+
+    @override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+    def test_status_update_is_not_applied_twice(self):
+        staff = User.objects.create_user('staff', 'staff@example.com', 'staffpass', is_staff=True)
+        order = Order.objects.create(user=self.user, total=20)
+        view = OrderStatusUpdateView.as_view()
+
+        def post(**headers):
+            request = RequestFactory().post('/status/', **headers)
+            request.user = staff
+            return view(request, order_id=order.id, status='cancelled')
+        first = post(HTTP_IDEMPOTENCY_KEY='cancel-1')
+        self.assertEqual(first.status_code, 200)
+        retry = post(HTTP_IDEMPOTENCY_KEY='cancel-1')
+        self.assertEqual((retry.status_code, retry.content), (200, first.content))
+        self.assertEqual(post().status_code, 400)  # Without a key the transition runs again
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class CartPricingTests(StripeStandInMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user('user', 'user@example.com', 'userpass')
+        self.client.force_authenticate(user=self.user)
+        category = Category.objects.create(name='Tops')
+        self.shirt = Product.objects.create(name='Shirt', category=category, price=20, discount=10, stock=10)
+        self.hat = Product.objects.create(name='Hat', category=category, price='9.99', stock=10)
+        self.cart = Cart.objects.create(user=self.user)
+        self.line = CartItem.objects.create(cart=self.cart, product=self.shirt, quantity=2)
+        CartItem.objects.create(cart=self.cart, product=self.hat, quantity=1)
+
+    def test_summary_is_one_query_then_cached(self):
+        with self.assertNumQueries(1):
+            summary = cart_pricing(self.cart.id)
+        self.assertEqual(
+            (summary['item_count'], summary['subtotal'], summary['discount'], summary['total']),
+            (3, Decimal('49.99'), Decimal('4.00'), Decimal('45.99')),
+        )
+        with self.assertNumQueries(0):
+            self.assertEqual(cart_pricing(self.cart.id), summary)
+        self.assertEqual(self.client.get(reverse('orders:cart-total')).data['total'], Decimal('45.99'))
+
+    def test_cart_and_price_changes_invalidate_the_summary(self):
+        cart_pricing(self.cart.id)
+        self.line.quantity = 1
+        self.line.save()
+        self.assertEqual(cart_pricing(self.cart.id)['total'], Decimal('27.99'))
+        self.hat.price = Decimal('5.00')
+        self.hat.save()
+        self.assertEqual(cart_pricing(self.cart.id)['total'], Decimal('23.00'))
+        self.hat.stock = 3  # Other product changes keep the cached summary
+        self.hat.save()
+        with self.assertNumQueries(0):
+            cart_pricing(self.cart.id)
+
+    def test_checkout_charges_the_cart_total_with_coupon(self):
+        Coupon.objects.create(code='SAVE10', discount=10)
+        self.client.post(reverse('orders:apply-coupon'), {'code': 'SAVE10'})
+        summary = self.client.get(reverse('orders:cart-total')).data
+        self.assertEqual((summary['coupon'], summary['coupon_discount'], summary['total']), ('SAVE10', Decimal('4.60'), Decimal('41.39')))
+        response = self.client.post(reverse('orders:checkout'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Order.objects.get().total, summary['total'])
+        self.assertEqual(cart_pricing(self.cart.id)['item_count'], 0)
+
+class CartLineTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user('user', 'user@example.com', 'userpass')
+        self.client.force_authenticate(user=self.user)
+        category = Category.objects.create(name='Tops')
+        self.size = Size.objects.create(name='M')
+        self.shirt = Product.objects.create(name='Shirt', category=category, price=20, stock=10)
+        self.hat = Product.objects.create(name='Hat', category=category, price=10, stock=10)
+        self.cart = Cart.objects.create(user=self.user)
+
+    def lines(self):
+        return sorted(self.cart.items.values_list('product__name', 'size__name', 'quantity'), key=str)
+
+    def test_adding_a_line_twice_adds_to_its_quantity(self):
+        url = reverse('orders:cart-item-list')
+        for size in [None, None, self.size]:
+            data = {'cart': self.cart.id, 'product_id': self.shirt.id, 'quantity': 2, **({'size_id': size.id} if size else {})}
+            self.assertEqual(self.client.post(url, data).status_code, 201)
+        self.assertEqual(self.lines(), [('Shirt', 'M', 2), ('Shirt', None, 4)])
+        self.assertEqual(cart_pricing(self.cart.id)['item_count'], 6)
+
+    def test_set_lines_reconciles_the_cart(self):
+        CartItem.objects.create(cart=self.cart, product=self.shirt, quantity=5)
+        CartItem.objects.create(cart=self.cart, product=self.hat, size=self.size, quantity=1)
+        url = reverse('orders:cart-item-set-lines')
+        lines = [
+            {'product_id': self.shirt.id, 'quantity': 2},
+            {'product_id': self.hat.id, 'size_id': self.size.id, 'quantity': 0},
+            {'product_id': self.hat.id, 'quantity': 3},
+        ]
+        response = self.client.put(url, lines, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([(item['product']['name'], item['quantity']) for item in response.data], [('Shirt', 2), ('Hat', 3)])
+        self.assertEqual(self.lines(), [('Hat', None, 3), ('Shirt', None, 2)])
+        self.assertEqual(cart_pricing(self.cart.id)['total'], Decimal('70.00'))
+        response = self.client.put(url, [{'product_id': 999, 'quantity': 1}], format='json')
+        self.assertEqual((response.status_code, response.data['product_id']), (400, [999]))
+
+    def test_update_quantity_changes_the_line_in_one_update(self):
+        item = CartItem.objects.create(cart=self.cart, product=self.shirt, quantity=2)
+        url = reverse('orders:cart-item-update-quantity', args=[item.id])
+        self.assertEqual(self.client.patch(url, {'delta': 3}).data['quantity'], 5)
+        self.assertEqual(self.client.patch(url, {'quantity': 1}).data['quantity'], 1)
+        self.assertEqual(self.client.patch(url, {'delta': -4}).data, {'message': 'Item removed from cart'})
+        self.assertFalse(CartItem.objects.exists())
+        other = CartItem.objects.create(cart=Cart.objects.create(user=User.objects.create_user('other')), product=self.hat)
+        self.assertEqual(self.client.patch(reverse('orders:cart-item-update-quantity', args=[other.id]), {'delta': 1}).status_code, 404)
+        self.assertEqual(self.client.patch(reverse('orders:cart-item-update-quantity', args=['abc']), {'delta': 1}).status_code, 404)
+
+    def test_update_cannot_move_an_item_onto_another_line(self):
+        item = CartItem.objects.create(cart=self.cart, product=self.shirt, quantity=2)
+        CartItem.objects.create(cart=self.cart, product=self.hat, quantity=1)
+        url = reverse('orders:cart-item-detail', args=[item.id])
+        response = self.client.patch(url, {'product_id': self.hat.id})
+        self.assertEqual((response.status_code, list(response.data)), (400, ['product_id']))
+        response = self.client.put(url, {'cart': self.cart.id, 'product_id': self.shirt.id, 'quantity': 4})
+        self.assertEqual((response.status_code, response.data['quantity']), (200, 4))
+        self.assertEqual(self.lines(), [('Hat', None, 1), ('Shirt', None, 4)])
+
+class GuestCartTests(TestCase):
+    def setUp(self):
+        LocMemGuestCartBackend.carts.clear()
+        self.client = APIClient()
+        category = Category.objects.create(name='Tops')
+        self.size = Size.objects.create(name='M')
+        self.shirt = Product.objects.create(name='Shirt', category=category, price=20, stock=10)
+        self.hat = Product.objects.create(name='Hat', category=category, price=10, stock=10)
+
+    def add(self, product, quantity, token=None, size=None):
+        data = {'product_id': product.id, 'quantity': quantity, **({'size_id': size.id} if size else {})}
+        return self.client.post(reverse('orders:guest-cart-item-list'), data, **({'HTTP_X_CART_TOKEN': token} if token else {}))
+
+    def test_guest_cart_operations_stay_off_the_database(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.add(self.shirt, 1)
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(all(query['sql'].startswith('SELECT') for query in queries))  # Product reads only
+        token = response['X-Cart-Token']
+        self.add(self.shirt, 2, token, self.size)
+        self.add(self.shirt, 1, token, self.size)
+        self.assertFalse(CartItem.objects.exists())
+        items = self.client.get(reverse('orders:guest-cart-item-list'), HTTP_X_CART_TOKEN=token).data
+        self.assertEqual([(item['id'], item['product']['name'], item['quantity']) for item in items], [
+            (f'{self.shirt.id}-0', 'Shirt', 1), (f'{self.shirt.id}-{self.size.id}', 'Shirt', 3),
+        ])
+        url = reverse('orders:guest-cart-item-update-quantity', args=[f'{self.shirt.id}-0'])
+        self.assertEqual(self.client.patch(url, {'quantity': 5}, HTTP_X_CART_TOKEN=token).data['quantity'], 5)
+        self.assertEqual(self.client.patch(url, {'quantity': 'five'}, HTTP_X_CART_TOKEN=token).status_code, 400)
+        self.client.patch(url, {'quantity': 0}, HTTP_X_CART_TOKEN=token)
+        detail = reverse('orders:guest-cart-item-detail', args=[f'{self.shirt.id}-{self.size.id}'])
+        self.assertEqual(self.client.delete(detail, HTTP_X_CART_TOKEN=token).status_code, 204)
+        self.assertEqual(self.client.get(reverse('orders:guest-cart-item-list'), HTTP_X_CART_TOKEN=token).data, [])
+        self.assertEqual(self.client.get(detail, HTTP_X_CART_TOKEN='other').status_code, 404)
+
+    def test_guest_cart_merges_into_user_cart_on_login(self):
+        user = User.objects.create_user('user', 'user@example.com', 'userpass')
+        cart = Cart.objects.create(user=user)
+        CartItem.objects.create(cart=cart, product=self.shirt, quantity=1)
+        token = self.add(self.shirt, 2)['X-Cart-Token']
+        self.add(self.hat, 1, token)
+        response = self.client.post(reverse('users:login'), {'username': 'user', 'password': 'userpass'}, HTTP_X_CART_TOKEN=token)
+        self.assertEqual(response.data['cart_items_merged'], 2)
+        self.assertEqual(sorted(cart.items.values_list('product__name', 'quantity')), [('Hat', 1), ('Shirt', 3)])
+        # The guest cart is gone, so logging in again does not add it twice
+        self.client.post(reverse('users:login'), {'username': 'user', 'password': 'userpass'}, HTTP_X_CART_TOKEN=token)
+        self.assertEqual(cart.items.count(), 2)
+
+    def test_guest_cart_merges_on_registration(self):
+        token = self.add(self.hat, 2)['X-Cart-Token']
+        data = {'username': 'new', 'email': 'new@example.com', 'password': 'Str0ng-pass!', 'password2': 'Str0ng-pass!'}
+        response = self.client.post(reverse('users:register'), data, HTTP_X_CART_TOKEN=token)
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(list(Cart.objects.get(user__username='new').items.values_list('product__name', 'quantity')), [('Hat', 2)])
+
+class BulkTransitionTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('user', 'user@example.com', 'userpass')
+        self.staff = User.objects.create_user('staff', 'staff@example.com', 'staffpass', is_staff=True)
+        category = Category.objects.create(name='Tops')
+        self.product = Product.objects.create(name='Shirt', category=category, price=20, stock=5)
+        self.sold_out = Product.objects.create(name='Hat', category=category, price=20, stock=0)
+
+    def order(self, product, status='pending', quantity=2):
+        order = Order.objects.create(user=self.user, total=40, status=status)
+        OrderItem.objects.create(order=order, product=product, quantity=quantity, price=20)
+        return order
+
+    def test_endpoint_moves_valid_orders_and_reports_the_rest(self):
+        paid = [self.order(self.product), self.order(self.product)]
+        short, shipped = self.order(self.sold_out), self.order(self.product, status='shipped')
+        ids = [order.id for order in paid + [short, shipped]] + [9999]
+        url = reverse('orders:order-bulk-transition')
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        self.assertEqual(client.post(url, {'order_ids': ids, 'status': 'paid'}, format='json').status_code, 403)
+        client.force_authenticate(user=self.staff)
+        mail.outbox = []
+        with self.captureOnCommitCallbacks(execute=True):
+            response = client.post(url, {'order_ids': ids, 'status': 'paid'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['updated'], [order.id for order in paid])
+        self.assertEqual(response.data['errors'], {
+            str(short.id): 'Not enough stock for Hat',
+            str(shipped.id): 'Invalid status transition: shipped → paid',
+            '9999': 'Order not found',
+        })
+        self.assertEqual(sorted(Order.objects.filter(status='paid').values_list('id', flat=True)), response.data['updated'])
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 1)
+        self.assertEqual(AdminActionLog.objects.filter(user=self.staff, model='Order').count(), 2)
+        self.assertEqual(sorted(m.subject for m in mail.outbox), [f'Order #{order.id} status updated: Paid' for order in paid])
+        self.assertEqual(client.post(url, {'order_ids': ids, 'status': 'lost'}, format='json').status_code, 400)
+
+    def test_paying_allocates_short_stock_in_order_id_order(self):
+        orders = [self.order(self.product, quantity=1) for _ in range(10)]
+        with self.captureOnCommitCallbacks(execute=True):
+            updated, rejected = bulk_transition([order.id for order in orders], 'paid')
+        self.assertEqual(updated, [order.id for order in orders[:5]])
+        self.assertEqual(rejected, {order.id: 'Not enough stock for Shirt (one size)' for order in orders[5:]})
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 0)
+
+    def test_query_count_does_not_grow_with_orders(self):
+        def shipping_queries(count):
+            ids = [self.order(self.product, status='paid').id for _ in range(count)]
+            with CaptureQueriesContext(connection) as ctx:
+                updated, rejected = bulk_transition(ids, 'shipped', user=self.staff)
+            self.assertEqual((len(updated), rejected), (count, {}))
+            return len(ctx.captured_queries)
+        self.assertEqual(shipping_queries(2), shipping_queries(10))
+
+    def test_cancelling_paid_orders_restocks_once_per_product(self):
+        orders = [self.order(self.product, status='paid') for _ in range(3)]
+        with self.captureOnCommitCallbacks(execute=True):
+            updated, rejected = bulk_transition([order.id for order in orders], 'cancelled')
+        self.assertEqual(len(updated), 3)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 11)
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class OrderEventTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('user', 'user@example.com', 'userpass')
+        self.other = User.objects.create_user('other', 'other@example.com', 'otherpass')
+        self.publisher = OrderEventPublisher(background=False)
+        patcher = patch('orders.events.publisher', self.publisher)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.layer = get_channel_layer()
+
+    def listen(self, group):
+        channel = async_to_sync(self.layer.new_channel)()
+        async_to_sync(self.layer.group_add)(group, channel)
+        return channel
+
+    def test_committed_changes_are_coalesced_per_user_and_sent_to_order_groups(self):
+        first, second = Order.objects.create(user=self.user, total=10), Order.objects.create(user=self.user, total=10)
+        other = Order.objects.create(user=self.other, total=10)
+        user_channel, order_channel = self.listen(f'orders_{self.user.id}'), self.listen(f'order_{first.id}')
+        with self.captureOnCommitCallbacks(execute=True):
+            first.transition_status('paid')
+            first.transition_status('cancelled')
+            second.transition_status('cancelled')
+            bulk_transition([other.id], 'cancelled')
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                second.status = 'paid'
+                second.save()
+                raise RuntimeError  # Rolled back: not published
+        self.assertEqual(self.publisher.drain(), 5)  # 2 user groups + 3 order groups
+        batch = async_to_sync(self.layer.receive)(user_channel)
+        self.assertEqual(batch['type'], 'order_status_batch')
+        self.assertEqual([(update['order_id'], update['status']) for update in batch['updates']], [(first.id, 'cancelled'), (second.id, 'cancelled')])
+        update = async_to_sync(self.layer.receive)(order_channel)
+        self.assertEqual((update['type'], update['status'], update['id']), ('order_status_update', 'cancelled', batch['updates'][0]['id']))
+        self.assertEqual(self.publisher.drain(), 0)
+
+    def test_consumer_delivers_an_event_once_and_only_follows_own_orders(self):
+        own, foreign = Order.objects.create(user=self.user, total=10), Order.objects.create(user=self.other, total=10)
+
+        async def scenario():
+            communicator = WebsocketCommunicator(OrderStatusConsumer.as_asgi(), '/ws/orders/')
+            communicator.scope['user'] = self.user
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+            await communicator.send_json_to({'type': 'subscribe_order', 'order_id': foreign.id})
+            self.assertTrue(await communicator.receive_nothing())
+            await communicator.send_json_to({'type': 'subscribe_order', 'order_id': own.id})
+            self.assertEqual((await communicator.receive_json_from())['type'], 'subscription_confirmed')
+            event = {'id': 'e1', 'order_id': own.id, 'user_id': self.user.id, 'status': 'paid', 'message': 'paid'}
+            await self.layer.group_send(f'orders_{self.user.id}', {'type': 'order_status_batch', 'updates': [event]})
+            await self.layer.group_send(f'order_{own.id}', {'type': 'order_status_update', **event})
+            self.assertEqual((await communicator.receive_json_from())['status'], 'paid')
+            self.assertTrue(await communicator.receive_nothing())
+            await communicator.disconnect()
+        async_to_sync(scenario)()
+
+class StockMovementTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('buyer', 'buyer@example.com', 'pass')
+        self.category = Category.objects.create(name='Tops')
+        self.shirt = Product.objects.create(name='Shirt', category=self.category, price=20, stock=5)
+        self.hat = Product.objects.create(name='Hat', category=self.category, price=10, stock=1)
+
+    def order(self, *lines, size=None):
+        order = Order.objects.create(user=self.user, total=0, status='pending')
+        for product, quantity in lines:
+            OrderItem.objects.create(order=order, product=product, size=size, quantity=quantity, price=product.price)
+        return order
+
+    def transition(self, order, status):
+        # stock_changed listeners run after commit
+        with self.captureOnCommitCallbacks(execute=True):
+            order.transition_status(status)
+
+    def test_payment_is_all_or_nothing(self):
+        order = self.order((self.shirt, 2), (self.hat, 2))
+        with self.assertRaisesMessage(ValueError, 'Not enough stock for Hat'):
+            order.transition_status('paid')
+        self.shirt.refresh_from_db()
+        self.assertEqual(self.shirt.stock, 5)
+        self.assertEqual(Order.objects.get(pk=order.pk).status, 'pending')
+
+    def test_payment_and_cancellation_move_stock(self):
+        order = self.order((self.shirt, 2), (self.shirt, 1))
+        self.transition(order, 'paid')
+        self.shirt.refresh_from_db()
+        self.assertEqual(self.shirt.stock, 2)
+        self.transition(order, 'cancelled')
+        self.shirt.refresh_from_db()
+        self.assertEqual(self.shirt.stock, 5)
+
+    def test_failing_stock_listener_does_not_fail_the_payment(self):
+        order = self.order((self.shirt, 2))
+        with patch('orders.signals.enqueue_low_stock_check', side_effect=RuntimeError('queue down')), self.assertLogs(level='ERROR'):
+            self.transition(order, 'paid')
+        self.shirt.refresh_from_db()
+        self.assertEqual((self.shirt.stock, Order.objects.get(pk=order.pk).status), (3, 'paid'))
+
+    def test_stale_instance_cannot_pay_twice(self):
+        order = self.order((self.shirt, 1))
+        stale = Order.objects.get(pk=order.pk)
+        self.transition(order, 'paid')
+        with self.assertRaises(ValueError):
+            stale.transition_status('paid')
+        self.shirt.refresh_from_db()
+        self.assertEqual(self.shirt.stock, 4)
+
+    def test_sizes_are_stocked_separately(self):
+        small, medium = Size.objects.create(name='S'), Size.objects.create(name='M')
+        dress = Product.objects.create(name='Dress', category=self.category, price=50)
+        ProductVariant.objects.create(product=dress, size=small, stock=1)
+        ProductVariant.objects.create(product=dress, size=medium, stock=3)
+        self.transition(self.order((dress, 1), size=small), 'paid')
+        with self.assertRaisesMessage(ValueError, 'Not enough stock for Dress (S)'):
+            self.transition(self.order((dress, 1), size=small), 'paid')
+        self.transition(self.order((dress, 2), size=medium), 'paid')
+        dress.refresh_from_db()
+        self.assertEqual(dress.stock, 1)
+        self.assertEqual(ProductVariant.objects.get(product=dress, size=medium).stock, 1)
+
+    def test_unknown_size_uses_unsized_variant(self):
+        self.transition(self.order((self.shirt, 2), size=Size.objects.create(name='XL')), 'paid')
+        self.shirt.refresh_from_db()
+        self.assertEqual(self.shirt.stock, 3)
+
+class HotStockTests(TestCase):
+    def setUp(self):
+        self.clear_counters()
+        self.addCleanup(self.clear_counters)  # Variant ids are reused by later tests
+        self.user = User.objects.create_user('buyer', 'buyer@example.com', 'pass')
+        self.drop = Product.objects.create(name='Drop', category=Category.objects.create(name='Tops'), price=99, stock=2, hot_stock=True)
+        self.variant = self.drop.variants.get()
+
+    def clear_counters(self):
+        LocMemHotStockBackend.values.clear()
+        LocMemHotStockBackend.journal.clear()
+
+    def order(self, quantity=1):
+        order = Order.objects.create(user=self.user, total=0, status='pending')
+        OrderItem.objects.create(order=order, product=self.drop, quantity=quantity, price=99)
+        return order
+
+    def pay(self, quantity=1):
+        self.order(quantity).transition_status('paid')
+
+    def test_hot_products_sell_from_counters(self):
+        self.pay()
+        self.pay()
+        with self.assertRaisesMessage(ValueError, 'Not enough stock for Drop'):
+            self.pay()
+        self.variant.refresh_from_db()
+        self.assertEqual(self.variant.stock, 2)  # Not flushed yet
+        self.assertEqual(get_hot_stock_backend().counters([self.variant.pk]), {self.variant.pk: 0})
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(flush_journal(), 2)
+        self.drop.refresh_from_db()
+        self.assertEqual(self.drop.stock, 0)
+
+    def test_flush_after_crash_does_not_apply_twice(self):
+        self.pay()
+        with patch.object(LocMemHotStockBackend, 'trim_journal'):  # Crash between commit and trim
+            flush_journal()
+        self.assertEqual(flush_journal(), 0)
+        self.variant.refresh_from_db()
+        self.assertEqual(self.variant.stock, 1)
+        self.assertEqual(LocMemHotStockBackend.journal, [])
+
+    def test_failed_payment_gives_units_back(self):
+        order = self.order(quantity=2)
+        with patch.object(Order, 'save', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                order.transition_status('paid')
+        self.pay(quantity=2)
+
+    def test_cold_products_release_counters(self):
+        self.pay()
+        Product.objects.filter(pk=self.drop.pk).update(hot_stock=False)
+        flush_journal()
+        self.assertEqual(get_hot_stock_backend().counters([self.variant.pk]), {})
+        self.variant.refresh_from_db()
+        self.assertEqual(self.variant.stock, 1)
+
+@override_settings(
+    ADMINS=[('Admin', 'admin@example.com')],
+    CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}},
+)
+class StripeWebhookInboxTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('user', 'user@example.com', 'userpass')
+        self.order = Order.objects.create(user=self.user, total=20)
+
+    def post_event(self, event_id, event_type, created):
+        payload = json.dumps({
+            'id': event_id, 'object': 'event', 'type': event_type, 'created': created,
+            'data': {'object': {'id': 'pi_1', 'object': 'payment_intent', 'metadata': {'order_id': str(self.order.id)}}},
+        })
+        timestamp = int(time.time())
+        secret = 'whsec_your_webhook_secret'
+        signature = hmac.new(secret.encode(), f'{timestamp}.{payload}'.encode(), hashlib.sha256).hexdigest()
+        with override_settings(STRIPE_WEBHOOK_SECRET=secret):
+            return self.client.post(
+                reverse('orders:stripe-webhook'), payload, content_type='application/json',
+                HTTP_STRIPE_SIGNATURE=f't={timestamp},v1={signature}',
+            )
+
+    def test_events_are_acked_once_and_processed_by_the_worker(self):
+        PaymentAttempt.objects.create(order=self.order, status='created', payment_intent_id='pi_1')
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(self.post_event('evt_1', 'payment_intent.succeeded', 100).status_code, 200)
+        self.assertEqual(len(ctx.captured_queries), 1)  # One INSERT, no order work in the request
+        self.assertEqual(self.post_event('evt_1', 'payment_intent.succeeded', 100).status_code, 200)  # Redelivery
+        self.assertEqual(self.client.post(reverse('orders:stripe-webhook'), '{}', content_type='application/json').status_code, 400)
+        self.assertEqual(StripeEvent.objects.count(), 1)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, 'pending')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(process_stripe_events(), 1)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, 'paid')
+        self.assertEqual(StripeEvent.objects.get().status, 'processed')
+        self.assertEqual(PaymentAttempt.objects.get().status, 'succeeded')
+        self.assertEqual(process_stripe_events(), 0)
+
+    def test_failed_event_is_retried_before_later_events_of_its_order(self):
+        self.post_event('evt_2', 'payment_intent.payment_failed', 200)
+        self.post_event('evt_1', 'payment_intent.succeeded', 100)
+        with patch.object(Order, 'transition_status', side_effect=RuntimeError('database went away')):
+            self.assertEqual(process_stripe_events(), 0)
+        first = StripeEvent.objects.get(event_id='evt_1')
+        self.assertEqual((first.status, first.attempts), ('pending', 1))
+        self.assertIn('database went away', first.last_error)
+        self.assertEqual(StripeEvent.objects.get(event_id='evt_2').attempts, 0)  # Waits behind evt_1
+        self.assertEqual(process_stripe_events(), 0)  # evt_1 backs off
+        StripeEvent.objects.filter(event_id='evt_1').update(next_attempt_at=first.received_at)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(process_stripe_events(), 2)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, 'paid')
+        self.assertEqual(list(StripeEvent.objects.order_by('processed_at').values_list('event_id', flat=True)), ['evt_1', 'evt_2'])
+        self.assertIn(f'[Django] [YD Bloom] Stripe Payment Failed for Order {self.order.id}', [m.subject for m in mail.outbox])
+
+    @override_settings(ADMINS=[('Admin', 'admin@example.com')])
+    def test_paid_order_short_of_stock_is_retried_then_reported(self):
+        hat = Product.objects.create(name='Hat', category=Category.objects.create(name='Hats'), price=20, stock=0)
+        OrderItem.objects.create(order=self.order, product=hat, quantity=1, price=20)
+        self.post_event('evt_1', 'payment_intent.succeeded', 100)
+        with self.assertLogs('orders.webhooks', 'WARNING'):
+            self.assertEqual(process_stripe_events(), 0)
+        event = StripeEvent.objects.get()
+        self.assertEqual((event.status, event.attempts), ('pending', 1))
+        StripeEvent.objects.update(attempts=MAX_ATTEMPTS - 1, next_attempt_at=event.received_at)
+        with self.captureOnCommitCallbacks(execute=True), self.assertLogs('orders.webhooks', 'WARNING'):
+            process_stripe_events()
+        self.assertEqual(StripeEvent.objects.get().status, 'failed')
+        self.assertIn('The customer was charged', mail.outbox[-1].body)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, 'pending')
+
+@override_settings(ADMINS=[('Admin', 'admin@example.com')])
+class LowStockDigestTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name='Tops')
+        self.products = [Product.objects.create(name=f'Shirt {i}', category=category, price=20, stock=10) for i in range(3)]
+
+    def adjust(self, products, amount):
+        with self.captureOnCommitCallbacks(execute=True):
+            adjust_stock(products, amount)
+
+    def test_stock_changes_are_batched_into_one_digest(self):
+        self.adjust(self.products[:2], -8)
+        self.adjust(self.products[:2], -1)
+        self.assertEqual(mail.outbox, [])
+        self.assertEqual([variant.product for variant in send_low_stock_digest()], self.products[:2])
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIn('Shirt 0 (one size) (ID: %d): 1 left' % self.products[0].pk, mail.outbox[0].body)
+        self.assertIn('Shirt 1', mail.outbox[0].body)
+        self.assertNotIn('Shirt 2', mail.outbox[0].body)
+
+    def test_products_are_reported_once_until_restocked(self):
+        self.adjust(self.products[:1], -8)
+        send_low_stock_digest()
+        self.adjust(self.products[:1], -1)
+        self.assertEqual(send_low_stock_digest(), [])
+        self.adjust(self.products[:1], 10)
+        send_low_stock_digest()
+        self.adjust(self.products[:1], -10)
+        self.assertEqual([variant.product for variant in send_low_stock_digest()], self.products[:1])
+        self.assertEqual(len(mail.outbox), 2)
+
+    def test_drain_waits_for_a_slot_being_written(self):
+        self.adjust(self.products[:1], -8)
+        tail = cache.incr('low_stock_queue_tail')  # A concurrent enqueue reserved its slot, not written yet
+        self.adjust(self.products[1:2], -8)
+        self.assertEqual([variant.product for variant in send_low_stock_digest()], self.products[:1])
+        cache.set(f'low_stock_queue_{tail}', self.products[2].pk)
+        self.adjust(self.products[2:], -8)
+        self.assertEqual([variant.product for variant in send_low_stock_digest()], self.products[1:])
+
+    def test_drain_skips_a_slot_whose_writer_died(self):
+        cache.set('low_stock_queue_tail', 1)  # Slot 1 reserved, never written
+        self.adjust(self.products[:1], -8)
+        self.assertEqual(send_low_stock_digest(), [])
+        self.assertEqual([variant.product for variant in send_low_stock_digest()], self.products[:1])
+
+    def test_low_sizes_are_reported_even_if_the_product_total_is_not_low(self):
+        small, medium = Size.objects.create(name='S'), Size.objects.create(name='M')
+        dress = Product.objects.create(name='Dress', category=self.products[0].category, price=50)
+        with self.captureOnCommitCallbacks(execute=True):
+            ProductVariant.objects.create(product=dress, size=small, stock=1)
+            ProductVariant.objects.create(product=dress, size=medium, stock=20)
+        self.assertEqual([str(variant) for variant in send_low_stock_digest()], ['Dress (S)'])
+        self.assertIn('Dress (S) (ID: %d): 1 left' % dress.pk, mail.outbox[0].body)
+
+class StockConcurrencyTests(TransactionTestCase):
+    def test_concurrent_checkouts_never_oversell(self):
+        out = StringIO()
+        call_command('stress_checkout', threads=6, orders=60, stock=25, stdout=out)
+        self.assertIn('25 paid, 35 sold out', out.getvalue())
+        self.assertFalse(Product.objects.exists())
+
+    def test_concurrent_hot_checkouts_never_oversell(self):
+        out = StringIO()
+        call_command('stress_checkout', threads=4, orders=30, stock=12, hot=True, stdout=out)
+        self.assertIn('12 paid, 18 sold out', out.getvalue())
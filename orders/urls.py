@@ -6,7 +6,7 @@ app_name = 'orders'
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from .views import (
-    CartViewSet, CartItemViewSet, OrderViewSet, OrderItemViewSet, 
+    CartViewSet, CartItemViewSet, GuestCartItemViewSet, OrderViewSet, OrderItemViewSet, 
     CheckoutView, PaymentWebhookView, apply_coupon
 )
 
@@ -14,6 +14,7 @@ from .views import (
 router = DefaultRouter()
 router.register(r'carts', CartViewSet, basename='cart')
 router.register(r'cart-items', CartItemViewSet, basename='cart-item')
+router.register(r'guest-cart-items', GuestCartItemViewSet, basename='guest-cart-item')
 router.register(r'orders', OrderViewSet, basename='order')
 router.register(r'order-items', OrderItemViewSet, basename='order-item')
 
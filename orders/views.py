@@ -3,31 +3,53 @@ from rest_framework.decorators import action, api_view, permission_classes
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from django.shortcuts import get_object_or_404, redirect
+from django.urls import reverse
 from django.contrib import messages
 from django.contrib.admin.views.decorators import staff_member_required
 from django.utils.decorators import method_decorator
 from django.views.decorators.http import require_POST
-from django.http import JsonResponse
+from django.http import Http404, JsonResponse
 from django.views import View
 from django.db import transaction
-from decimal import Decimal
+from django.db.models import F, Prefetch, prefetch_related_objects
+from django.db.models.functions import Greatest
+import json
 import stripe
 from django.conf import settings
-from .models import Cart, CartItem, Order, OrderItem
-from .serializers import CartSerializer, CartItemSerializer, OrderSerializer, OrderItemSerializer
-from store.models import Product, Coupon
+from .models import Cart, CartItem, Order, OrderItem, item_snapshot
+from .serializers import CartSerializer, CartItemSerializer, CartLineSerializer, GuestCartItemSerializer, OrderHistorySerializer, OrderSerializer, OrderItemSerializer
+from store.models import Product, Coupon, Size
+from store.conditional import ConditionalGetMixin, conditional_get
+from store.pagination import OrderCursorPagination
+from store.serializers import includes_field
+from store.stock import find_insufficient
+from .fulfillment import bulk_transition
+from .guest_cart import MAX_LINES, TOKEN_HEADER, get_guest_cart_backend, line_id, load_items, new_token
+from .idempotency import idempotent
+from .payments import create_payment_intent, retrieve_payment_intent, start_payment
+from .pricing import cart_pricing, invalidate_cart_pricing, valid_coupon
+from .webhooks import store_event
 from django.utils import timezone
 from orders.pdf_services import PDFService
-from channels.layers import get_channel_layer
-from asgiref.sync import async_to_sync
 from drf_yasg.utils import swagger_auto_schema
 from drf_yasg import openapi
-from rest_framework.permissions import IsAuthenticated, IsAdminUser, SAFE_METHODS
-from django.core.mail import mail_admins
+from rest_framework.permissions import AllowAny, IsAuthenticated, IsAdminUser, SAFE_METHODS
 
 # Configure Stripe
 stripe.api_key = settings.STRIPE_SECRET_KEY if hasattr(settings, 'STRIPE_SECRET_KEY') else 'sk_test_your_test_key'
 
+MAX_BULK_ORDERS = 5000  # Orders per bulk-transition request
+
+def catalog_products(request):
+    """Products with everything the nested product serializer will render."""
+    include_reviews = includes_field(request, 'reviews', default=False, prefix='product_')
+    include_variants = includes_field(request, 'variants', default=False, prefix='product_')
+    return Product.objects.with_catalog_data(include_reviews=include_reviews, include_variants=include_variants)
+
+def catalog_product_prefetch(request):
+    """Prefetch nested products with everything the product serializer will render."""
+    return Prefetch('product', queryset=catalog_products(request))
+
 class CartViewSet(viewsets.ModelViewSet):
     """
     API endpoint for managing the user's shopping cart.
@@ -42,7 +64,9 @@ class CartViewSet(viewsets.ModelViewSet):
         user = self.request.user
         if getattr(self, 'swagger_fake_view', False) or not user.is_authenticated:
             return Cart.objects.none()
-        return Cart.objects.filter(user=user)
+        return Cart.objects.filter(user=user).prefetch_related(
+            Prefetch('items', queryset=CartItem.objects.select_related('size').prefetch_related(catalog_product_prefetch(self.request)))
+        )
 
     def perform_create(self, serializer):
         """Create a cart for the current user if it doesn't exist."""
@@ -50,75 +74,241 @@ class CartViewSet(viewsets.ModelViewSet):
 
     @action(detail=False, methods=['get'])
     def total(self, request):
-        """Get the total value of the user's cart."""
-        user = request.user
-        cart = get_object_or_404(Cart, user=user)
-        cart_items = CartItem.objects.filter(cart=cart)
-        total = Decimal('0.00')
-        for item in cart_items:
-            total += item.product.price * item.quantity
-        return Response({'total': total})
+        """Get the pricing summary of the user's cart (with the applied coupon)."""
+        cart_id = get_object_or_404(Cart.objects.values_list('id', flat=True), user=request.user)
+        return Response(cart_pricing(cart_id, valid_coupon(request.session.get('applied_coupon'))))
 
 class CartItemViewSet(viewsets.ModelViewSet):
     """
     API endpoint for managing items in the user's cart.
-    Supports CRUD operations and quantity updates.
+    Supports CRUD operations and quantity updates. A cart has one line per
+    product and size: adding an existing line adds to its quantity, and
+    updates only change quantities.
     """
     serializer_class = CartItemSerializer
     permission_classes = [IsAuthenticated]
     swagger_tags = ['Orders']
+    max_lines = 100  # Lines per set-lines request
 
     def get_queryset(self):
         user = self.request.user
         if getattr(self, 'swagger_fake_view', False) or not user.is_authenticated:
             return CartItem.objects.none()
-        return CartItem.objects.filter(cart__user=user)
+        return CartItem.objects.filter(cart__user=user).select_related('size').prefetch_related(catalog_product_prefetch(self.request))
 
-    def perform_create(self, serializer):
-        """Add an item to the user's cart, creating the cart if needed."""
-        user = self.request.user
-        cart, created = Cart.objects.get_or_create(user=user)
-        serializer.save(cart=cart)
+    def create(self, request, *args, **kwargs):
+        """Add an item to the user's cart (creating the cart if needed) with one atomic upsert."""
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        product, size = serializer.validated_data['product'], serializer.validated_data.get('size')
+        cart = Cart.objects.get_or_create(user=request.user)[0]
+        CartItem.objects.upsert_lines(cart.id, {(product.pk, size.pk if size else None): serializer.validated_data.get('quantity', 1)})
+        invalidate_cart_pricing(cart.id)
+        item = self.get_queryset().get(cart=cart, product=product, size=size)
+        return Response(self.get_serializer(item).data, status=status.HTTP_201_CREATED)
+
+    @action(detail=False, methods=['put'], url_path='set-lines')
+    def set_lines(self, request):
+        """
+        Replace the user's cart with the given lines ([{product_id, size_id, quantity}],
+        quantity 0 removes a line) in one transaction; returns the cart items.
+        """
+        serializer = CartLineSerializer(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+        if len(serializer.validated_data) > self.max_lines:
+            return Response({'error': f'At most {self.max_lines} lines per request.'}, status=status.HTTP_400_BAD_REQUEST)
+        quantities = {}
+        for line in serializer.validated_data:
+            key = (line['product_id'], line.get('size_id'))
+            quantities[key] = quantities.get(key, 0) + line['quantity']
+        # Unknown products and sizes in two queries rather than one per line
+        product_ids = {product_id for product_id, _ in quantities}
+        size_ids = {size_id for _, size_id in quantities if size_id is not None}
+        unknown = {
+            'product_id': sorted(product_ids - set(Product.objects.filter(pk__in=product_ids).values_list('pk', flat=True))),
+            'size_id': sorted(size_ids - set(Size.objects.filter(pk__in=size_ids).values_list('pk', flat=True))),
+        }
+        if unknown['product_id'] or unknown['size_id']:
+            return Response({'error': 'Unknown products or sizes', **unknown}, status=status.HTTP_400_BAD_REQUEST)
+        quantities = {key: quantity for key, quantity in quantities.items() if quantity > 0}
+        with transaction.atomic():
+            cart = Cart.objects.get_or_create(user=request.user)[0]
+            removed = [pk for pk, *key in CartItem.objects.filter(cart=cart).values_list('pk', 'product_id', 'size_id') if tuple(key) not in quantities]
+            if removed:
+                CartItem.objects.filter(pk__in=removed).delete()
+            CartItem.objects.upsert_lines(cart.id, quantities, increment=False)
+            invalidate_cart_pricing(cart.id)
+        serializer = self.get_serializer(self.get_queryset().filter(cart=cart).order_by('id'), many=True)
+        return Response(serializer.data)
 
     @action(detail=True, methods=['patch'])
     def update_quantity(self, request, pk=None):
-        """Update the quantity of a cart item or remove it if quantity <= 0."""
-        cart_item = self.get_object()
-        quantity = request.data.get('quantity', 1)
-        if quantity <= 0:
-            cart_item.delete()
+        """
+        Set the quantity of a cart item (quantity) or change it by delta, in one UPDATE;
+        the item is removed when its quantity drops to 0 or below.
+        """
+        try:
+            delta = int(request.data['delta']) if 'delta' in request.data else None
+            quantity = int(request.data.get('quantity', 1))
+        except (TypeError, ValueError):
+            return Response({'error': 'quantity and delta must be integers'}, status=status.HTTP_400_BAD_REQUEST)
+        if not str(pk).isdigit():
+            raise Http404  # Like get_object() for a malformed id
+        items = self.get_queryset().filter(pk=pk)
+        new_quantity = Greatest(F('quantity') + delta, 0) if delta is not None else max(quantity, 0)
+        cart_id = items.values_list('cart_id', flat=True).first()
+        if cart_id is None or not CartItem.objects.filter(pk=pk).update(quantity=new_quantity):
+            raise Http404
+        invalidate_cart_pricing(cart_id)
+        if CartItem.objects.filter(pk=pk, quantity=0).delete()[0]:
             return Response({'message': 'Item removed from cart'})
-        cart_item.quantity = quantity
-        cart_item.save()
-        serializer = self.get_serializer(cart_item)
+        serializer = self.get_serializer(items.get())
         return Response(serializer.data)
 
-class OrderViewSet(viewsets.ModelViewSet):
+class GuestCartItemViewSet(viewsets.ViewSet):
+    """
+    API endpoint for the items of an anonymous guest cart (kept in Redis, see orders.guest_cart).
+    Same operations as the cart items endpoint. The cart is identified by the
+    X-Cart-Token header, which is returned when the first item is added; updates
+    only change quantities. The cart is merged into the user's cart on login/registration.
+    """
+    permission_classes = [AllowAny]
+    swagger_tags = ['Orders']
+
+    def get_token(self):
+        return self.request.headers.get(TOKEN_HEADER)
+
+    def get_items(self, lines):
+        return load_items(lines, catalog_products(self.request))
+
+    def get_item(self, token, pk):
+        """Return the item pk of the token's cart, or raise Http404."""
+        lines = get_guest_cart_backend().lines(token) if token else {}
+        items = self.get_items({pk: lines[pk]}) if pk in lines else []
+        if not items:
+            raise Http404
+        return items[0]
+
+    def respond(self, data, token, status_code=status.HTTP_200_OK):
+        response = Response(data, status=status_code)
+        if token:
+            response[TOKEN_HEADER] = token
+        return response
+
+    def list(self, request):
+        token = self.get_token()
+        lines = get_guest_cart_backend().lines(token) if token else {}
+        serializer = GuestCartItemSerializer(self.get_items(lines), many=True, context={'request': request})
+        return self.respond(serializer.data, token)
+
+    def create(self, request):
+        """Add an item to the guest cart (starting a new cart without X-Cart-Token)."""
+        serializer = GuestCartItemSerializer(data=request.data, context={'request': request})
+        serializer.is_valid(raise_exception=True)
+        product, size = serializer.validated_data['product'], serializer.validated_data.get('size')
+        token = self.get_token() or new_token()
+        backend = get_guest_cart_backend()
+        line = line_id(product.pk, size.pk if size else None)
+        lines = backend.lines(token)
+        if line not in lines and len(lines) >= MAX_LINES:
+            return self.respond({'error': f'A guest cart holds at most {MAX_LINES} items.'}, token, status.HTTP_400_BAD_REQUEST)
+        quantity = backend.add(token, line, serializer.validated_data['quantity'])
+        item = self.get_items({line: quantity})[0]
+        return self.respond(GuestCartItemSerializer(item, context={'request': request}).data, token, status.HTTP_201_CREATED)
+
+    def retrieve(self, request, pk=None):
+        token = self.get_token()
+        return self.respond(GuestCartItemSerializer(self.get_item(token, pk), context={'request': request}).data, token)
+
+    def update(self, request, pk=None):
+        """Set the quantity of a guest cart item."""
+        token = self.get_token()
+        item = self.get_item(token, pk)
+        serializer = GuestCartItemSerializer(item, data=request.data, partial=True, context={'request': request})
+        serializer.is_valid(raise_exception=True)
+        item.quantity = serializer.validated_data.get('quantity', item.quantity)
+        get_guest_cart_backend().set(token, pk, item.quantity)
+        return self.respond(GuestCartItemSerializer(item, context={'request': request}).data, token)
+
+    def partial_update(self, request, pk=None):
+        return self.update(request, pk)
+
+    def destroy(self, request, pk=None):
+        token = self.get_token()
+        if not token or not get_guest_cart_backend().remove(token, pk):
+            raise Http404
+        return self.respond(None, token, status.HTTP_204_NO_CONTENT)
+
+    @action(detail=True, methods=['patch'])
+    def update_quantity(self, request, pk=None):
+        """Update the quantity of a guest cart item or remove it if quantity <= 0."""
+        token = self.get_token()
+        item = self.get_item(token, pk)
+        try:
+            quantity = int(request.data.get('quantity', 1))
+        except (TypeError, ValueError):
+            return self.respond({'error': 'quantity must be an integer'}, token, status.HTTP_400_BAD_REQUEST)
+        if quantity <= 0:
+            get_guest_cart_backend().remove(token, pk)
+            return self.respond({'message': 'Item removed from cart'}, token)
+        item.quantity = quantity
+        get_guest_cart_backend().set(token, pk, quantity)
+        return self.respond(GuestCartItemSerializer(item, context={'request': request}).data, token)
+
+class OrderViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     """
     API endpoint for managing user orders.
     Supports CRUD, order details, PDF receipt, and order history.
+    List, retrieve and history answer conditional GETs (ETag / Last-Modified).
     """
     serializer_class = OrderSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = OrderCursorPagination
     swagger_tags = ['Orders']
+    history_actions = ['history', 'order_details']  # Render item snapshots (OrderHistorySerializer)
+
+    def renders_products(self):
+        """Whether the response nests products (always, except history without ?item_expand=product)."""
+        return self.action not in self.history_actions or includes_field(self.request, 'product', default=False, prefix='item_')
+
+    @property
+    def validator_timestamp_fields(self):
+        # Nested products must move the validators when they change; snapshots do not change
+        return ['updated_at', 'items__product__updated_at'] if self.renders_products() else ['updated_at']
+
+    def get_serializer_class(self):
+        return OrderHistorySerializer if self.action in self.history_actions else OrderSerializer
 
     def get_queryset(self):
         user = self.request.user
         if getattr(self, 'swagger_fake_view', False) or not user.is_authenticated:
             return Order.objects.none()
+        if self.renders_products():
+            items = OrderItem.objects.select_related('size').prefetch_related(catalog_product_prefetch(self.request))
+        else:
+            items = OrderItem.objects.all()
+        orders = Order.objects.prefetch_related(Prefetch('items', queryset=items))
         if user.is_staff:
-            return Order.objects.all()
-        return Order.objects.filter(user=user)
+            return orders
+        return orders.filter(user=user)
 
     def perform_create(self, serializer):
         """Create a new order for the current user."""
         serializer.save(user=self.request.user)
 
+    @conditional_get
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @conditional_get
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
     @action(detail=True, methods=['get'])
     def order_details(self, request, pk=None):
         """Get details for a specific order."""
         order = self.get_object()
-        serializer = OrderSerializer(order)
+        serializer = self.get_serializer(order)
         return Response(serializer.data)
 
     @action(detail=True, methods=['get'])
@@ -128,17 +318,15 @@ class OrderViewSet(viewsets.ModelViewSet):
         return PDFService.get_order_receipt_response(order)
 
     @action(detail=False, methods=['get'])
+    @conditional_get
     def history(self, request):
-        """Get the user's order history with pagination."""
-        orders = self.get_queryset().order_by('-created_at')
-        page = self.paginate_queryset(orders)
-        if page is not None:
-            serializer = self.get_serializer(page, many=True)
-            return self.get_paginated_response(serializer.data)
-        serializer = self.get_serializer(orders, many=True)
-        return Response(serializer.data)
+        """Get the user's order history (item snapshots) with cursor pagination (newest first)."""
+        page = self.paginate_queryset(self.get_queryset())
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
 
     @action(detail=True, methods=['post'], url_path='cancel')
+    @idempotent
     def cancel_order(self, request, pk=None):
         """Allow user to cancel their own pending order."""
         order = self.get_object()
@@ -152,6 +340,47 @@ class OrderViewSet(viewsets.ModelViewSet):
             return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
         return Response({'success': True, 'message': f'Order #{order.id} cancelled.'})
 
+    @action(detail=True, methods=['post'], url_path='retry-payment')
+    def retry_payment(self, request, pk=None):
+        """Start the Stripe payment of a pending order again (after checkout could not reach Stripe)."""
+        order = self.get_object()
+        if order.user != request.user:
+            return Response({'error': 'You do not have permission to pay this order.'}, status=status.HTTP_403_FORBIDDEN)
+        if order.status != 'pending':
+            return Response({'error': 'Only pending orders can be paid.'}, status=status.HTTP_400_BAD_REQUEST)
+        attempt = order.payment_attempts.order_by('-id').first()
+        if attempt and attempt.status == 'created':
+            # Already started: hand out the existing PaymentIntent
+            try:
+                intent, error = retrieve_payment_intent(attempt), ''
+            except stripe.StripeError as e:
+                intent, error = None, str(e)
+        else:
+            attempt = start_payment(order)
+            intent, error = create_payment_intent(attempt), attempt.last_error
+        if intent is None:
+            return Response({'error': f'Payment could not be started: {error}'}, status=status.HTTP_502_BAD_GATEWAY)
+        return Response({'client_secret': intent.client_secret, 'payment_intent_id': intent.id})
+
+    @action(detail=False, methods=['post'], url_path='bulk-transition', permission_classes=[IsAdminUser])
+    @idempotent
+    def bulk_transition(self, request):
+        """
+        Move many orders to a status at once (staff fulfillment):
+        {"order_ids": [...], "status": "shipped"}. Orders whose transition is
+        invalid are skipped and listed in errors.
+        """
+        order_ids = request.data.get('order_ids')
+        new_status = request.data.get('status')
+        if new_status not in Order.TRANSITIONS:
+            return Response({'error': 'Invalid status'}, status=status.HTTP_400_BAD_REQUEST)
+        if not isinstance(order_ids, list) or not all(isinstance(order_id, int) for order_id in order_ids):
+            return Response({'error': 'order_ids must be a list of order ids'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(order_ids) > MAX_BULK_ORDERS:
+            return Response({'error': f'At most {MAX_BULK_ORDERS} orders per request'}, status=status.HTTP_400_BAD_REQUEST)
+        updated, rejected = bulk_transition(order_ids, new_status, user=request.user)
+        return Response({'updated': updated, 'errors': {str(order_id): error for order_id, error in rejected.items()}})
+
 class OrderItemViewSet(viewsets.ModelViewSet):
     """
     API endpoint for managing items in an order.
@@ -164,12 +393,14 @@ class OrderItemViewSet(viewsets.ModelViewSet):
         user = self.request.user
         if getattr(self, 'swagger_fake_view', False) or not user.is_authenticated:
             return OrderItem.objects.none()
+        items = OrderItem.objects.select_related('size').prefetch_related(catalog_product_prefetch(self.request))
         if user.is_staff:
-            return OrderItem.objects.all()
-        return OrderItem.objects.filter(order__user=user)
+            return items
+        return items.filter(order__user=user)
 
 @api_view(['POST'])
 @permission_classes([permissions.IsAuthenticated])
+@idempotent
 def apply_coupon(request):
     """
     Apply a coupon code to the current user's session/cart.
@@ -193,124 +424,89 @@ class CheckoutView(APIView):
     """
     API endpoint for checking out the user's cart and creating an order.
     Handles coupon, payment intent, and order creation.
+    The order is committed first; the Stripe PaymentIntent is created after
+    the commit (see orders.payments), so no transaction waits on Stripe.
+    Retries sent with the same Idempotency-Key get the first response back.
     """
     permission_classes = [IsAuthenticated]
 
-    @transaction.atomic
+    @idempotent
     def post(self, request):
         user = request.user
-        cart = get_object_or_404(Cart, user=user)
-        cart_items = CartItem.objects.filter(cart=cart)
-        if not cart_items.exists():
-            return Response({'error': 'Cart is empty'}, status=status.HTTP_400_BAD_REQUEST)
-        # Check stock for all items
-        for item in cart_items.select_related('product'):
-            if item.product.stock < item.quantity:
-                return Response({'error': f'Not enough stock for {item.product.name}'}, status=status.HTTP_400_BAD_REQUEST)
-        # Calculate total
-        total = Decimal('0.00')
-        for item in cart_items:
-            total += item.product.get_discounted_price() * item.quantity
-        # Apply coupon if present
-        coupon_code = request.session.get('applied_coupon')
-        coupon = None
-        if coupon_code:
-            try:
-                coupon = Coupon.objects.get(code=coupon_code, active=True)
-                if coupon.expiry and coupon.expiry < timezone.now():
-                    coupon = None
-                elif coupon.usage_limit and coupon.used_count >= coupon.usage_limit:
-                    coupon = None
-            except Coupon.DoesNotExist:
-                coupon = None
-        if coupon:
-            total = total * (1 - coupon.discount / 100)
-            coupon.used_count += 1
-            coupon.save()
-            # Optionally, clear coupon after use
-            del request.session['applied_coupon']
-        # Create order
-        order = Order.objects.create(user=user, total=total)
-        # Create order items
-        for cart_item in cart_items:
-            OrderItem.objects.create(
-                order=order,
-                product=cart_item.product,
-                size=cart_item.size,
-                quantity=cart_item.quantity,
-                price=cart_item.product.get_discounted_price()
-            )
-        # Clear cart
-        cart_items.delete()
-        # Send order confirmation email (removed)
-        # Create Stripe payment intent
-        try:
-            intent = stripe.PaymentIntent.create(
-                amount=int(total * 100),  # Convert to cents
-                currency='usd',
-                metadata={'order_id': order.id}
-            )
+        with transaction.atomic():
+            cart = get_object_or_404(Cart, user=user)
+            # Load the cart once, joined with its products and sizes (images for the item snapshots)
+            cart_items = list(CartItem.objects.filter(cart=cart).select_related('product', 'size').prefetch_related('product__images').order_by('id'))
+            if not cart_items:
+                return Response({'error': 'Cart is empty'}, status=status.HTTP_400_BAD_REQUEST)
+            # Check stock of the ordered variants (product x size) in one query; stock is taken on payment
+            quantities = {}
+            for item in cart_items:
+                key = (item.product_id, item.size_id)
+                quantities[key] = quantities.get(key, 0) + item.quantity
+            insufficient = find_insufficient(quantities)
+            if insufficient:
+                return Response({'error': f'Not enough stock for {insufficient[0]}'}, status=status.HTTP_400_BAD_REQUEST)
+            # Price the cart like the cart total (recomputed, not read from the cache) with the session coupon
+            coupon = valid_coupon(request.session.get('applied_coupon'))
+            total = cart_pricing(cart.id, coupon, refresh=True)['total']
+            prices = [item.product.get_discounted_price() for item in cart_items]
+            if coupon:
+                coupon.used_count += 1
+                coupon.save()
+                # Optionally, clear coupon after use
+                del request.session['applied_coupon']
+            # Create order
+            order = Order.objects.create(user=user, total=total)
+            # Create order items in one INSERT
+            OrderItem.objects.bulk_create([
+                OrderItem(order=order, product=item.product, size=item.size, quantity=item.quantity, price=price, **item_snapshot(item.product, item.size))
+                for item, price in zip(cart_items, prices)
+            ])
+            # Clear cart
+            CartItem.objects.filter(pk__in=[item.pk for item in cart_items]).delete()
+            # Record the payment attempt; Stripe is called once this commits
+            attempt = start_payment(order)
+        # Create Stripe payment intent (retried with the attempt's idempotency key)
+        intent = create_payment_intent(attempt)
+        # Items with their products in a fixed number of queries for the response
+        prefetch_related_objects([order], Prefetch(
+            'items', queryset=OrderItem.objects.select_related('size').prefetch_related(catalog_product_prefetch(request)),
+        ))
+        if intent is None:
+            # The order stays pending; the client retries the payment only
             return Response({
+                'error': f'Payment could not be started: {attempt.last_error}',
                 'order': OrderSerializer(order).data,
-                'client_secret': intent.client_secret,
-                'payment_intent_id': intent.id
-            })
-        except Exception as e:
-            # If Stripe fails, delete the order
-            order.delete()
-            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+                'retry_url': reverse('orders:order-retry-payment', args=[order.id]),
+            }, status=status.HTTP_502_BAD_GATEWAY)
+        return Response({
+            'order': OrderSerializer(order).data,
+            'client_secret': intent.client_secret,
+            'payment_intent_id': intent.id
+        })
 
 class PaymentWebhookView(APIView):
     """
     Stripe webhook endpoint to update order status after payment.
+    Verified events are stored in the StripeEvent inbox and acknowledged
+    right away; the process_stripe_events worker applies them (see orders.webhooks).
     """
     permission_classes = [permissions.AllowAny]
 
     def post(self, request):
-        """Handle Stripe webhook for payment confirmation."""
+        """Verify and store a Stripe webhook event."""
         payload = request.body
         sig_header = request.META.get('HTTP_STRIPE_SIGNATURE')
         try:
-            event = stripe.Webhook.construct_event(
+            stripe.Webhook.construct_event(
                 payload, sig_header, settings.STRIPE_WEBHOOK_SECRET if hasattr(settings, 'STRIPE_WEBHOOK_SECRET') else 'whsec_your_webhook_secret'
             )
         except ValueError as e:
             return Response({'error': 'Invalid payload'}, status=status.HTTP_400_BAD_REQUEST)
         except stripe.error.SignatureVerificationError as e:
             return Response({'error': 'Invalid signature'}, status=status.HTTP_400_BAD_REQUEST)
-        if event['type'] == 'payment_intent.succeeded':
-            payment_intent = event['data']['object']
-            order_id = payment_intent['metadata']['order_id']
-            try:
-                order = Order.objects.get(id=order_id)
-                try:
-                    order.transition_status('paid')
-                except ValueError as e:
-                    return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
-                # Real-time broadcast to user via Channels
-                channel_layer = get_channel_layer()
-                async_to_sync(channel_layer.group_send)(
-                    f"orders_{order.user.id}",
-                    {
-                        'type': 'order_status_update',
-                        'order_id': order.id,
-                        'status': order.status,
-                        'message': f'Order #{order.id} marked as paid (via Stripe webhook).'
-                    }
-                )
-            except Order.DoesNotExist:
-                pass
-        # --- Admin notification for failed payments ---
-        if event['type'] == 'payment_intent.payment_failed':
-            payment_intent = event['data']['object']
-            order_id = payment_intent['metadata'].get('order_id') if 'metadata' in payment_intent else None
-            user_email = payment_intent.get('receipt_email') or payment_intent.get('customer_email')
-            amount = payment_intent.get('amount')
-            currency = payment_intent.get('currency')
-            failure_message = payment_intent.get('last_payment_error', {}).get('message', 'Unknown error')
-            subject = f"[YD Bloom] Stripe Payment Failed for Order {order_id or '(unknown)'}"
-            message = f"A Stripe payment failed.\nOrder ID: {order_id}\nUser Email: {user_email}\nAmount: {amount} {currency}\nReason: {failure_message}"
-            mail_admins(subject, message, fail_silently=True)
+        store_event(json.loads(payload))  # Verified above
         return Response({'status': 'success'})
 
 @staff_member_required
@@ -326,17 +522,6 @@ def mark_order_paid(request, order_id):
     except ValueError as e:
         messages.error(request, str(e))
         return redirect('admin:orders_order_changelist')
-    # Real-time broadcast to user via Channels
-    channel_layer = get_channel_layer()
-    async_to_sync(channel_layer.group_send)(
-        f"orders_{order.user.id}",
-        {
-            'type': 'order_status_update',
-            'order_id': order.id,
-            'status': order.status,
-            'message': f'Order #{order.id} marked as paid.'
-        }
-    )
     messages.success(request, f"Order #{order.id} marked as paid.")
     return redirect('admin:orders_order_changelist')
 
@@ -353,17 +538,6 @@ def mark_order_shipped(request, order_id):
     except ValueError as e:
         messages.error(request, str(e))
         return redirect('admin:orders_order_changelist')
-    # Real-time broadcast to user via Channels
-    channel_layer = get_channel_layer()
-    async_to_sync(channel_layer.group_send)(
-        f"orders_{order.user.id}",
-        {
-            'type': 'order_status_update',
-            'order_id': order.id,
-            'status': order.status,
-            'message': f'Order #{order.id} marked as shipped.'
-        }
-    )
     messages.success(request, f"Order #{order.id} marked as shipped.")
     return redirect('admin:orders_order_changelist')
 
@@ -380,17 +554,6 @@ def mark_order_delivered(request, order_id):
     except ValueError as e:
         messages.error(request, str(e))
         return redirect('admin:orders_order_changelist')
-    # Real-time broadcast to user via Channels
-    channel_layer = get_channel_layer()
-    async_to_sync(channel_layer.group_send)(
-        f"orders_{order.user.id}",
-        {
-            'type': 'order_status_update',
-            'order_id': order.id,
-            'status': order.status,
-            'message': f'Order #{order.id} marked as delivered.'
-        }
-    )
     messages.success(request, f"Order #{order.id} marked as delivered.")
     return redirect('admin:orders_order_changelist')
 
@@ -400,6 +563,7 @@ class OrderStatusUpdateView(View):
     Admin view to update order status to any valid value.
     Broadcasts real-time update to user.
     """
+    @idempotent
     def post(self, request, order_id, status):
         order = get_object_or_404(Order, id=order_id)
         valid_statuses = ['pending', 'paid', 'shipped', 'delivered', 'cancelled']
@@ -409,17 +573,6 @@ class OrderStatusUpdateView(View):
             order.transition_status(status)
         except ValueError as e:
             return JsonResponse({'error': str(e)}, status=400)
-        # Real-time broadcast to user via Channels
-        channel_layer = get_channel_layer()
-        async_to_sync(channel_layer.group_send)(
-            f"orders_{order.user.id}",
-            {
-                'type': 'order_status_update',
-                'order_id': order.id,
-                'status': order.status,
-                'message': f'Order #{order.id} status updated to {status}'
-            }
-        )
         return JsonResponse({
             'success': True,
             'message': f'Order #{order.id} status updated to {status}',
@@ -0,0 +1,129 @@
+"""
+Stripe webhook inbox.
+
+The webhook view only verifies the signature and inserts the event into
+StripeEvent (one INSERT, duplicates of an event id are ignored), then
+answers 200, so Stripe gets its ack in a few milliseconds even under a
+burst and redeliveries are stored once. process_stripe_events() (the
+process_stripe_events command, run as a worker) handles the stored events:
+
+- Events are handled oldest first (Stripe creation time), and an event is
+  skipped while an earlier event of the same order is still pending, so
+  the events of one order are applied in order.
+- Each event is claimed with a conditional UPDATE that leases it for
+  CLAIM_TIMEOUT seconds (an event whose worker died is picked up again),
+  so several workers can run side by side. The handler then runs outside
+  of a transaction, as Order.transition_status requires: flash sale
+  (hot stock) units are only given back by its own rollback.
+- A failing event is retried MAX_ATTEMPTS times with doubling delays;
+  invalid order transitions (ValueError) are not retried. A payment for an
+  order that is short of stock (InsufficientStock) is retried, in case the
+  product is restocked, and logged each time. Admins get an email for
+  events that are given up.
+"""
+import logging
+from datetime import timedelta
+from django.core.mail import mail_admins
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from store.stock import InsufficientStock
+from .models import Order, PaymentAttempt, StripeEvent
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 5
+RETRY_DELAY = 30  # Seconds before the first retry (doubles)
+CLAIM_TIMEOUT = 5 * 60  # Seconds a worker holds a claimed event
+
+def store_event(event):
+    """Save a verified Stripe event (dict) in the inbox; a redelivered event id is ignored."""
+    payment_intent = event['data']['object']
+    order_id = (payment_intent.get('metadata') or {}).get('order_id')
+    StripeEvent.objects.bulk_create([StripeEvent(
+        event_id=event['id'],
+        type=event['type'],
+        payload=event,
+        order_id=int(order_id) if order_id else None,
+        stripe_created=event.get('created') or 0,
+    )], ignore_conflicts=True)
+
+def handle_payment_succeeded(event):
+    """Mark the order paid and tell its owner."""
+    payment_intent = event.payload['data']['object']
+    PaymentAttempt.objects.filter(payment_intent_id=payment_intent['id']).update(status='succeeded', updated_at=timezone.now())
+    order = Order.objects.filter(id=event.order_id).first()
+    if order is None or order.status == 'paid':
+        return  # Unknown order, or already paid
+    order.transition_status('paid')  # Publishes the status change to the user (see orders.events)
+
+def handle_payment_failed(event):
+    """Notify admins of a failed payment."""
+    payment_intent = event.payload['data']['object']
+    order_id = event.order_id
+    user_email = payment_intent.get('receipt_email') or payment_intent.get('customer_email')
+    amount = payment_intent.get('amount')
+    currency = payment_intent.get('currency')
+    failure_message = (payment_intent.get('last_payment_error') or {}).get('message', 'Unknown error')
+    subject = f"[YD Bloom] Stripe Payment Failed for Order {order_id or '(unknown)'}"
+    message = f"A Stripe payment failed.\nOrder ID: {order_id}\nUser Email: {user_email}\nAmount: {amount} {currency}\nReason: {failure_message}"
+    transaction.on_commit(lambda: mail_admins(subject, message, fail_silently=True))
+
+HANDLERS = {
+    'payment_intent.succeeded': handle_payment_succeeded,
+    'payment_intent.payment_failed': handle_payment_failed,
+}
+
+def _waits_for_earlier(event):
+    """Whether an earlier event of the same order is still pending."""
+    if event.order_id is None:
+        return False
+    return StripeEvent.objects.filter(order_id=event.order_id, status='pending').filter(
+        Q(stripe_created__lt=event.stripe_created) | Q(stripe_created=event.stripe_created, id__lt=event.id)
+    ).exists()
+
+def _process(event):
+    """Run the handler of a claimed event (outside of a transaction) and record the outcome."""
+    event.attempts += 1
+    try:
+        handler = HANDLERS.get(event.type)
+        if handler:
+            handler(event)
+    except Exception as e:
+        event.last_error = f'{type(e).__name__}: {e}'
+        if isinstance(e, InsufficientStock):
+            logger.warning('Order %s was paid but is short of stock (Stripe event %s, attempt %d): %s', event.order_id, event.event_id, event.attempts, e)
+        if (isinstance(e, ValueError) and not isinstance(e, InsufficientStock)) or event.attempts >= MAX_ATTEMPTS:
+            event.status = 'failed'
+            subject = f"[YD Bloom] Stripe event {event.event_id} could not be processed"
+            message = f"Event: {event.type} {event.event_id}\nOrder ID: {event.order_id}\nAttempts: {event.attempts}\nError: {event.last_error}"
+            if isinstance(e, InsufficientStock):
+                message += "\nThe customer was charged but the order is still pending: restock it or refund the payment."
+            transaction.on_commit(lambda: mail_admins(subject, message, fail_silently=True))
+        else:
+            event.next_attempt_at = timezone.now() + timedelta(seconds=RETRY_DELAY * 2 ** (event.attempts - 1))
+    else:
+        event.status, event.last_error, event.processed_at = 'processed', '', timezone.now()
+    event.save(update_fields=['status', 'attempts', 'last_error', 'next_attempt_at', 'processed_at'])
+    return event.status == 'processed'
+
+def _claim(event):
+    """Lease a due pending event to this worker for CLAIM_TIMEOUT; returns whether it was claimed."""
+    now = timezone.now()
+    return bool(StripeEvent.objects.filter(pk=event.pk, status='pending', next_attempt_at__lte=now).update(
+        next_attempt_at=now + timedelta(seconds=CLAIM_TIMEOUT),
+    ))
+
+def process_stripe_events(batch_size=100):
+    """
+    Handle up to batch_size due inbox events.
+    Call outside of a transaction. Returns the number of events processed successfully.
+    """
+    due = StripeEvent.objects.filter(status='pending', next_attempt_at__lte=timezone.now())
+    processed = 0
+    for pk in due.order_by('stripe_created', 'id').values_list('pk', flat=True)[:batch_size]:
+        event = StripeEvent.objects.filter(pk=pk, status='pending').first()
+        if event is None or _waits_for_earlier(event) or not _claim(event):
+            continue  # Handled or claimed by another worker, or blocked behind an earlier event of its order
+        processed += _process(event)
+    return processed
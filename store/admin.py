@@ -4,8 +4,11 @@ Admin customizations for the store app (products, categories, sizes, coupons, re
 from django.contrib import admin
 from django.utils.html import format_html
 from django.urls import reverse
-from django.db.models import Count, Sum, Avg
-from .models import Category, Size, Product, ProductImage, Coupon, Review
+from django.db.models import Count, Prefetch, Sum
+from .models import Category, Size, Product, ProductImage, ProductVariant, Coupon, Review
+from .cache import bump_catalog_version, bump_pricing_version
+from .images import rendition_urls
+from .stock import adjust_stock, low_stock_variants
 from django.utils import timezone
 from users.models import AdminActionLog
 from django.utils.timezone import now
@@ -102,12 +105,14 @@ class CouponAdmin(admin.ModelAdmin):
     def activate_coupons(self, request, queryset):
         """Bulk action: activate selected coupons."""
         queryset.update(active=True)
+        bump_catalog_version(Coupon)  # update() does not send post_save
         self.message_user(request, f"{queryset.count()} coupons activated.")
     activate_coupons.short_description = "Activate selected coupons"
 
     def deactivate_coupons(self, request, queryset):
         """Bulk action: deactivate selected coupons."""
         queryset.update(active=False)
+        bump_catalog_version(Coupon)
         self.message_user(request, f"{queryset.count()} coupons deactivated.")
     deactivate_coupons.short_description = "Deactivate selected coupons"
 
@@ -159,42 +164,63 @@ class ProductImageAdmin(admin.ModelAdmin):
     search_fields = ['product__name']
 
     def image_preview(self, obj):
-        """Show a small preview of the product image."""
+        """Show a small preview of the product image (thumbnail rendition when available)."""
         if obj.image:
-            return format_html('<img src="{}" style="max-height: 50px; max-width: 50px;" />', obj.image.url)
+            url = rendition_urls(obj).get('thumbnail', {}).get('jpeg', obj.image.url)
+            return format_html('<img src="{}" style="max-height: 50px; max-width: 50px;" />', url)
         return "No image"
     image_preview.short_description = 'Image'
 
+class ProductVariantInline(admin.TabularInline):
+    """
+    Inline stock per size; Product.stock is the sum of these rows.
+    """
+    model = ProductVariant
+    extra = 0
+    fields = ['size', 'stock', 'updated_at']
+    readonly_fields = ['updated_at']
+
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
     """
     Admin interface for Product model.
     Shows price, discount, stock, rating, and provides bulk actions.
     """
-    list_display = ['name', 'category', 'price', 'stock', 'low_stock_warning', 'created_at']
-    list_filter = ['category', 'created_at', 'stock']
-    search_fields = ['name', 'category__name']
+    list_display = ['name', 'category', 'price', 'stock', 'low_stock_warning', 'rating', 'created_at']
+    list_filter = ['category', 'created_at', 'stock', 'hot_stock']
+    search_fields = ['name', 'sku', 'category__name']
     filter_horizontal = ['sizes']
-    readonly_fields = ['created_at', 'updated_at']
+    readonly_fields = ['created_at', 'updated_at', 'rating_count', 'rating_average']
     ordering = ['-created_at']
+    inlines = [ProductVariantInline]
 
     fieldsets = (
         ('Basic Information', {
-            'fields': ('name', 'description', 'category', 'price', 'discount', 'colors')
+            'fields': ('name', 'sku', 'description', 'category', 'price', 'discount', 'colors')
         }),
         ('Inventory', {
-            'fields': ('stock', 'sizes')
+            'fields': ('stock', 'hot_stock', 'sizes')
         }),
         ('Promotions', {
             'fields': ('coupon',),
             'classes': ('collapse',)
         }),
         ('Metadata', {
-            'fields': ('created_at', 'updated_at'),
+            'fields': ('created_at', 'updated_at', 'rating_count', 'rating_average'),
             'classes': ('collapse',)
         }),
     )
 
+    def get_queryset(self, request):
+        # Stock warnings are checked per variant
+        return super().get_queryset(request).prefetch_related(Prefetch('variants', queryset=ProductVariant.objects.select_related('size')))
+
+    def get_readonly_fields(self, request, obj=None):
+        # After creation stock is the rollup of the variants (edited inline)
+        if obj is not None:
+            return [*self.readonly_fields, 'stock']
+        return self.readonly_fields
+
     def discounted_price(self, obj):
         """Show the discounted price (if any) with formatting."""
         if obj.discount > 0:
@@ -205,16 +231,20 @@ class ProductAdmin(admin.ModelAdmin):
 
     def rating(self, obj):
         """Show the average rating as stars and value."""
-        avg_rating = obj.reviews.aggregate(avg=Avg('rating'))['avg']
-        if avg_rating:
-            stars = '\u2b50' * int(avg_rating)
-            return format_html('{} ({:.1f})', stars, avg_rating)
+        if obj.rating_count:
+            stars = '\u2b50' * int(obj.rating_average)
+            return format_html('{} ({:.1f})', stars, obj.rating_average)
         return 'No ratings'
     rating.short_description = 'Rating'
+    rating.admin_order_field = 'rating_average'
+
+    def low_stock_levels(self, variants):
+        return ', '.join(f'{variant.size.name}: {variant.stock}' if variant.size else str(variant.stock) for variant in variants)
 
     def low_stock_warning(self, obj):
-        if obj.stock < 5:
-            return format_html('<span style="color: red; font-weight: bold;">LOW ({})</span>', obj.stock)
+        low = low_stock_variants(obj)
+        if low:
+            return format_html('<span style="color: red; font-weight: bold;">LOW ({})</span>', self.low_stock_levels(low))
         return obj.stock
     low_stock_warning.short_description = 'Stock Warning'
 
@@ -223,35 +253,40 @@ class ProductAdmin(admin.ModelAdmin):
     def apply_discount(self, request, queryset):
         """Bulk action: apply discount to selected products."""
         discount = request.POST.get('discount', 10)
-        queryset.update(discount=discount)
+        queryset.update(discount=discount, updated_at=timezone.now())
+        bump_catalog_version(Product)  # update() does not send post_save
+        bump_pricing_version()
         self.message_user(request, f"Applied {discount}% discount to {queryset.count()} products.")
     apply_discount.short_description = "Apply discount to selected products"
 
     def increase_stock(self, request, queryset):
         """Bulk action: increase stock for selected products."""
         amount = int(request.POST.get('amount', 10))
-        for product in queryset:
-            product.stock += amount
-            product.save()
-        self.message_user(request, f"Increased stock by {amount} for {queryset.count()} products.")
+        sized = adjust_stock(queryset, amount)
+        self.message_user(request, f"Increased stock by {amount} for {queryset.count() - len(sized)} products.")
+        self.warn_stocked_per_size(request, sized)
     increase_stock.short_description = "Increase stock for selected products"
 
     def decrease_stock(self, request, queryset):
         """Bulk action: decrease stock for selected products."""
         amount = int(request.POST.get('amount', 5))
-        for product in queryset:
-            product.stock = max(0, product.stock - amount)
-            product.save()
-        self.message_user(request, f"Decreased stock by {amount} for {queryset.count()} products.")
+        sized = adjust_stock(queryset, -amount)
+        self.message_user(request, f"Decreased stock by {amount} for {queryset.count() - len(sized)} products.")
+        self.warn_stocked_per_size(request, sized)
     decrease_stock.short_description = "Decrease stock for selected products"
 
+    def warn_stocked_per_size(self, request, product_ids):
+        if product_ids:
+            names = ', '.join(Product.objects.filter(pk__in=product_ids).order_by('name').values_list('name', flat=True))
+            self.message_user(request, f"Stock not changed for products stocked per size: {names}. Edit their sizes instead.", level='WARNING')
+
     def notify_low_stock(self, request, queryset):
-        low_stock = queryset.filter(stock__lt=5)
-        if not low_stock.exists():
+        low_stock = [(product, low) for product in queryset if (low := low_stock_variants(product))]
+        if not low_stock:
             self.message_user(request, "No low stock products selected.")
             return
         # Placeholder: send email to staff (implement as needed)
-        product_list = ', '.join([f'{p.name} (stock: {p.stock})' for p in low_stock])
+        product_list = ', '.join([f'{p.name} (stock: {self.low_stock_levels(low)})' for p, low in low_stock])
         self.message_user(request, f"Low stock alert for: {product_list}", level='WARNING')
     notify_low_stock.short_description = "Notify staff about low stock products"
 
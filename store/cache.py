@@ -0,0 +1,121 @@
+"""
+Versioned response cache for anonymous catalog reads.
+
+Every catalog model has a version counter in the shared cache. Cached
+responses are keyed on host, path, query string and the current versions of
+the models they depend on, so bumping a counter (store.signals) invalidates
+every dependent response in O(1); stale entries simply expire.
+"""
+import hashlib
+import time
+from functools import wraps
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework.response import Response
+
+CATALOG_VERSION_KEY = 'catalog_version_{}'  # model label
+CATALOG_RESPONSE_KEY = 'catalog_response_{}'  # hash of URL + versions
+CATALOG_OBJECT_KEY = 'catalog_object_{}'  # hash of URL + versions + object id
+CATALOG_RESPONSE_TIMEOUT = 60 * 10
+PRICING_VERSION_KEY = 'catalog_pricing_version'  # Product prices and discounts (cart pricing)
+
+def _version_key(model):
+    return CATALOG_VERSION_KEY.format(model._meta.label_lower)
+
+def _new_version():
+    # Time-based seed so a counter evicted from the cache never restarts at an old value
+    return int(time.time() * 1000)
+
+def get_catalog_versions(models):
+    """Return the current version counters for models, initializing missing ones."""
+    keys = [_version_key(model) for model in models]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, _new_version(), timeout=None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+def _incr_version(model):
+    _incr(_version_key(model))
+
+def _incr(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, _new_version(), timeout=None)
+
+def bump_catalog_version(model):
+    """
+    Invalidate cached responses that depend on model.
+    Bumped immediately and again on commit, so a response rebuilt from
+    pre-commit data by a concurrent request is not served afterwards.
+    """
+    _incr_version(model)
+    transaction.on_commit(lambda: _incr_version(model))
+
+def get_pricing_version():
+    """Return the product pricing counter, initializing it if missing."""
+    version = cache.get(PRICING_VERSION_KEY)
+    if version is None:
+        cache.add(PRICING_VERSION_KEY, _new_version(), timeout=None)
+        version = cache.get(PRICING_VERSION_KEY)
+    return version
+
+def bump_pricing_version():
+    """
+    Invalidate cached cart pricing (orders.pricing) after product prices or
+    discounts change; bumped immediately and again on commit like catalog versions.
+    """
+    _incr(PRICING_VERSION_KEY)
+    transaction.on_commit(lambda: _incr(PRICING_VERSION_KEY))
+
+def catalog_cache_key(request, models):
+    """Build the response cache key for request and the models it depends on."""
+    query = sorted((name, value) for name, values in request.query_params.lists() for value in values)
+    versions = get_catalog_versions(models)
+    raw = f'{request.get_host()}|{request.path}|{query}|{versions}'
+    return CATALOG_RESPONSE_KEY.format(hashlib.sha1(raw.encode()).hexdigest())
+
+def get_cached_catalog_objects(request, models, ids, build, exclude_params=()):
+    """
+    Return {id: representation} for ids, caching each object separately.
+    Entries are keyed like catalog_cache_key() (minus exclude_params) plus the id,
+    so overlapping requests share them; build(missing_ids) must return
+    {id: representation} for the ids not in the cache (absent ids are not cached).
+    """
+    query = sorted(
+        (name, value) for name, values in request.query_params.lists() if name not in exclude_params for value in values
+    )
+    versions = get_catalog_versions(models)
+    prefix = f'{request.get_host()}|{request.path}|{query}|{versions}'
+    keys = {pk: CATALOG_OBJECT_KEY.format(hashlib.sha1(f'{prefix}|{pk}'.encode()).hexdigest()) for pk in ids}
+    cached = cache.get_many(keys.values())
+    found = {pk: cached[key] for pk, key in keys.items() if key in cached}
+    missing = [pk for pk in ids if pk not in found]
+    if missing:
+        built = build(missing)
+        cache.set_many({keys[pk]: data for pk, data in built.items()}, timeout=CATALOG_RESPONSE_TIMEOUT)
+        found.update(built)
+    return found
+
+def cache_catalog_response(*models):
+    """
+    Decorator caching successful anonymous GET responses of a viewset method.
+    models are the catalog models the response is built from.
+    """
+    def decorator(view_method):
+        @wraps(view_method)
+        def wrapper(self, request, *args, **kwargs):
+            if request.method != 'GET' or request.user.is_authenticated:
+                return view_method(self, request, *args, **kwargs)
+            key = catalog_cache_key(request, models)
+            data = cache.get(key)
+            if data is not None:
+                return Response(data)
+            response = view_method(self, request, *args, **kwargs)
+            if response.status_code == 200:
+                cache.set(key, response.data, timeout=CATALOG_RESPONSE_TIMEOUT)
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,233 @@
+"""
+Streaming catalog import/export (used by the import_catalog and export_catalog commands).
+
+Rows are read and written through generators and applied in fixed-size
+chunks, so memory stays flat whatever the file size. Each chunk is one
+transaction: products are upserted on sku with bulk_create(update_conflicts=True)
+(one INSERT ... ON CONFLICT DO UPDATE per batch), sizes are bulk inserted
+into the m2m table, stock variants are replaced, and the search index and
+parsed colors are refreshed for the chunk (bulk writes do not send the
+post_save signals that normally do this).
+
+File columns (CSV header or JSONL keys): CATALOG_FIELDS. sizes are
+separated by '|' (colors stay comma-separated); JSONL may also use a list.
+A size may carry its stock as name:stock (e.g. S:5|M:3): such rows are
+stocked per size and stock is their sum, otherwise stock is held by the
+product's unsized variant.
+"""
+import csv
+import json
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+from django.db import transaction
+from django.db.models import Prefetch
+from .models import Category, Size, Coupon, Product, ProductColor, ProductVariant, parse_colors
+from .search import get_search_backend
+from .stock import refresh_stock_rollups
+
+CATALOG_FIELDS = ['sku', 'name', 'description', 'price', 'category', 'sizes', 'stock', 'colors', 'discount', 'coupon']
+SIZE_SEPARATOR = '|'
+SIZE_STOCK_SEPARATOR = ':'
+# Product columns overwritten when an imported sku already exists
+IMPORTED_FIELDS = ['name', 'description', 'price', 'category', 'stock', 'colors', 'discount', 'coupon', 'updated_at']
+
+class RowError(ValueError):
+    """A catalog row that cannot be imported."""
+
+def detect_format(path, fmt=None):
+    """Return 'csv' or 'jsonl' from an explicit format or the file extension."""
+    if fmt:
+        return fmt
+    return 'jsonl' if str(path).endswith(('.jsonl', '.ndjson')) else 'csv'
+
+def read_rows(stream, fmt):
+    """Yield (row number, dict) for every row of a CSV or JSONL stream."""
+    if fmt == 'csv':
+        for number, row in enumerate(csv.DictReader(stream), start=1):
+            yield number, row
+    else:
+        for number, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                yield number, json.loads(line)
+            except ValueError:
+                yield number, None  # Rejected by CatalogImporter.parse()
+
+def chunked(iterable, size):
+    """Yield lists of up to size items from iterable."""
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+class CatalogImporter:
+    """
+    Applies catalog rows to the database chunk by chunk.
+    Categories and sizes are resolved through in-memory maps (missing ones are
+    created), coupons by code (a missing coupon rejects the row).
+    """
+    def __init__(self):
+        self.categories = {category.name: category for category in Category.objects.all()}
+        self.sizes = {size.name: size for size in Size.objects.all()}
+        self.coupons = {coupon.code: coupon for coupon in Coupon.objects.all()}
+        self.search_backend = get_search_backend()
+
+    def create_missing_lookups(self, parsed):
+        """
+        Create categories and sizes referenced by parsed rows that do not exist yet.
+        Runs before (not inside) the chunk transaction, so a rolled-back chunk
+        never leaves unsaved objects in the lookup maps.
+        """
+        for values, size_stock in parsed:
+            if values['category'] not in self.categories:
+                self.categories[values['category']] = Category.objects.create(name=values['category'])
+            for name in size_stock:
+                if name not in self.sizes:
+                    self.sizes[name] = Size.objects.create(name=name)
+
+    def parse_sizes(self, sizes):
+        """Return {size name: stock or None} from a sizes value (S|M or S:5|M:3)."""
+        if isinstance(sizes, str):
+            sizes = sizes.split(SIZE_SEPARATOR)
+        size_stock = {}
+        for size in sizes:
+            name, separator, stock = str(size).partition(SIZE_STOCK_SEPARATOR)
+            if not name.strip():
+                continue
+            try:
+                size_stock[name.strip()] = int(stock) if separator else None
+            except ValueError:
+                raise RowError(f'invalid stock for size {name.strip()}')
+            if separator and size_stock[name.strip()] < 0:
+                raise RowError('stock cannot be negative')
+        return size_stock
+
+    def parse(self, row):
+        """Validate one row and return (product field values, {size name: stock or None})."""
+        if not isinstance(row, dict):
+            raise RowError('row is not a JSON object')
+        sku = str(row.get('sku') or '').strip()
+        name = str(row.get('name') or '').strip()
+        category = str(row.get('category') or '').strip()
+        if not sku or not name or not category:
+            raise RowError('sku, name and category are required')
+        try:
+            price = Decimal(str(row['price']))
+            discount = Decimal(str(row.get('discount') or 0))
+            stock = int(row.get('stock') or 0)
+        except (KeyError, InvalidOperation, ValueError):
+            raise RowError('invalid price, discount or stock')
+        if stock < 0:
+            raise RowError('stock cannot be negative')
+        coupon_code = str(row.get('coupon') or '').strip()
+        if coupon_code and coupon_code not in self.coupons:
+            raise RowError(f'unknown coupon {coupon_code}')
+        size_stock = self.parse_sizes(row.get('sizes') or [])
+        if any(count is not None for count in size_stock.values()):
+            stock = sum(count or 0 for count in size_stock.values())  # Stocked per size
+        values = {
+            'sku': sku,
+            'name': name,
+            'description': str(row.get('description') or ''),
+            'price': price,
+            'category': category,
+            'stock': stock,
+            'colors': str(row.get('colors') or ''),
+            'discount': discount,
+            'coupon': self.coupons.get(coupon_code),
+        }
+        return values, size_stock
+
+    def import_chunk(self, parsed):
+        """
+        Upsert a chunk of parsed rows in one transaction.
+        Returns (created, updated) counts.
+        """
+        self.create_missing_lookups(parsed)
+        rows = {values['sku']: (values, size_stock) for values, size_stock in parsed}  # Last row of a sku wins
+        with transaction.atomic():
+            existing = set(Product.objects.filter(sku__in=list(rows)).values_list('sku', flat=True))
+            products, sizes = [], []
+            for values, size_stock in rows.values():
+                product = Product(**dict(values, category=self.categories[values['category']]))
+                products.append(product)
+                sizes.append((product, {self.sizes[name]: count for name, count in size_stock.items()}))
+            # One INSERT ... ON CONFLICT (sku) DO UPDATE per batch; primary keys are returned for both cases
+            Product.objects.bulk_create(products, update_conflicts=True, unique_fields=['sku'], update_fields=IMPORTED_FIELDS)
+            self.replace_sizes(sizes)
+            self.replace_variants(sizes)
+            self.replace_colors(products)
+            self.search_backend.index_products(products)
+        return len(products) - len(existing), len(existing)
+
+    def replace_sizes(self, products_and_sizes):
+        Through = Product.sizes.through
+        Through.objects.filter(product__in=[product for product, _ in products_and_sizes]).delete()
+        Through.objects.bulk_create([
+            Through(product_id=product.pk, size_id=size.pk)
+            for product, sizes in products_and_sizes
+            for size in sizes
+        ])
+
+    def replace_variants(self, products_and_sizes):
+        """Replace the stock variants of the products (per size, or one unsized variant); stock equals their sum."""
+        ProductVariant.objects.filter(product__in=[product for product, _ in products_and_sizes]).delete()
+        variants = []
+        for product, size_stock in products_and_sizes:
+            if any(count is not None for count in size_stock.values()):
+                variants.extend(ProductVariant(product=product, size=size, stock=count or 0) for size, count in size_stock.items())
+            elif product.stock:
+                variants.append(ProductVariant(product=product, stock=product.stock))
+        ProductVariant.objects.bulk_create(variants)
+        refresh_stock_rollups(product.pk for product, _ in products_and_sizes)  # bulk_create sends no post_save
+
+    def replace_colors(self, products):
+        ProductColor.objects.filter(product__in=products).delete()
+        ProductColor.objects.bulk_create([
+            ProductColor(product=product, name=color)
+            for product in products
+            for color in parse_colors(product.colors)
+        ])
+
+def export_rows(queryset, chunk_size):
+    """Yield one dict per product (CATALOG_FIELDS), reading queryset in keyset-paginated chunks."""
+    variants = Prefetch('variants', queryset=ProductVariant.objects.filter(size__isnull=False))
+    queryset = queryset.select_related('category', 'coupon').prefetch_related('sizes', variants).order_by('pk')
+    last_pk = None
+    while True:
+        page = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+        products = list(page[:chunk_size])
+        if not products:
+            return
+        for product in products:
+            size_stock = {variant.size_id: variant.stock for variant in product.variants.all()}
+            sizes = [
+                f'{size.name}{SIZE_STOCK_SEPARATOR}{size_stock[size.pk]}' if size.pk in size_stock else size.name
+                for size in product.sizes.all()
+            ]
+            yield {
+                'sku': product.sku or '',
+                'name': product.name,
+                'description': product.description,
+                'price': str(product.price),
+                'category': product.category.name,
+                'sizes': SIZE_SEPARATOR.join(sizes),
+                'stock': product.stock,
+                'colors': product.colors,
+                'discount': str(product.discount),
+                'coupon': product.coupon.code if product.coupon else '',
+            }
+        last_pk = products[-1].pk
+
+def write_rows(stream, rows, fmt):
+    """Write rows to a CSV or JSONL stream, yielding after every row (for progress reporting)."""
+    if fmt == 'csv':
+        writer = csv.DictWriter(stream, fieldnames=CATALOG_FIELDS)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(row)
+            yield row
+    else:
+        for row in rows:
+            stream.write(json.dumps(row) + '\n')
+            yield row
@@ -0,0 +1,75 @@
+"""
+Conditional GET (ETag / Last-Modified) support for viewsets.
+
+Validators are computed with one aggregate query (row count and max
+updated_at of the rows a response is built from) before anything is
+serialized, so unchanged resources are answered with 304 Not Modified.
+Related rows (reviews, images, order items, ...) touch their parent's
+updated_at via signals, so they move the validators too.
+"""
+import hashlib
+from functools import wraps
+from django.core.exceptions import ValidationError
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+class ConditionalGetMixin:
+    """
+    Viewset mixin computing validators for list and retrieve actions.
+    Views set validator_timestamp_fields and may override get_validator_queryset().
+    """
+    validator_timestamp_fields = ['updated_at']
+
+    def get_validator_queryset(self):
+        """Queryset the response is built from (permission-scoped and filtered)."""
+        return self.filter_queryset(self.get_queryset())
+
+    def get_validators(self, request):
+        """
+        Return (etag, last_modified) for the current request.
+        Last-Modified is only given for single objects: a list can lose rows
+        without its max(updated_at) changing, so lists rely on the ETag.
+        """
+        queryset = self.get_validator_queryset()
+        detail = self.action == 'retrieve'
+        if detail:
+            lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+            try:
+                queryset = queryset.filter(**{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+            except (TypeError, ValueError, ValidationError):
+                return None, None  # Malformed lookup value: let get_object() answer 404
+        aggregates = {f'ts{i}': Max(field) for i, field in enumerate(self.validator_timestamp_fields)}
+        stats = queryset.order_by().aggregate(count=Count('pk', distinct=True), **aggregates)
+        if detail and not stats['count']:
+            return None, None  # Let the view answer 404
+        timestamps = [stats[name] for name in aggregates if stats[name] is not None]
+        query = sorted((name, value) for name, values in request.query_params.lists() for value in values)
+        raw = f'{request.user.pk}|{request.path}|{query}|{request.META.get("HTTP_ACCEPT", "")}|{stats["count"]}|{[ts.isoformat() for ts in timestamps]}'
+        etag = '"{}"'.format(hashlib.sha1(raw.encode()).hexdigest())
+        last_modified = int(max(timestamps).timestamp()) if detail and timestamps else None
+        return etag, last_modified
+
+def conditional_get(view_method):
+    """
+    Decorator answering If-None-Match / If-Modified-Since with 304 for GET
+    and adding ETag / Last-Modified headers to successful responses.
+    """
+    @wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        if request.method != 'GET':
+            return view_method(self, request, *args, **kwargs)
+        etag, last_modified = self.get_validators(request)
+        if etag is None:
+            return view_method(self, request, *args, **kwargs)
+        not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if not_modified is not None:
+            not_modified['ETag'] = etag
+            return not_modified
+        response = view_method(self, request, *args, **kwargs)
+        if response.status_code == 200:
+            response['ETag'] = etag
+            if last_modified is not None:
+                response['Last-Modified'] = http_date(last_modified)
+        return response
+    return wrapper
@@ -0,0 +1,57 @@
+"""
+Facet counts for the product catalog sidebar.
+
+Every facet is computed for the currently filtered products with one grouped
+query (categories, sizes, colors) or one conditional aggregate (price buckets),
+so the number of queries does not depend on how many values a facet has.
+"""
+from django.db.models import Count, Q
+from .models import Product, ProductColor
+
+# (label, lower bound inclusive, upper bound exclusive or None)
+PRICE_BUCKETS = [
+    ('0-25', 0, 25),
+    ('25-50', 25, 50),
+    ('50-100', 50, 100),
+    ('100-200', 100, 200),
+    ('200+', 200, None),
+]
+
+def price_bucket_condition(low, high):
+    condition = Q(price__gte=low)
+    if high is not None:
+        condition &= Q(price__lt=high)
+    return condition
+
+def product_facets(queryset):
+    """
+    Return category, size, color and price-bucket counts for the products in queryset.
+    """
+    product_ids = queryset.order_by().values('pk')
+    products = Product.objects.filter(pk__in=product_ids)
+    categories = (
+        products.values('category_id', 'category__name')
+        .annotate(count=Count('pk')).order_by('-count', 'category__name')
+    )
+    sizes = (
+        Product.sizes.through.objects.filter(product__in=product_ids)
+        .values('size_id', 'size__name')
+        .annotate(count=Count('product', distinct=True)).order_by('-count', 'size__name')
+    )
+    colors = (
+        ProductColor.objects.filter(product__in=product_ids)
+        .values('name')
+        .annotate(count=Count('product', distinct=True)).order_by('-count', 'name')
+    )
+    prices = products.aggregate(**{
+        label: Count('pk', filter=price_bucket_condition(low, high)) for label, low, high in PRICE_BUCKETS
+    })
+    return {
+        'categories': [{'id': row['category_id'], 'name': row['category__name'], 'count': row['count']} for row in categories],
+        'sizes': [{'id': row['size_id'], 'name': row['size__name'], 'count': row['count']} for row in sizes],
+        'colors': [{'name': row['name'], 'count': row['count']} for row in colors],
+        'price': [
+            {'label': label, 'min': low, 'max': high, 'count': prices[label]}
+            for label, low, high in PRICE_BUCKETS
+        ],
+    }
@@ -0,0 +1,27 @@
+"""
+FilterSets for store API endpoints.
+"""
+import django_filters
+from .models import Product
+
+class ProductFilter(django_filters.FilterSet):
+    """
+    Product filters: category, sizes and stock, ?color= (parsed colors),
+    ?in_stock_size= (size id with variant stock left), plus
+    ?min_rating= / ?max_rating= on the denormalized average rating.
+    """
+    color = django_filters.CharFilter(method='filter_color')
+    in_stock_size = django_filters.NumberFilter(method='filter_in_stock_size')
+    min_rating = django_filters.NumberFilter(field_name='rating_average', lookup_expr='gte')
+    max_rating = django_filters.NumberFilter(field_name='rating_average', lookup_expr='lte')
+
+    class Meta:
+        model = Product
+        fields = ['category', 'sizes', 'stock']
+
+    def filter_color(self, queryset, name, value):
+        return queryset.filter(parsed_colors__name=value.strip().lower())
+
+    def filter_in_stock_size(self, queryset, name, value):
+        # One variant per (product, size), so the join cannot duplicate products
+        return queryset.filter(variants__size=value, variants__stock__gt=0)
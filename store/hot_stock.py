@@ -0,0 +1,276 @@
+"""
+Hot stock counters for flash sales.
+
+Variants of products flagged with Product.hot_stock are not decremented in
+the database: their stock is an in-memory counter (Redis in production) that
+is taken atomically (all lines of an order or none, never below zero) by a
+single Lua script, so thousands of checkouts per second do not queue on the
+variant row lock. A counter starts from the variant's database stock the
+first time it is used.
+
+Every counter change appends a numbered entry to a journal in the same
+atomic step. flush_journal() (the flush_hot_stock command, run periodically)
+applies journal entries to ProductVariant.stock in one transaction that also
+stores the last applied sequence number (HotStockFlush), and only then trims
+the journal; entries at or below the stored sequence are skipped, so a
+flush that crashes between the commit and the trim never applies an entry
+twice. The checkpoint is tied to the counter store's epoch (a random id
+created with the store), so a Redis instance that lost its data and
+restarts its sequence at 1 is not mistaken for already applied entries;
+unflushed changes lost with such a store are lost for good, so run Redis
+with AOF persistence. Product.stock of hot products lags by up to one flush
+interval.
+
+While a product is hot its stock must be changed through the counters (the
+database value is overwritten by journal deltas, not read back); after
+turning hot_stock off, run flush_hot_stock so the counters are released.
+
+The backend is set with the STORE_HOT_STOCK_BACKEND setting (dotted path):
+RedisHotStockBackend (STORE_HOT_STOCK_REDIS_URL) or the single-process
+LocMemHotStockBackend used by the local SQLite setup.
+"""
+import json
+import threading
+import uuid
+import redis
+from collections import defaultdict
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from .models import HotStockFlush, ProductVariant
+
+class BaseHotStockBackend:
+    """
+    Interface for hot stock counter stores.
+    Counters are keyed by variant id; lines are {variant_id: (quantity, initial stock)}.
+    """
+    def apply(self, sign, lines):
+        """
+        Atomically add sign * quantity to every counter and journal the change.
+        When taking (sign=-1) and any counter is short, change nothing and return
+        the id of the first short variant; otherwise return None.
+        """
+        raise NotImplementedError
+
+    def counters(self, variant_ids):
+        """Return {variant_id: counter} for the variant ids that have a counter."""
+        raise NotImplementedError
+
+    def counter_ids(self):
+        """Return the ids of all variants that have a counter."""
+        raise NotImplementedError
+
+    def delete_counters(self, variant_ids):
+        """Drop the counters of variant_ids (the database becomes authoritative again)."""
+        raise NotImplementedError
+
+    def epoch(self):
+        """Return the id of this counter store (changes when its data is lost)."""
+        raise NotImplementedError
+
+    def read_journal(self, limit):
+        """Return up to limit oldest journal entries as [(sequence, {variant_id: delta})]."""
+        raise NotImplementedError
+
+    def trim_journal(self, sequence):
+        """Remove journal entries numbered up to sequence."""
+        raise NotImplementedError
+
+class LocMemHotStockBackend(BaseHotStockBackend):
+    """
+    Process-local counters (development and tests); not shared between workers or crash-safe.
+    """
+    lock = threading.Lock()
+    values = {}
+    journal = []
+    sequence = 0
+    store_epoch = uuid.uuid4().hex
+
+    def apply(self, sign, lines):
+        cls = type(self)
+        with cls.lock:
+            for variant_id, (_, initial) in lines.items():
+                cls.values.setdefault(variant_id, initial)
+            if sign < 0:
+                for variant_id, (quantity, _) in lines.items():
+                    if cls.values[variant_id] < quantity:
+                        return variant_id
+            for variant_id, (quantity, _) in lines.items():
+                cls.values[variant_id] += sign * quantity
+            cls.sequence += 1
+            cls.journal.append((cls.sequence, {variant_id: sign * quantity for variant_id, (quantity, _) in lines.items()}))
+        return None
+
+    def counters(self, variant_ids):
+        with self.lock:
+            return {variant_id: self.values[variant_id] for variant_id in variant_ids if variant_id in self.values}
+
+    def counter_ids(self):
+        with self.lock:
+            return list(self.values)
+
+    def delete_counters(self, variant_ids):
+        with self.lock:
+            for variant_id in variant_ids:
+                self.values.pop(variant_id, None)
+
+    def epoch(self):
+        return self.store_epoch
+
+    def read_journal(self, limit):
+        with self.lock:
+            return list(self.journal[:limit])
+
+    def trim_journal(self, sequence):
+        with self.lock:
+            self.journal[:] = [entry for entry in self.journal if entry[0] > sequence]
+
+class RedisHotStockBackend(BaseHotStockBackend):
+    """
+    Redis counters. All keys share the {hot_stock} hash tag so the Lua scripts
+    can touch several of them atomically (also on Redis Cluster).
+    """
+    prefix = '{hot_stock}'
+    # KEYS: journal, sequence, counters...  ARGV: sign, journal payload, then quantity/initial pairs
+    apply_script = """
+        local sign = tonumber(ARGV[1])
+        local count = #KEYS - 2
+        for i = 1, count do
+            local key = KEYS[i + 2]
+            redis.call('SET', key, ARGV[2 + 2 * i], 'NX')
+            if sign < 0 and tonumber(redis.call('GET', key)) < tonumber(ARGV[1 + 2 * i]) then
+                return i
+            end
+        end
+        for i = 1, count do
+            redis.call('INCRBY', KEYS[i + 2], sign * tonumber(ARGV[1 + 2 * i]))
+        end
+        local sequence = redis.call('INCR', KEYS[2])
+        redis.call('RPUSH', KEYS[1], sequence .. ' ' .. ARGV[2])
+        return 0
+    """
+    # KEYS: journal  ARGV: last applied sequence
+    trim_script = """
+        while true do
+            local entry = redis.call('LINDEX', KEYS[1], 0)
+            if not entry or tonumber(string.match(entry, '^%d+')) > tonumber(ARGV[1]) then
+                return
+            end
+            redis.call('LPOP', KEYS[1])
+        end
+    """
+
+    def __init__(self):
+        self.client = redis.Redis.from_url(settings.STORE_HOT_STOCK_REDIS_URL)
+        self.journal_key = f'{self.prefix}:journal'
+        self.sequence_key = f'{self.prefix}:sequence'
+        self.epoch_key = f'{self.prefix}:epoch'
+        self._apply = self.client.register_script(self.apply_script)
+        self._trim = self.client.register_script(self.trim_script)
+
+    def counter_key(self, variant_id):
+        return f'{self.prefix}:variant:{variant_id}'
+
+    def apply(self, sign, lines):
+        variant_ids = list(lines)
+        payload = json.dumps({variant_id: sign * quantity for variant_id, (quantity, _) in lines.items()})
+        args = [sign, payload]
+        for quantity, initial in lines.values():
+            args += [quantity, initial]
+        keys = [self.journal_key, self.sequence_key] + [self.counter_key(variant_id) for variant_id in variant_ids]
+        short = self._apply(keys=keys, args=args)
+        return variant_ids[short - 1] if short else None
+
+    def counters(self, variant_ids):
+        variant_ids = list(variant_ids)
+        if not variant_ids:
+            return {}
+        values = self.client.mget([self.counter_key(variant_id) for variant_id in variant_ids])
+        return {variant_id: int(value) for variant_id, value in zip(variant_ids, values) if value is not None}
+
+    def counter_ids(self):
+        pattern = self.counter_key('*')
+        return [int(key.decode().rsplit(':', 1)[1]) for key in self.client.scan_iter(match=pattern)]
+
+    def delete_counters(self, variant_ids):
+        if variant_ids:
+            self.client.delete(*[self.counter_key(variant_id) for variant_id in variant_ids])
+
+    def epoch(self):
+        self.client.set(self.epoch_key, uuid.uuid4().hex, nx=True)
+        return self.client.get(self.epoch_key).decode()
+
+    def read_journal(self, limit):
+        entries = []
+        for entry in self.client.lrange(self.journal_key, 0, limit - 1):
+            sequence, payload = entry.decode().split(' ', 1)
+            entries.append((int(sequence), {int(variant_id): delta for variant_id, delta in json.loads(payload).items()}))
+        return entries
+
+    def trim_journal(self, sequence):
+        self._trim(keys=[self.journal_key], args=[sequence])
+
+def get_hot_stock_backend():
+    """Return the configured hot stock backend instance."""
+    return import_string(settings.STORE_HOT_STOCK_BACKEND)()
+
+def take(variant_quantities, backend=None):
+    """
+    Atomically take [(variant, quantity)] from the hot counters.
+    Returns the variant that is short (nothing is taken then), or None.
+    """
+    backend = backend or get_hot_stock_backend()
+    variants = {variant.pk: variant for variant, _ in variant_quantities}
+    short = backend.apply(-1, {variant.pk: (quantity, variant.stock) for variant, quantity in variant_quantities})
+    return variants[short] if short is not None else None
+
+def give(variant_quantities, backend=None):
+    """Put [(variant, quantity)] back into the hot counters."""
+    if variant_quantities:
+        backend = backend or get_hot_stock_backend()
+        backend.apply(1, {variant.pk: (quantity, variant.stock) for variant, quantity in variant_quantities})
+
+def available(variants, backend=None):
+    """Return {variant_id: stock} for variants, reading counters where they exist."""
+    backend = backend or get_hot_stock_backend()
+    counters = backend.counters(variant.pk for variant in variants)
+    return {variant.pk: counters.get(variant.pk, variant.stock) for variant in variants}
+
+def flush_journal(batch_size=1000, backend=None):
+    """
+    Apply journaled counter changes to ProductVariant.stock, batch_size entries
+    per transaction, then release the counters of products no longer hot
+    (or deleted).
+    Returns the number of journal entries applied.
+    """
+    from .stock import refresh_stock_rollups
+    backend = backend or get_hot_stock_backend()
+    applied = 0
+    trimmed = None
+    while (entries := backend.read_journal(batch_size)) and entries[-1][0] != trimmed:  # Stop if a trim did not happen
+        epoch = backend.epoch()
+        with transaction.atomic():
+            checkpoint, _ = HotStockFlush.objects.select_for_update().get_or_create(pk=1)
+            if checkpoint.epoch != epoch:
+                checkpoint.epoch, checkpoint.sequence = epoch, 0  # New counter store, new sequence
+            deltas = defaultdict(int)
+            for sequence, changes in entries:
+                if sequence > checkpoint.sequence:
+                    for variant_id, delta in changes.items():
+                        deltas[variant_id] += delta
+                    applied += 1
+            now = timezone.now()
+            for variant_id, delta in sorted(deltas.items()):
+                ProductVariant.objects.filter(pk=variant_id).update(stock=Greatest(F('stock') + delta, 0), updated_at=now)
+            checkpoint.sequence = max(checkpoint.sequence, entries[-1][0])
+            checkpoint.save()
+            refresh_stock_rollups(ProductVariant.objects.filter(pk__in=list(deltas)).values_list('product_id', flat=True))
+        backend.trim_journal(checkpoint.sequence)
+        trimmed = checkpoint.sequence
+    counted = set(backend.counter_ids())
+    hot = set(ProductVariant.objects.filter(pk__in=counted, product__hot_stock=True).values_list('pk', flat=True))
+    backend.delete_counters(list(counted - hot))  # Products turned cold, or deleted variants
+    return applied
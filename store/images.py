@@ -0,0 +1,137 @@
+"""
+Image derivative pipeline for product images.
+
+Every ProductImage upload gets fixed-width renditions (RENDITIONS) in WebP
+and JPEG, stored next to the original with content-hashed names
+(products/shirt.medium.3f2a9c01d4e7.webp) so they can be cached forever.
+Renditions are generated after the upload commits in a small background
+thread pool, keeping resizing off the request path; images whose renditions
+are missing (e.g. after a restart) are picked up by
+`python manage.py generate_image_derivatives`.
+"""
+import hashlib
+import logging
+import posixpath
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+# Rendition name -> max width in pixels (images are never upscaled)
+RENDITIONS = {
+    'thumbnail': 150,
+    'medium': 600,
+    'large': 1200,
+}
+# Output format -> (file extension, Pillow save options)
+FORMATS = {
+    'webp': ('webp', {'format': 'WEBP', 'quality': 80, 'method': 4}),
+    'jpeg': ('jpg', {'format': 'JPEG', 'quality': 85, 'optimize': True, 'progressive': True}),
+}
+
+_executor = None
+
+def derivative_name(source_name, rendition, content, extension):
+    """Return the storage name of a rendition: next to the original, content-hashed."""
+    root, _ = posixpath.splitext(source_name)
+    digest = hashlib.sha256(content).hexdigest()[:12]
+    return f'{root}.{rendition}.{digest}.{extension}'
+
+def render(image, width, options):
+    """Return image resized to at most width pixels wide, encoded with options."""
+    resized = image.copy()
+    if resized.width > width:
+        resized.thumbnail((width, round(resized.height * width / resized.width)), Image.LANCZOS)
+    if options['format'] == 'JPEG' and resized.mode != 'RGB':
+        resized = resized.convert('RGB')
+    output = BytesIO()
+    resized.save(output, **options)
+    return resized.size, output.getvalue()
+
+def derivative_files(derivatives):
+    """Return the storage names of every file in a derivatives map."""
+    return {entry[fmt] for entry in derivatives.values() for fmt in FORMATS if entry.get(fmt)}
+
+def delete_files(storage, names):
+    """Delete rendition files (missing files are ignored by storage.delete)."""
+    for name in names:
+        storage.delete(name)
+
+def generate_derivatives(product_image):
+    """
+    Create every rendition of product_image, store their names on the row and
+    delete renditions of a previous upload.
+    """
+    source_name = product_image.image.name
+    storage = product_image.image.storage
+    with product_image.image.open('rb') as source:
+        image = ImageOps.exif_transpose(Image.open(source))
+        image.load()
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'transparency' in image.info or image.mode in ('LA', 'PA') else 'RGB')
+    derivatives = {}
+    for rendition, width in RENDITIONS.items():
+        entry = {}
+        for fmt, (extension, options) in FORMATS.items():
+            size, content = render(image, width, options)
+            name = derivative_name(source_name, rendition, content, extension)
+            if not storage.exists(name):
+                name = storage.save(name, ContentFile(content))
+            entry[fmt] = name
+        entry['width'], entry['height'] = size
+        derivatives[rendition] = entry
+    previous = product_image.derivatives
+    product_image.derivatives = derivatives
+    product_image.derivatives_source = source_name
+    product_image.save(update_fields=['derivatives', 'derivatives_source'])
+    delete_files(storage, derivative_files(previous) - derivative_files(derivatives))
+    return derivatives
+
+def process_image(image_id):
+    """Generate renditions for one ProductImage id if they are missing or stale."""
+    from .models import ProductImage
+    try:
+        product_image = ProductImage.objects.filter(pk=image_id).first()
+        if product_image is not None and product_image.derivatives_pending:
+            generate_derivatives(product_image)
+    except Exception:
+        logger.exception('Could not generate derivatives for product image %s', image_id)
+    finally:
+        close_old_connections()
+
+def schedule_derivatives(image_id):
+    """Queue rendition generation for a ProductImage on the background thread pool."""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=getattr(settings, 'STORE_IMAGE_WORKERS', 2),
+            thread_name_prefix='image-derivatives',
+        )
+    _executor.submit(process_image, image_id)
+
+def rendition_urls(product_image, request=None):
+    """
+    Return {rendition: {'width', 'height', 'webp', 'jpeg'}} with absolute URLs
+    (when request is given) for a ProductImage.
+    """
+    storage = product_image.image.storage
+    if product_image.derivatives_pending:
+        return {}
+    urls = {}
+    for rendition, entry in product_image.derivatives.items():
+        urls[rendition] = {'width': entry['width'], 'height': entry['height']}
+        for fmt in FORMATS:
+            url = storage.url(entry[fmt])
+            urls[rendition][fmt] = request.build_absolute_uri(url) if request else url
+    return urls
+
+def srcset(urls):
+    """Return {format: 'url 150w, url 600w, ...'} from rendition_urls() output."""
+    if not urls:
+        return {}
+    entries = sorted(urls.values(), key=lambda entry: entry['width'])
+    return {fmt: ', '.join(f"{entry[fmt]} {entry['width']}w" for entry in entries) for fmt in FORMATS}
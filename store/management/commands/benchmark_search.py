@@ -0,0 +1,73 @@
+import random
+import statistics
+import time
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from store.models import Category, Product
+from store.search import IContainsSearchBackend, get_search_backend
+
+ADJECTIVES = ['soft', 'classic', 'summer', 'winter', 'cozy', 'denim', 'cotton', 'linen', 'organic', 'striped', 'floral', 'vintage']
+COLORS = ['blue', 'red', 'green', 'pink', 'white', 'black', 'gray', 'purple', 'yellow', 'navy']
+NOUNS = ['shirt', 'dress', 'jeans', 'hoodie', 'jacket', 'sneakers', 'cap', 'skirt', 'sweater', 'shorts', 'pajamas', 'socks']
+
+class Rollback(Exception):
+    pass
+
+class Command(BaseCommand):
+    help = 'Compare search latency of the full-text backend against icontains on a synthetic catalog.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=1_000_000, help='Synthetic products to generate')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--repeat', type=int, default=5, help='Timed runs per term')
+        parser.add_argument('--terms', default='shirt,blue cotton,vintage jacket,pajamas', help='Comma-separated search terms')
+        parser.add_argument('--keep', action='store_true', help='Keep the synthetic products instead of rolling back')
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.generate(options['products'], options['batch_size'])
+                self.run_benchmark([term.strip() for term in options['terms'].split(',') if term.strip()], options['repeat'])
+                if not options['keep']:
+                    raise Rollback
+        except Rollback:
+            self.stdout.write('Synthetic products rolled back.')
+
+    def generate(self, count, batch_size):
+        rng = random.Random(42)
+        # Descriptions mix the product words with a large filler vocabulary, like a real
+        # catalog, so search terms match a realistic fraction of products.
+        vocabulary = [''.join(rng.choice('abcdefghijklmnopqrstuvwxyz') for _ in range(rng.randint(4, 9))) for _ in range(5000)]
+        category = Category.objects.create(name='Benchmark')
+        self.stdout.write(f'Generating {count} products...')
+        start = time.perf_counter()
+        for offset in range(0, count, batch_size):
+            batch = []
+            for i in range(offset, min(offset + batch_size, count)):
+                name = f'{rng.choice(ADJECTIVES).title()} {rng.choice(COLORS).title()} {rng.choice(NOUNS).title()} #{i}'
+                description = ' '.join(rng.choice(vocabulary) for _ in range(20)) + f' {rng.choice(ADJECTIVES)} {rng.choice(NOUNS)}'
+                batch.append(Product(name=name, description=description, price=rng.randint(5, 100), category=category))
+            Product.objects.bulk_create(batch)
+        get_search_backend().rebuild()
+        self.stdout.write(f'Generated and indexed in {time.perf_counter() - start:.1f}s')
+
+    def time_query(self, backend, term, repeat):
+        def first_page():
+            queryset = backend.search(Product.objects.all(), term).order_by('-search_rank', '-id')
+            return list(queryset.values_list('id', flat=True)[:20])
+        first_page()  # warm up
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            first_page()
+            timings.append((time.perf_counter() - start) * 1000)
+        return statistics.median(timings)
+
+    def run_benchmark(self, terms, repeat):
+        backend = get_search_backend()
+        baseline = IContainsSearchBackend()
+        self.stdout.write(f'{"term":<20}{"icontains (ms)":>16}{backend.__class__.__name__ + " (ms)":>32}{"speedup":>10}')
+        for term in terms:
+            slow = self.time_query(baseline, term, repeat)
+            fast = self.time_query(backend, term, repeat)
+            self.stdout.write(f'{term:<20}{slow:>16.1f}{fast:>32.1f}{slow / fast:>9.1f}x')
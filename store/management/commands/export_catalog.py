@@ -0,0 +1,35 @@
+import sys
+import time
+from django.core.management.base import BaseCommand
+from store.catalog_io import detect_format, export_rows, write_rows
+from store.models import Product
+
+class Command(BaseCommand):
+    help = 'Stream the product catalog to a CSV/JSONL file (same columns as import_catalog), reading products in keyset-paginated chunks.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Output file, or '-' for stdout.")
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help='File format (default: from the extension, csv for stdout).')
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Products read per query.')
+        parser.add_argument('--category', help='Only export products of this category name.')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = detect_format(path, options['format'])
+        queryset = Product.objects.all()
+        if options['category']:
+            queryset = queryset.filter(category__name=options['category'])
+        # Progress goes to stderr when the catalog itself is written to stdout
+        report = self.stderr if path == '-' else self.stdout
+        started = time.monotonic()
+        count = 0
+        stream = sys.stdout if path == '-' else open(path, 'w', newline='', encoding='utf-8')
+        try:
+            for count, _ in enumerate(write_rows(stream, export_rows(queryset, options['chunk_size']), fmt), start=1):
+                if count % options['chunk_size'] == 0:
+                    report.write(f'{count} rows ({count / (time.monotonic() - started):.0f} rows/s)')
+        finally:
+            if stream is not sys.stdout:
+                stream.close()
+        elapsed = time.monotonic() - started
+        report.write(self.style.SUCCESS(f'Exported {count} products in {elapsed:.1f}s ({count / max(elapsed, 1e-9):.0f} rows/s).'))
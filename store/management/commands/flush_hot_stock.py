@@ -0,0 +1,22 @@
+import time
+from django.core.management.base import BaseCommand
+from store.hot_stock import flush_journal, get_hot_stock_backend
+
+class Command(BaseCommand):
+    help = (
+        'Apply the flash sale (hot stock) counter journal to variant stock and release the counters '
+        'of products no longer flagged hot_stock. Run periodically, e.g. every few seconds with --interval.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Journal entries applied per transaction.')
+        parser.add_argument('--interval', type=float, default=0, help='Keep flushing every N seconds (0: flush once).')
+
+    def handle(self, *args, **options):
+        backend = get_hot_stock_backend()
+        while True:
+            applied = flush_journal(options['batch_size'], backend=backend)
+            self.stdout.write(self.style.SUCCESS(f'Applied {applied} hot stock journal entries.'))
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
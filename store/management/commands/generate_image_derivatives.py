@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from store.images import generate_derivatives
+from store.models import ProductImage
+
+class Command(BaseCommand):
+    help = 'Generate thumbnail/medium/large WebP and JPEG renditions for product images that are missing them.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Regenerate renditions for every image, not only pending ones.')
+
+    def handle(self, *args, **options):
+        generated = failed = 0
+        for product_image in ProductImage.objects.exclude(image='').order_by('id').iterator():
+            if not options['all'] and not product_image.derivatives_pending:
+                continue
+            if options['all']:
+                product_image.derivatives_source = ''
+            try:
+                generate_derivatives(product_image)
+                generated += 1
+            except Exception as exc:
+                failed += 1
+                self.stderr.write(f'Image {product_image.pk} ({product_image.image.name}): {exc}')
+        self.stdout.write(self.style.SUCCESS(f'Generated renditions for {generated} images ({failed} failed).'))
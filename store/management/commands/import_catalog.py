@@ -0,0 +1,92 @@
+import json
+import os
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError
+from store.cache import bump_catalog_version, bump_pricing_version
+from store.catalog_io import CatalogImporter, RowError, chunked, detect_format, read_rows
+from store.models import Product
+
+class Command(BaseCommand):
+    help = (
+        'Stream a CSV/JSONL supplier catalog into the store, upserting products by sku in chunked '
+        'bulk writes (one transaction per chunk). Rejected rows go to a .rejects.jsonl file; '
+        '--resume continues after the last committed chunk of an interrupted run.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV or JSONL file to import.')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help='File format (default: from the extension).')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Rows written per transaction.')
+        parser.add_argument('--resume', action='store_true', help='Skip rows up to the checkpoint of a previous run.')
+        parser.add_argument('--checkpoint', help='Checkpoint file (default: <path>.checkpoint).')
+        parser.add_argument('--rejects', help='Rejected rows file (default: <path>.rejects.jsonl).')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if not os.path.exists(path):
+            raise CommandError(f'{path} does not exist.')
+        fmt = detect_format(path, options['format'])
+        checkpoint = options['checkpoint'] or f'{path}.checkpoint'
+        rejects_path = options['rejects'] or f'{path}.rejects.jsonl'
+        start_after = self.read_checkpoint(checkpoint) if options['resume'] else 0
+        if start_after:
+            self.stdout.write(f'Resuming after row {start_after}.')
+
+        importer = CatalogImporter()
+        created = updated = rejected = processed = failed_chunks = 0
+        started = time.monotonic()
+        # A resumed run appends: the rejects of the interrupted run are the only record of its rejected rows
+        with open(path, newline='', encoding='utf-8') as stream, open(rejects_path, 'a' if options['resume'] else 'w', encoding='utf-8') as rejects:
+            rows = ((number, row) for number, row in read_rows(stream, fmt) if number > start_after)
+            for chunk in chunked(rows, options['chunk_size']):
+                parsed, accepted = [], []
+                for number, row in chunk:
+                    try:
+                        parsed.append(importer.parse(row))
+                        accepted.append((number, row))
+                    except RowError as exc:
+                        rejected += self.reject(rejects, number, row, exc)
+                try:
+                    chunk_created, chunk_updated = importer.import_chunk(parsed)
+                    created += chunk_created
+                    updated += chunk_updated
+                except DatabaseError as exc:
+                    # The chunk was rolled back; continue with the next one and keep its rows for a re-run
+                    failed_chunks += 1
+                    self.stderr.write(f'Rows {chunk[0][0]}-{chunk[-1][0]} failed: {exc}')
+                    for number, row in accepted:
+                        rejected += self.reject(rejects, number, row, exc)
+                processed += len(chunk)
+                self.write_checkpoint(checkpoint, chunk[-1][0])
+                elapsed = time.monotonic() - started
+                self.stdout.write(f'{processed} rows ({processed / elapsed:.0f} rows/s)')
+
+        bump_catalog_version(Product)
+        bump_pricing_version()
+        # The run completed: the checkpoint is only needed to resume an interrupted run
+        if os.path.exists(checkpoint):
+            os.remove(checkpoint)
+        if not os.path.getsize(rejects_path):
+            os.remove(rejects_path)
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {processed} rows in {elapsed:.1f}s ({processed / max(elapsed, 1e-9):.0f} rows/s): '
+            f'{created} created, {updated} updated, {rejected} rejected ({failed_chunks} failed chunks).'
+        ))
+        if os.path.exists(rejects_path):
+            self.stdout.write(f'Rejected rows written to {rejects_path}.')
+
+    def reject(self, rejects, number, row, error):
+        rejects.write(json.dumps({'row': number, 'error': str(error), 'data': row}, default=str) + '\n')
+        return 1
+
+    def read_checkpoint(self, checkpoint):
+        if not os.path.exists(checkpoint):
+            return 0
+        with open(checkpoint) as f:
+            return int(f.read().strip() or 0)
+
+    def write_checkpoint(self, checkpoint, row_number):
+        with open(checkpoint, 'w') as f:
+            f.write(str(row_number))
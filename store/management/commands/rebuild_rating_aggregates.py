@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from store.cache import bump_catalog_version
+from store.models import Product
+
+class Command(BaseCommand):
+    help = 'Recompute the denormalized rating aggregates (count, sum, per-star histogram) of every product from its reviews.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000, help='Products updated per transaction.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        ids = Product.objects.order_by('id').values_list('id', flat=True)
+        updated = 0
+        last_id = 0
+        while True:
+            batch = list(ids.filter(id__gt=last_id)[:batch_size])
+            if not batch:
+                break
+            with transaction.atomic():
+                updated += Product.objects.filter(id__gte=batch[0], id__lte=batch[-1]).rebuild_ratings()
+            last_id = batch[-1]
+        bump_catalog_version(Product)
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt rating aggregates for {updated} products.'))
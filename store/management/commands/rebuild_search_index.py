@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+from store.search import get_search_backend
+
+class Command(BaseCommand):
+    help = 'Create (if missing) and rebuild the full-text product search index.'
+
+    def handle(self, *args, **options):
+        backend = get_search_backend()
+        with connection.schema_editor() as schema_editor:
+            backend.create_index(schema_editor)
+        backend.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Search index rebuilt with {backend.__class__.__name__}.'))
@@ -0,0 +1,27 @@
+# Creates the full-text search index used by store.search (tsvector + GIN on
+# PostgreSQL, FTS5 table on SQLite) and indexes existing products.
+
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    from store.search import get_search_backend
+    backend = get_search_backend()
+    backend.create_index(schema_editor)
+    backend.rebuild()
+
+
+def drop_search_index(apps, schema_editor):
+    from store.search import get_search_backend
+    get_search_backend().drop_index(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0003_product_product_created_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.4 on 2026-10-17 06:33
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def parse_existing_colors(apps, schema_editor):
+    from store.models import parse_colors
+    Product = apps.get_model('store', 'Product')
+    ProductColor = apps.get_model('store', 'ProductColor')
+    colors = [
+        ProductColor(product_id=product_id, name=color)
+        for product_id, value in Product.objects.exclude(colors='').values_list('id', 'colors').iterator()
+        for color in parse_colors(value)
+    ]
+    ProductColor.objects.bulk_create(colors, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0005_product_rating_1_count_product_rating_2_count_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductColor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='parsed_colors', to='store.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['name', 'product'], name='product_color_name_idx')],
+                'constraints': [models.UniqueConstraint(fields=('product', 'name'), name='unique_product_color')],
+            },
+        ),
+        migrations.RunPython(parse_existing_colors, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.4 on 2026-10-17 06:58
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def create_unsized_variants(apps, schema_editor):
+    # Existing product stock becomes the stock of an unsized variant
+    Product = apps.get_model('store', 'Product')
+    ProductVariant = apps.get_model('store', 'ProductVariant')
+    ProductVariant.objects.bulk_create(
+        (ProductVariant(product_id=product_id, stock=stock) for product_id, stock in Product.objects.filter(stock__gt=0).values_list('id', 'stock').iterator()),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0008_product_sku'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductVariant',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('stock', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='variants', to='store.product')),
+                ('size', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='variants', to='store.size')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['size', 'stock', 'product'], name='variant_size_stock_idx')],
+                'constraints': [models.UniqueConstraint(fields=('product', 'size'), name='unique_product_variant'), models.UniqueConstraint(condition=models.Q(('size__isnull', True)), fields=('product',), name='unique_product_unsized_variant')],
+            },
+        ),
+        migrations.RunPython(create_unsized_variants, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.4 on 2026-10-17 07:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0009_productvariant'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HotStockFlush',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('epoch', models.CharField(blank=True, max_length=64)),
+                ('sequence', models.PositiveBigIntegerField(default=0)),
+                ('flushed_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='hot_stock',
+            field=models.BooleanField(default=False, help_text='Flash sale: count stock in Redis, flushed to the database periodically'),
+        ),
+    ]
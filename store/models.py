@@ -1,7 +1,10 @@
 """
 Models for product catalog, categories, sizes, coupons, images, and reviews.
 """
+from decimal import Decimal, ROUND_HALF_UP
 from django.db import models
+from django.db.models import Case, Count, F, FloatField, OuterRef, Prefetch, Subquery, Sum, Value, When
+from django.db.models.functions import Cast, Coalesce
 from django.contrib.auth.models import User
 from django.utils import timezone
 
@@ -38,25 +41,147 @@ class Coupon(models.Model):
     def __str__(self):
         return self.code
 
+RATING_STARS = range(1, 6)  # Ratings counted in the per-star histogram
+RATING_FIELDS = ['rating_count', 'rating_sum'] + [f'rating_{star}_count' for star in RATING_STARS]
+# Columns maintained from other tables: never written by Product.save() on existing rows
+DENORMALIZED_FIELDS = RATING_FIELDS + ['stock']
+
+def rating_aggregate_expressions(review_model):
+    """
+    Return update() expressions recomputing every rating column of a product
+    from review_model rows (also used by the data migration).
+    """
+    reviews = review_model.objects.filter(product=OuterRef('pk')).order_by().values('product')
+
+    def aggregate(expression, **filters):
+        return Coalesce(Subquery(reviews.filter(**filters).annotate(value=expression).values('value')), 0)
+
+    expressions = {'rating_count': aggregate(Count('id')), 'rating_sum': aggregate(Sum('rating'))}
+    for star in RATING_STARS:
+        expressions[f'rating_{star}_count'] = aggregate(Count('id'), rating=star)
+    return expressions
+
+class ProductQuerySet(models.QuerySet):
+    """
+    QuerySet helpers for product listings.
+    """
+    def with_catalog_data(self, include_reviews=True, include_variants=True):
+        """
+        Load everything ProductSerializer needs in a fixed number of queries.
+        Category and coupon are joined and sizes/images (and reviews/variants,
+        unless excluded) are prefetched. Rating stats are columns.
+        """
+        prefetches = ['sizes', 'images']
+        if include_reviews:
+            prefetches.append(Prefetch('reviews', queryset=Review.objects.select_related('user')))
+        if include_variants:
+            prefetches.append(Prefetch('variants', queryset=ProductVariant.objects.select_related('size')))
+        return self.select_related('category', 'coupon').prefetch_related(*prefetches)
+
+    def rebuild_stock(self):
+        """Recompute the Product.stock rollup of these products from their variants."""
+        variants = ProductVariant.objects.filter(product=OuterRef('pk')).order_by().values('product')
+        return self.update(
+            stock=Coalesce(Subquery(variants.annotate(total=Sum('stock')).values('total')), 0),
+            updated_at=timezone.now(),
+        )
+
+    def rebuild_ratings(self):
+        """Recompute the rating columns of these products from their reviews."""
+        return self.update(updated_at=timezone.now(), **rating_aggregate_expressions(Review))
+
+    def add_rating(self, rating, delta=1):
+        """
+        Atomically add (delta=1) or remove (delta=-1) one rating from the
+        denormalized rating columns of these products.
+        """
+        changes = {
+            'rating_count': F('rating_count') + delta,
+            'rating_sum': F('rating_sum') + rating * delta,
+        }
+        if rating in RATING_STARS:
+            field = f'rating_{rating}_count'
+            changes[field] = F(field) + delta
+        return self.update(**changes)
+
 class Product(models.Model):
     """
     Product in the store (with category, sizes, price, stock, etc.).
     """
     name = models.CharField(max_length=200)  # Product name
+    sku = models.CharField(max_length=64, unique=True, null=True, blank=True)  # Supplier SKU (catalog import key)
     description = models.TextField()  # Product description
     price = models.DecimalField(max_digits=10, decimal_places=2)  # Base price
     category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='products')  # Product category
     sizes = models.ManyToManyField(Size, blank=True)  # Available sizes
-    stock = models.PositiveIntegerField(default=0)  # Stock count
+    stock = models.PositiveIntegerField(default=0)  # Stock count (sum of variant stock, see store.stock)
+    hot_stock = models.BooleanField(default=False, help_text='Flash sale: count stock in Redis, flushed to the database periodically')  # See store.hot_stock
     colors = models.CharField(max_length=100, blank=True, help_text='Comma-separated colors')  # Available colors
     discount = models.DecimalField(max_digits=5, decimal_places=2, default=0, help_text='Discount percentage')  # Discount percent
     coupon = models.ForeignKey(Coupon, on_delete=models.SET_NULL, null=True, blank=True, related_name='products')  # Linked coupon
     created_at = models.DateTimeField(auto_now_add=True)  # Created timestamp
     updated_at = models.DateTimeField(auto_now=True)  # Updated timestamp
+    # Rating aggregates, maintained from Review signals (rebuild_rating_aggregates recomputes them)
+    rating_count = models.PositiveIntegerField(default=0, editable=False)  # Number of reviews
+    rating_sum = models.PositiveIntegerField(default=0, editable=False)  # Sum of review ratings
+    rating_1_count = models.PositiveIntegerField(default=0, editable=False)  # 1-star reviews
+    rating_2_count = models.PositiveIntegerField(default=0, editable=False)  # 2-star reviews
+    rating_3_count = models.PositiveIntegerField(default=0, editable=False)  # 3-star reviews
+    rating_4_count = models.PositiveIntegerField(default=0, editable=False)  # 4-star reviews
+    rating_5_count = models.PositiveIntegerField(default=0, editable=False)  # 5-star reviews
+    rating_average = models.GeneratedField(
+        expression=Case(
+            When(rating_count=0, then=Value(0.0)),
+            default=Cast('rating_sum', FloatField()) / F('rating_count'),
+        ),
+        output_field=FloatField(),
+        db_persist=True,
+    )  # Average rating (0 without reviews)
+
+    objects = ProductQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Keyset pagination orderings (see store.pagination)
+            models.Index(fields=['created_at', 'id'], name='product_created_idx'),
+            models.Index(fields=['price', 'id'], name='product_price_idx'),
+            models.Index(fields=['name', 'id'], name='product_name_idx'),
+            models.Index(fields=['rating_average', 'id'], name='product_rating_idx'),
+        ]
 
     def __str__(self):
         return self.name
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Price changes invalidate cached cart pricing on save (see store.signals)
+        instance.saved_pricing = (instance.__dict__.get('price'), instance.__dict__.get('discount'))
+        return instance
+
+    def save(self, *args, **kwargs):
+        # Rating aggregates and the stock rollup are only written with UPDATEs
+        # (add_rating, store.stock), so saving a stale instance must not overwrite them.
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            skipped = set(DENORMALIZED_FIELDS) | self.get_deferred_fields()
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and not field.generated and field.attname not in skipped
+            ]
+        super().save(*args, **kwargs)
+
+    def sync_colors(self):
+        """Replace the ProductColor rows of this product with the colors parsed from colors."""
+        colors = parse_colors(self.colors)
+        self.parsed_colors.exclude(name__in=colors).delete()
+        existing = set(self.parsed_colors.values_list('name', flat=True))
+        ProductColor.objects.bulk_create([ProductColor(product=self, name=color) for color in colors if color not in existing])
+
+    @property
+    def rating_histogram(self):
+        """Return {star: review count} for 1-5 star ratings."""
+        return {star: getattr(self, f'rating_{star}_count') for star in RATING_STARS}
+
     def get_discounted_price(self):
         """
         Return the price after applying discount (if any).
@@ -64,7 +189,69 @@ class Product(models.Model):
         price = self.price
         if self.discount:
             price = price * (1 - self.discount / 100)
-        return round(price, 2)
+        return Decimal(price).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)  # Rounds like SQL ROUND (see orders.pricing)
+
+def parse_colors(value):
+    """Split a comma-separated colors string into unique, normalized color names."""
+    colors = []
+    for color in (value or '').split(','):
+        color = color.strip().lower()
+        if color and color not in colors:
+            colors.append(color)
+    return colors
+
+class ProductVariant(models.Model):
+    """
+    Stock of one size of a product. A variant without size holds the stock of
+    products that are not stocked per size. Product.stock is the sum of its variants.
+    """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='variants')  # Stocked product
+    size = models.ForeignKey(Size, on_delete=models.CASCADE, null=True, blank=True, related_name='variants')  # Size (empty: not stocked per size)
+    stock = models.PositiveIntegerField(default=0)  # Units in stock
+    updated_at = models.DateTimeField(auto_now=True)  # Updated timestamp
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'size'], name='unique_product_variant'),
+            models.UniqueConstraint(fields=['product'], condition=models.Q(size__isnull=True), name='unique_product_unsized_variant'),
+        ]
+        indexes = [
+            # "In stock in size M" lookups
+            models.Index(fields=['size', 'stock', 'product'], name='variant_size_stock_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.product.name} ({self.size.name if self.size else 'one size'})"
+
+class HotStockFlush(models.Model):
+    """
+    Last hot stock journal entry applied to variant stock (single row, see store.hot_stock).
+    """
+    epoch = models.CharField(max_length=64, blank=True)  # Counter store the sequence belongs to
+    sequence = models.PositiveBigIntegerField(default=0)  # Last applied journal entry
+    flushed_at = models.DateTimeField(auto_now=True)  # Last flush
+
+    def __str__(self):
+        return f"Hot stock flushed up to {self.sequence}"
+
+class ProductColor(models.Model):
+    """
+    One color of a product, parsed from Product.colors (used for color facets and filters).
+    Rows are kept in sync by Product.sync_colors().
+    """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='parsed_colors')  # Colored product
+    name = models.CharField(max_length=100)  # Normalized color name (lowercase)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'name'], name='unique_product_color'),
+        ]
+        indexes = [
+            models.Index(fields=['name', 'product'], name='product_color_name_idx'),
+        ]
+
+    def __str__(self):
+        return self.name
 
 class ProductImage(models.Model):
     """
@@ -72,10 +259,17 @@ class ProductImage(models.Model):
     """
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='images')  # Linked product
     image = models.ImageField(upload_to='products/')  # Image file
+    derivatives = models.JSONField(default=dict, blank=True, editable=False)  # Resized renditions (see store.images)
+    derivatives_source = models.CharField(max_length=255, blank=True, editable=False)  # Image name the renditions were made from
 
     def __str__(self):
         return f"Image for {self.product.name}"
 
+    @property
+    def derivatives_pending(self):
+        """True if the renditions are missing or were made from a previous upload."""
+        return bool(self.image) and self.derivatives_source != self.image.name
+
 class Review(models.Model):
     """
     User review for a product.
@@ -86,5 +280,12 @@ class Review(models.Model):
     review = models.TextField(blank=True)  # Review text
     created_at = models.DateTimeField(default=timezone.now)  # When review was created
 
+    class Meta:
+        indexes = [
+            # Keyset pagination orderings (see store.pagination)
+            models.Index(fields=['created_at', 'id'], name='review_created_idx'),
+            models.Index(fields=['product', 'created_at', 'id'], name='review_product_created_idx'),
+        ]
+
     def __str__(self):
         return f"{self.rating} by {self.user.username} for {self.product.name}"
@@ -0,0 +1,28 @@
+"""
+Cursor (keyset) pagination classes for catalog and order listings.
+Pages are fetched with WHERE position < cursor ... LIMIT n on an indexed ordering,
+so deep pages cost the same as the first one.
+"""
+from rest_framework.pagination import CursorPagination
+
+class CatalogCursorPagination(CursorPagination):
+    """
+    Cursor pagination for products and reviews (newest first), with an enforced max page size.
+    The primary key is appended to every ordering (including ?ordering= from OrderingFilter)
+    so rows with equal sort values always come back in the same order.
+    """
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering = ('-created_at', '-id')
+
+    def get_ordering(self, request, queryset, view):
+        ordering = super().get_ordering(request, queryset, view)
+        if not any(field.lstrip('-') in ('id', 'pk') for field in ordering):
+            tiebreaker = '-id' if ordering[0].startswith('-') else 'id'
+            ordering = ordering + (tiebreaker,)
+        return ordering
+
+class OrderCursorPagination(CatalogCursorPagination):
+    """Pagination for order listings and history (newest first)."""
+    page_size = 10
@@ -0,0 +1,179 @@
+"""
+Full-text product search.
+
+Search backends keep an index of product name/description and return
+relevance-ranked querysets:
+- PostgresSearchBackend: tsvector column on store_product with a GIN index.
+- SQLiteSearchBackend: FTS5 shadow table (store_product_fts) keyed by product id.
+- IContainsSearchBackend: unindexed fallback for other databases.
+
+The backend is chosen from the database vendor, or set explicitly with
+the STORE_SEARCH_BACKEND setting (dotted path to a backend class).
+The index is kept in sync by the Product signals in store.signals.
+"""
+from django.conf import settings
+from django.db import connection
+from django.db.models import BooleanField, FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+from django.utils.module_loading import import_string
+from rest_framework.filters import OrderingFilter, SearchFilter
+
+class BaseSearchBackend:
+    """
+    Interface for product search backends.
+    """
+    def create_index(self, schema_editor):
+        """Create the index structures (called from migrations)."""
+
+    def drop_index(self, schema_editor):
+        """Drop the index structures (called from migrations)."""
+
+    def index_products(self, products):
+        """Add or refresh the index entries for the given products."""
+
+    def remove_products(self, product_ids):
+        """Remove index entries for the given product ids."""
+
+    def rebuild(self):
+        """Re-index every product."""
+
+    def search(self, queryset, term):
+        """Filter queryset to products matching term, annotated with search_rank."""
+        raise NotImplementedError
+
+class IContainsSearchBackend(BaseSearchBackend):
+    """
+    Fallback backend equivalent to DRF SearchFilter (ILIKE '%term%', no index).
+    """
+    def search(self, queryset, term):
+        condition = Q()
+        for word in term.split():
+            condition &= Q(name__icontains=word) | Q(description__icontains=word)
+        return queryset.filter(condition).annotate(search_rank=Value(0.0, output_field=FloatField()))
+
+class PostgresSearchBackend(BaseSearchBackend):
+    """
+    PostgreSQL backend: a weighted tsvector column (name=A, description=B) with a GIN index.
+    """
+    config = 'english'
+    vector_sql = (
+        "setweight(to_tsvector('{config}', coalesce(name, '')), 'A') || "
+        "setweight(to_tsvector('{config}', coalesce(description, '')), 'B')"
+    )
+
+    def create_index(self, schema_editor):
+        schema_editor.execute('ALTER TABLE store_product ADD COLUMN IF NOT EXISTS search_vector tsvector')
+        schema_editor.execute('CREATE INDEX IF NOT EXISTS store_product_search_vector_idx ON store_product USING gin (search_vector)')
+
+    def drop_index(self, schema_editor):
+        schema_editor.execute('DROP INDEX IF EXISTS store_product_search_vector_idx')
+        schema_editor.execute('ALTER TABLE store_product DROP COLUMN IF EXISTS search_vector')
+
+    def _update(self, where='', params=None):
+        with connection.cursor() as cursor:
+            cursor.execute(f'UPDATE store_product SET search_vector = {self.vector_sql.format(config=self.config)} {where}', params)
+
+    def index_products(self, products):
+        ids = [product.pk for product in products]
+        if ids:
+            self._update('WHERE id = ANY(%s)', [ids])
+
+    def rebuild(self):
+        self._update()
+
+    def search(self, queryset, term):
+        query = f"websearch_to_tsquery('{self.config}', %s)"
+        return queryset.filter(
+            RawSQL(f'store_product.search_vector @@ {query}', [term], output_field=BooleanField())
+        ).annotate(
+            search_rank=RawSQL(f'ts_rank(store_product.search_vector, {query})', [term], output_field=FloatField())
+        )
+
+class SQLiteSearchBackend(BaseSearchBackend):
+    """
+    SQLite backend: an FTS5 virtual table whose rowid is the product id, ranked by bm25
+    with name matches weighted above description matches.
+    """
+    table = 'store_product_fts'
+    column_weights = (10.0, 1.0)  # name, description
+
+    def create_index(self, schema_editor):
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {self.table} USING fts5(name, description, tokenize='porter unicode61')"
+        )
+
+    def drop_index(self, schema_editor):
+        schema_editor.execute(f'DROP TABLE IF EXISTS {self.table}')
+
+    def index_products(self, products):
+        rows = [(product.pk, product.name, product.description) for product in products]
+        if not rows:
+            return
+        with connection.cursor() as cursor:
+            cursor.executemany(f'DELETE FROM {self.table} WHERE rowid = %s', [(row[0],) for row in rows])
+            cursor.executemany(f'INSERT INTO {self.table} (rowid, name, description) VALUES (%s, %s, %s)', rows)
+
+    def remove_products(self, product_ids):
+        with connection.cursor() as cursor:
+            cursor.executemany(f'DELETE FROM {self.table} WHERE rowid = %s', [(pk,) for pk in product_ids])
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table}')
+            cursor.execute(f'INSERT INTO {self.table} (rowid, name, description) SELECT id, name, description FROM store_product')
+
+    @staticmethod
+    def match_expression(term):
+        """Quote each word so user input is never parsed as FTS5 query syntax."""
+        return ' '.join('"{}"'.format(word.replace('"', '""')) for word in term.split())
+
+    def search(self, queryset, term):
+        match = self.match_expression(term)
+        if not match:
+            return queryset.none()
+        weights = ', '.join(str(weight) for weight in self.column_weights)
+        # The ranked matches are materialized once per statement (SQLite 3.35+);
+        # a plain correlated MATCH would re-run the full-text query for every row.
+        return queryset.filter(
+            id__in=RawSQL(f'SELECT rowid FROM {self.table} WHERE {self.table} MATCH %s', [match])
+        ).annotate(
+            search_rank=RawSQL(
+                f'WITH ranked AS MATERIALIZED ('
+                f'SELECT rowid AS id, -bm25({self.table}, {weights}) AS rank FROM {self.table} WHERE {self.table} MATCH %s'
+                f') SELECT rank FROM ranked WHERE ranked.id = store_product.id',
+                [match],
+                output_field=FloatField(),
+            )
+        )
+
+def get_search_backend():
+    """Return the configured search backend instance."""
+    path = getattr(settings, 'STORE_SEARCH_BACKEND', None)
+    if path:
+        return import_string(path)()
+    if connection.vendor == 'postgresql':
+        return PostgresSearchBackend()
+    if connection.vendor == 'sqlite':
+        return SQLiteSearchBackend()
+    return IContainsSearchBackend()
+
+class ProductSearchFilter(SearchFilter):
+    """
+    Drop-in replacement for SearchFilter on products (same ?search= parameter)
+    that uses the configured search backend instead of icontains lookups.
+    Results are annotated with search_rank (see RankedOrderingFilter).
+    """
+    def filter_queryset(self, request, queryset, view):
+        term = request.query_params.get(self.search_param, '').strip()
+        if not term:
+            return queryset
+        return get_search_backend().search(queryset, term)
+
+class RankedOrderingFilter(OrderingFilter):
+    """
+    OrderingFilter that sorts search results by relevance unless ?ordering= is given.
+    """
+    def get_ordering(self, request, queryset, view):
+        if not request.query_params.get(self.ordering_param) and 'search_rank' in queryset.query.annotations:
+            return ['-search_rank']
+        return super().get_ordering(request, queryset, view)
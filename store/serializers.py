@@ -1,5 +1,60 @@
 from rest_framework import serializers
-from .models import Category, Size, Product, ProductImage, Coupon, Review
+from rest_framework.permissions import SAFE_METHODS
+from .images import rendition_urls, srcset
+from .models import Category, Size, Product, ProductImage, ProductVariant, Coupon, Review
+from .stock import set_unsized_stock
+
+def requested_fields(request, param):
+    """
+    Return the set of names passed as a comma-separated query parameter
+    (e.g. ?fields=id,name), or None if the parameter is absent.
+    Only read requests can shape their response.
+    """
+    if request is None or request.method not in SAFE_METHODS:
+        return None
+    value = request.query_params.get(param)
+    if not value:
+        return None
+    return {name.strip() for name in value.split(',') if name.strip()}
+
+def includes_field(request, name, default, prefix=''):
+    """
+    Return True if a DynamicFieldsMixin serializer will render `name` for this request.
+    `default` says whether the field is part of the serializer's standard fields.
+    """
+    only = requested_fields(request, f'{prefix}fields')
+    if only is not None and name not in only:
+        return False
+    if default:
+        return True
+    expand = requested_fields(request, f'{prefix}expand')
+    return bool(expand) and name in expand
+
+class DynamicFieldsMixin:
+    """
+    Serializer mixin for sparse fieldsets.
+    ?fields=a,b limits the output to those fields and ?expand=x adds optional
+    fields listed in Meta.expandable_fields. Nested serializers read prefixed
+    parameters instead, e.g. ?product_fields= for query_prefix='product_'.
+    Fields that are not requested are never built.
+    """
+    def __init__(self, *args, **kwargs):
+        self.query_prefix = kwargs.pop('query_prefix', '')
+        super().__init__(*args, **kwargs)
+
+    def get_field_names(self, declared_fields, info):
+        expandable = getattr(self.Meta, 'expandable_fields', [])
+        # Declared fields may be expand-only (left out of Meta.fields)
+        default_fields = {name: field for name, field in declared_fields.items() if name not in expandable or name in self.Meta.fields}
+        field_names = list(super().get_field_names(default_fields, info))
+        request = self.context.get('request')
+        expand = requested_fields(request, f'{self.query_prefix}expand')
+        if expand:
+            field_names += [name for name in expandable if name in expand and name not in field_names]
+        only = requested_fields(request, f'{self.query_prefix}fields')
+        if only:
+            field_names = [name for name in field_names if name in only]
+        return field_names
 
 class CategorySerializer(serializers.ModelSerializer):
     """
@@ -28,10 +83,22 @@ class CouponSerializer(serializers.ModelSerializer):
 class ProductImageSerializer(serializers.ModelSerializer):
     """
     Serializer for ProductImage model.
+    Adds the resized renditions and a srcset string per format once they are generated.
     """
+    renditions = serializers.SerializerMethodField()  # Resized WebP/JPEG URLs
+    srcset = serializers.SerializerMethodField()  # {'webp': 'url 150w, ...', 'jpeg': ...}
+
     class Meta:
         model = ProductImage
-        fields = '__all__'
+        exclude = ['derivatives', 'derivatives_source']
+
+    def get_renditions(self, obj):
+        """Return {rendition: {width, height, webp, jpeg}} (empty while pending)."""
+        return rendition_urls(obj, self.context.get('request'))
+
+    def get_srcset(self, obj):
+        """Return srcset strings per format (empty while pending)."""
+        return srcset(self.get_renditions(obj))
 
 class ReviewSerializer(serializers.ModelSerializer):
     """
@@ -42,7 +109,16 @@ class ReviewSerializer(serializers.ModelSerializer):
         model = Review
         fields = ['id', 'user', 'rating', 'review', 'created_at']
 
-class ProductSerializer(serializers.ModelSerializer):
+class ProductVariantSerializer(serializers.ModelSerializer):
+    """
+    Serializer for ProductVariant model (stock of one size).
+    """
+    size = SizeSerializer(read_only=True)
+    class Meta:
+        model = ProductVariant
+        fields = ['id', 'size', 'stock']
+
+class ProductSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     """
     Serializer for Product model.
     Includes nested category, sizes, images, coupon, reviews, and computed fields.
@@ -55,20 +131,65 @@ class ProductSerializer(serializers.ModelSerializer):
     coupon = CouponSerializer(read_only=True)
     coupon_id = serializers.PrimaryKeyRelatedField(queryset=Coupon.objects.all(), source='coupon', write_only=True, allow_null=True, required=False)  # For write
     reviews = ReviewSerializer(many=True, read_only=True)
+    variants = ProductVariantSerializer(many=True, read_only=True)  # Stock per size
     average_rating = serializers.SerializerMethodField()  # Computed
+    review_count = serializers.SerializerMethodField()  # Computed
+    rating_histogram = serializers.SerializerMethodField()  # Reviews per star
     discounted_price = serializers.SerializerMethodField()  # Computed
 
     class Meta:
         model = Product
-        fields = ['id', 'name', 'description', 'price', 'category', 'category_id', 'sizes', 'size_ids', 'stock', 'colors', 'discount', 'coupon', 'coupon_id', 'created_at', 'updated_at', 'images', 'reviews', 'average_rating', 'discounted_price']
+        fields = ['id', 'name', 'sku', 'description', 'price', 'category', 'category_id', 'sizes', 'size_ids', 'stock', 'colors', 'discount', 'coupon', 'coupon_id', 'created_at', 'updated_at', 'images', 'reviews', 'variants', 'average_rating', 'review_count', 'rating_histogram', 'discounted_price']
+
+    def update(self, instance, validated_data):
+        """Update the product; a new stock is written to its unsized variant."""
+        stock = validated_data.pop('stock', None)
+        if stock is not None and stock != instance.stock:
+            if instance.variants.filter(size__isnull=False).exists():
+                raise serializers.ValidationError({'stock': 'This product is stocked per size; update its variants instead.'})
+            set_unsized_stock(instance, stock)
+            instance.stock = stock  # For the response only: set_unsized_stock wrote the rollup, save() skips the column
+        return super().update(instance, validated_data)
 
     def get_average_rating(self, obj):
-        """Compute the average rating for the product."""
-        reviews = obj.reviews.all()
-        if reviews.exists():
-            return round(sum([r.rating for r in reviews]) / reviews.count(), 2)
+        """Return the average rating for the product."""
+        if obj.rating_count:
+            return round(obj.rating_average, 2)
         return None
 
+    def get_review_count(self, obj):
+        """Return the number of reviews for the product."""
+        return obj.rating_count
+
+    def get_rating_histogram(self, obj):
+        """Return the number of reviews per star (1-5)."""
+        return obj.rating_histogram
+
     def get_discounted_price(self, obj):
         """Return the discounted price for the product."""
-        return obj.get_discounted_price() 
\ No newline at end of file
+        return obj.get_discounted_price()
+
+class ProductListSerializer(ProductSerializer):
+    """
+    Compact Product representation for listings.
+    Returns only what a product card needs; the remaining ProductSerializer
+    fields can be requested with ?expand=.
+    """
+    image = serializers.SerializerMethodField()  # First product image
+
+    class Meta:
+        model = Product
+        fields = ['id', 'name', 'price', 'discounted_price', 'image', 'average_rating', 'review_count']
+        expandable_fields = ['sku', 'description', 'category', 'sizes', 'stock', 'colors', 'discount', 'coupon', 'created_at', 'updated_at', 'images', 'reviews', 'variants', 'rating_histogram']
+
+    def get_image(self, obj):
+        """Return the URL of the first product image (its medium rendition when available), if any."""
+        images = obj.images.all()
+        if not images:
+            return None
+        request = self.context.get('request')
+        renditions = rendition_urls(images[0], request)
+        if 'medium' in renditions:
+            return renditions['medium']['jpeg']
+        url = images[0].image.url
+        return request.build_absolute_uri(url) if request else url
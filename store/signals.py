@@ -0,0 +1,141 @@
+"""
+Signals keeping the product search index, parsed product colors, product
+image renditions, the catalog response cache (and cart pricing), product rating aggregates, the
+product stock rollup and product updated_at (used for ETags) in sync with
+catalog rows.
+"""
+from django.db.models.signals import pre_save, post_save, post_delete, pre_delete, m2m_changed
+from django.db import transaction
+from django.dispatch import receiver
+from django.utils import timezone
+from .cache import bump_catalog_version, bump_pricing_version
+from .images import delete_files, derivative_files, schedule_derivatives
+from .models import Category, Size, Product, ProductImage, ProductVariant, Coupon, Review
+from .search import get_search_backend
+from .stock import refresh_stock_rollups
+
+SEARCH_FIELDS = {'name', 'description'}
+
+@receiver(post_save, sender=Product)
+def index_product_for_search(sender, instance, update_fields=None, **kwargs):
+    # Saves that only touch other columns (e.g. stock) do not change the index
+    if update_fields is not None and not SEARCH_FIELDS & set(update_fields):
+        return
+    get_search_backend().index_products([instance])
+
+@receiver(post_save, sender=Product)
+def sync_product_colors(sender, instance, update_fields=None, raw=False, **kwargs):
+    if raw or (update_fields is not None and 'colors' not in update_fields):
+        return
+    instance.sync_colors()
+
+@receiver(post_delete, sender=Product)
+def remove_product_from_search(sender, instance, **kwargs):
+    get_search_backend().remove_products([instance.pk])
+
+# --- Variant stock and the Product.stock rollup ---
+
+@receiver(post_save, sender=Product)
+def create_unsized_variant(sender, instance, created, raw=False, **kwargs):
+    # Stock given at creation goes to the product's unsized variant
+    if created and not raw and instance.stock:
+        ProductVariant.objects.create(product=instance, stock=instance.stock)
+
+@receiver([post_save, post_delete], sender=ProductVariant)
+def refresh_stock_rollup(sender, instance, raw=False, **kwargs):
+    if not raw:
+        refresh_stock_rollups([instance.product_id])
+
+# --- Product image renditions ---
+
+@receiver(post_save, sender=ProductImage)
+def queue_image_derivatives(sender, instance, raw=False, **kwargs):
+    if not raw and instance.derivatives_pending:
+        transaction.on_commit(lambda: schedule_derivatives(instance.pk))
+
+@receiver(post_delete, sender=ProductImage)
+def delete_image_derivatives(sender, instance, **kwargs):
+    names = derivative_files(instance.derivatives)
+    transaction.on_commit(lambda: delete_files(instance.image.storage, names))
+
+# --- Denormalized product rating aggregates ---
+
+@receiver(pre_save, sender=Review)
+def remember_previous_rating(sender, instance, raw=False, **kwargs):
+    instance._previous_rating = None
+    if instance.pk and not raw:
+        instance._previous_rating = Review.objects.filter(pk=instance.pk).values_list('product_id', 'rating').first()
+
+@receiver(post_save, sender=Review)
+def update_product_rating(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    previous = getattr(instance, '_previous_rating', None)
+    if previous == (instance.product_id, instance.rating):
+        return  # Only the review text changed
+    if previous:
+        Product.objects.filter(pk=previous[0]).add_rating(previous[1], -1)
+    Product.objects.filter(pk=instance.product_id).add_rating(instance.rating)
+
+@receiver(post_delete, sender=Review)
+def remove_product_rating(sender, instance, **kwargs):
+    Product.objects.filter(pk=instance.product_id).add_rating(instance.rating, -1)
+
+# --- Catalog response cache invalidation ---
+
+@receiver([post_save, post_delete], sender=Product)
+@receiver([post_save, post_delete], sender=Category)
+@receiver([post_save, post_delete], sender=Size)
+@receiver([post_save, post_delete], sender=ProductImage)
+@receiver([post_save, post_delete], sender=Coupon)
+@receiver([post_save, post_delete], sender=Review)
+def invalidate_catalog_cache(sender, **kwargs):
+    bump_catalog_version(sender)
+
+@receiver(post_save, sender=Product)
+def invalidate_cart_pricing(sender, instance, created, raw=False, **kwargs):
+    pricing = (instance.price, instance.discount)
+    if not created and not raw and pricing != getattr(instance, 'saved_pricing', None):
+        bump_pricing_version()
+    instance.saved_pricing = pricing
+
+@receiver(m2m_changed, sender=Product.sizes.through)
+def invalidate_catalog_cache_on_sizes(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        bump_catalog_version(Product)
+
+# --- Product updated_at for conditional GETs ---
+
+def touch_products(**filters):
+    """Bump updated_at on products whose representation embeds a changed row."""
+    Product.objects.filter(**filters).update(updated_at=timezone.now())
+
+@receiver([post_save, post_delete], sender=Review)
+@receiver([post_save, post_delete], sender=ProductImage)
+def touch_product_of_related_row(sender, instance, **kwargs):
+    touch_products(pk=instance.product_id)
+
+@receiver(post_save, sender=Category)
+def touch_products_of_category(sender, instance, created, **kwargs):
+    if not created:
+        touch_products(category=instance)
+
+@receiver(post_save, sender=Coupon)
+@receiver(pre_delete, sender=Coupon)
+def touch_products_of_coupon(sender, instance, **kwargs):
+    touch_products(coupon=instance)
+
+@receiver(post_save, sender=Size)
+@receiver(pre_delete, sender=Size)
+def touch_products_of_size(sender, instance, **kwargs):
+    touch_products(sizes=instance)
+
+@receiver(m2m_changed, sender=Product.sizes.through)
+def touch_products_on_sizes(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse and action == 'pre_clear':
+        touch_products(sizes=instance)
+    elif action in ('post_add', 'post_remove', 'post_clear'):
+        if not reverse:
+            touch_products(pk=instance.pk)
+        elif pk_set:
+            touch_products(pk__in=pk_set)
@@ -0,0 +1,193 @@
+"""
+Concurrency-safe stock movements on product variants.
+
+Stock lives on ProductVariant rows (product x size). Order lines are
+resolved to a variant: the variant of their size, or the product's unsized
+variant. Stock is only changed with conditional UPDATEs
+(UPDATE ... SET stock = stock - q WHERE id = ... AND stock >= q), so two
+orders racing for the last unit cannot both succeed, and variants are
+updated in id order, so concurrent multi-item orders always take row locks
+in the same order and cannot deadlock each other. Sales of different sizes
+touch different rows.
+
+Variants of hot_stock (flash sale) products are taken from the counters in
+store.hot_stock instead, as the last step of a reservation so that a failed
+database line never needs to be given back.
+
+Product.stock is a rollup of its variants, recomputed in the same
+transaction as the movement with one UPDATE ... SET stock = (SELECT SUM(...)),
+so it never lags behind committed stock. stock_changed is sent after the
+commit with the ids of the products whose stock moved, for listeners such
+as the low stock notification; a failing listener is logged and does not
+fail the write.
+"""
+from collections import defaultdict
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.dispatch import Signal
+from django.utils import timezone
+from . import hot_stock
+from .cache import bump_catalog_version
+from .models import Product, ProductVariant, Size
+
+stock_changed = Signal()  # sender=Product, product_ids=[...]
+LOW_STOCK_THRESHOLD = 5  # Units per variant (admin warnings and the low stock digest)
+
+class InsufficientStock(ValueError):
+    """Raised when a product (size) does not have enough stock for a reservation."""
+    def __init__(self, product_id, name):
+        self.product_id = product_id
+        super().__init__(f"Not enough stock for {name}")
+
+def refresh_stock_rollups(product_ids):
+    """Recompute Product.stock for product_ids in the current transaction and notify listeners once it commits."""
+    product_ids = sorted(set(product_ids))
+    if not product_ids:
+        return
+    Product.objects.filter(pk__in=product_ids).rebuild_stock()
+    bump_catalog_version(Product)  # update() does not send post_save
+    transaction.on_commit(lambda: stock_changed.send(sender=Product, product_ids=product_ids), robust=True)
+
+def resolve_variants(lines):
+    """
+    Return {(product_id, size_id): variant} for order/cart lines, falling back
+    to the product's unsized variant; lines without any variant are left out.
+    """
+    variants = ProductVariant.objects.filter(product_id__in={product_id for product_id, _ in lines}).select_related('product', 'size')
+    by_key = {(variant.product_id, variant.size_id): variant for variant in variants}
+    resolved = {}
+    for product_id, size_id in lines:
+        variant = by_key.get((product_id, size_id)) or by_key.get((product_id, None))
+        if variant is not None:
+            resolved[(product_id, size_id)] = variant
+    return resolved
+
+def _line_label(product_id, size_id):
+    """Label of an order line that has no variant to take stock from."""
+    name = Product.objects.filter(pk=product_id).values_list('name', flat=True).first() or f'product {product_id}'
+    size = Size.objects.filter(pk=size_id).values_list('name', flat=True).first() if size_id else None
+    return f'{name} ({size})' if size else name
+
+def _variant_quantities(quantities):
+    """Map {(product_id, size_id): quantity} to {variant: quantity}; raise InsufficientStock for unstocked lines."""
+    resolved = resolve_variants(list(quantities))
+    totals = defaultdict(int)
+    variants = {}
+    for (product_id, size_id), quantity in quantities.items():
+        variant = resolved.get((product_id, size_id))
+        if variant is None:
+            raise InsufficientStock(product_id, _line_label(product_id, size_id))
+        variants[variant.pk] = variant
+        totals[variant.pk] += quantity
+    return [(variants[pk], totals[pk]) for pk in sorted(totals)]
+
+def _split_hot(variant_quantities):
+    """Split [(variant, quantity)] into (database lines, hot counter lines)."""
+    cold = [(variant, quantity) for variant, quantity in variant_quantities if not variant.product.hot_stock]
+    hot = [(variant, quantity) for variant, quantity in variant_quantities if variant.product.hot_stock]
+    return cold, hot
+
+def available_stock(lines):
+    """
+    Return {(product_id, size_id): (variant, units available)} for order/cart
+    lines (no locking); lines without any variant are left out.
+    """
+    resolved = resolve_variants(list(lines))
+    stock = {variant.pk: variant.stock for variant in resolved.values()}
+    hot = [variant for variant in resolved.values() if variant.product.hot_stock]
+    if hot:
+        stock.update(hot_stock.available(hot))
+    return {key: (variant, stock[variant.pk]) for key, variant in resolved.items()}
+
+def find_insufficient(quantities):
+    """Return labels of lines in quantities ({(product_id, size_id): quantity}) that are out of stock (no locking)."""
+    available = available_stock(quantities)
+    requested = defaultdict(int)
+    for key, quantity in quantities.items():
+        if key in available:
+            requested[available[key][0].pk] += quantity
+    return [
+        str(available[key][0]) if key in available else _line_label(*key)
+        for key in quantities
+        if key not in available or available[key][1] < requested[available[key][0].pk]
+    ]
+
+def reserve_stock(quantities):
+    """
+    Atomically take quantities ({(product_id, size_id): quantity}) out of stock.
+    Either every variant is decremented or none is (InsufficientStock is raised).
+    Returns the [(variant, quantity)] taken from hot counters: they are not
+    given back if an enclosing transaction rolls back later, callers do that
+    with release_hot_stock().
+    """
+    now = timezone.now()
+    cold, hot = _split_hot(_variant_quantities(quantities))
+    taken = False
+    try:
+        with transaction.atomic():
+            for variant, quantity in cold:
+                updated = ProductVariant.objects.filter(pk=variant.pk, stock__gte=quantity).update(
+                    stock=F('stock') - quantity, updated_at=now,
+                )
+                if not updated:
+                    raise InsufficientStock(variant.product_id, variant)
+            refresh_stock_rollups(variant.product_id for variant, _ in cold)
+            if hot and (short := hot_stock.take(hot)):
+                raise InsufficientStock(short.product_id, short)
+            taken = bool(hot)
+    except Exception:
+        if taken:
+            hot_stock.give(hot)  # Leaving the atomic block failed after the take
+        raise
+    return hot
+
+def release_stock(quantities):
+    """Atomically put quantities ({(product_id, size_id): quantity}) back into stock."""
+    now = timezone.now()
+    cold, hot = _split_hot(_variant_quantities(quantities))
+    with transaction.atomic():
+        for variant, quantity in cold:
+            ProductVariant.objects.filter(pk=variant.pk).update(stock=F('stock') + quantity, updated_at=now)
+        refresh_stock_rollups(variant.product_id for variant, _ in cold)
+    if hot:
+        transaction.on_commit(lambda: hot_stock.give(hot))
+
+def release_hot_stock(taken):
+    """Give back hot counter units taken by reserve_stock() whose transaction did not commit (no database access)."""
+    hot_stock.give(taken)
+
+def adjust_stock(products, amount):
+    """
+    Add amount (may be negative, floored at 0) to the stock of the products that
+    are not stocked per size, creating their unsized variant if they have none
+    (admin stock actions). Products stocked per size are left unchanged: their
+    sizes are edited one by one. Returns the ids of those products.
+    """
+    product_ids = [product.pk for product in products]
+    with transaction.atomic():
+        variants = ProductVariant.objects.filter(product_id__in=product_ids)
+        sized = set(variants.filter(size__isnull=False).values_list('product_id', flat=True))
+        stocked = set(variants.values_list('product_id', flat=True))
+        unsized = [pk for pk in product_ids if pk not in sized]
+        ProductVariant.objects.bulk_create([ProductVariant(product_id=pk) for pk in unsized if pk not in stocked])
+        ProductVariant.objects.filter(product_id__in=unsized, size=None).update(
+            stock=Greatest(F('stock') + amount, 0), updated_at=timezone.now(),
+        )
+        refresh_stock_rollups(unsized)
+    return sorted(sized)
+
+def stock_variants(product):
+    """
+    Return the variants of product (prefetch variants__size for lists); a product
+    without variants is returned as one unsaved unsized variant holding its stock.
+    """
+    return list(product.variants.all()) or [ProductVariant(product=product, stock=product.stock)]
+
+def low_stock_variants(product):
+    """Return the variants of product (see stock_variants) below LOW_STOCK_THRESHOLD."""
+    return [variant for variant in stock_variants(product) if variant.stock < LOW_STOCK_THRESHOLD]
+
+def set_unsized_stock(product, stock):
+    """Set the stock of a product that is not stocked per size (creates its unsized variant)."""
+    ProductVariant.objects.update_or_create(product=product, size=None, defaults={'stock': stock})  # Rollup: see store.signals
@@ -1,7 +1,18 @@
-from django.test import TestCase
+import json
+import os
+import tempfile
+from io import BytesIO, StringIO
+from unittest.mock import patch
+from PIL import Image as PILImage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import TestCase, override_settings
 from django.urls import reverse
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from rest_framework.test import APIClient
-from store.models import Category, Size, Product
+from store.images import generate_derivatives
+from store.models import Category, Size, Coupon, Product, ProductImage, ProductVariant, Review
 from django.contrib.auth import get_user_model
 
 User = get_user_model()
@@ -55,3 +66,547 @@ class StoreTests(TestCase):
         response = self.client.get(url)
         self.assertEqual(response.status_code, 200)
         self.assertGreaterEqual(len(response.data), 1)
+
+class ProductQueryCountTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.category = Category.objects.create(name='Tops')
+        self.sizes = [Size.objects.create(name=name) for name in ['S', 'M', 'L']]
+        self.reviewers = [User.objects.create_user(f'reviewer{i}', f'reviewer{i}@example.com', 'pass') for i in range(3)]
+
+    def create_products(self, count):
+        for i in range(count):
+            product = Product.objects.create(name=f'Product {i}', category=self.category, price=10 + i, stock=5)
+            product.sizes.set(self.sizes)
+            ProductImage.objects.create(product=product, image=f'products/{i}.jpg')
+            for rating, user in enumerate(self.reviewers, start=3):
+                Review.objects.create(product=product, user=user, rating=rating)
+
+    def count_list_queries(self):
+        url = reverse('store:product-list')
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries)
+
+    def test_product_list_query_count_is_constant(self):
+        self.create_products(2)
+        small = self.count_list_queries()
+        self.create_products(20)
+        large = self.count_list_queries()
+        self.assertEqual(small, large)
+
+    def test_average_rating_is_annotated(self):
+        self.create_products(1)
+        url = reverse('store:product-list')
+        response = self.client.get(url)
+        product = response.data['results'][0]
+        self.assertEqual(product['average_rating'], 4.0)
+        self.assertEqual(product['review_count'], 3)
+
+class ProductFieldsetTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user('reviewer', 'reviewer@example.com', 'pass')
+        self.category = Category.objects.create(name='Tops')
+        self.product = Product.objects.create(name='Shirt', description='Soft cotton', category=self.category, price=20, stock=10)
+        Review.objects.create(product=self.product, user=self.user, rating=5, review='Great')
+
+    def test_list_uses_compact_representation(self):
+        response = self.client.get(reverse('store:product-list'))
+        self.assertEqual(set(response.data['results'][0]), {'id', 'name', 'price', 'discounted_price', 'image', 'average_rating', 'review_count'})
+
+    def test_detail_uses_full_representation(self):
+        response = self.client.get(reverse('store:product-detail', args=[self.product.id]))
+        self.assertIn('description', response.data)
+        self.assertEqual(len(response.data['reviews']), 1)
+
+    def test_fields_param_limits_output(self):
+        response = self.client.get(reverse('store:product-list'), {'fields': 'id,name'})
+        self.assertEqual(set(response.data['results'][0]), {'id', 'name'})
+
+    def test_expand_param_adds_fields(self):
+        response = self.client.get(reverse('store:product-list'), {'expand': 'reviews,description'})
+        self.assertEqual(response.data['results'][0]['description'], 'Soft cotton')
+        self.assertEqual(response.data['results'][0]['reviews'][0]['review'], 'Great')
+
+class ProductPaginationTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.category = Category.objects.create(name='Tops')
+        for i in range(25):
+            Product.objects.create(name=f'Product {i}', category=self.category, price=10 + i % 3, stock=5)
+
+    def collect_ids(self, params):
+        url = reverse('store:product-list')
+        ids = []
+        response = self.client.get(url, params)
+        while True:
+            ids += [product['id'] for product in response.data['results']]
+            if not response.data['next']:
+                return ids
+            response = self.client.get(response.data['next'])
+
+    def test_cursor_pages_cover_catalog_once(self):
+        ids = self.collect_ids({'page_size': 7})
+        self.assertEqual(len(ids), 25)
+        self.assertEqual(len(set(ids)), 25)
+
+    def test_ordering_with_duplicate_values_is_stable(self):
+        ids = self.collect_ids({'page_size': 4, 'ordering': 'price'})
+        self.assertEqual(len(set(ids)), 25)
+        prices = list(Product.objects.filter(id__in=ids).values_list('id', 'price'))
+        price_by_id = dict(prices)
+        self.assertEqual([price_by_id[i] for i in ids], sorted(price_by_id[i] for i in ids))
+
+    def test_page_size_is_capped(self):
+        Product.objects.bulk_create([Product(name=f'Bulk {i}', category=self.category, price=1) for i in range(100)])
+        response = self.client.get(reverse('store:product-list'), {'page_size': 1000})
+        self.assertEqual(len(response.data['results']), 100)
+
+class ProductSearchTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.category = Category.objects.create(name='Tops')
+        self.shirt = Product.objects.create(name='Cotton Shirt', description='Soft and breathable', category=self.category, price=20)
+        self.dress = Product.objects.create(name='Summer Dress', description='Pairs well with a shirt', category=self.category, price=30)
+        self.hat = Product.objects.create(name='Sun Hat', description='Wide brim', category=self.category, price=10)
+
+    def search(self, term, **params):
+        response = self.client.get(reverse('store:product-list'), {'search': term, **params})
+        self.assertEqual(response.status_code, 200)
+        return [product['id'] for product in response.data['results']]
+
+    def test_results_are_ranked_by_relevance(self):
+        self.assertEqual(self.search('shirts'), [self.shirt.id, self.dress.id])
+
+    def test_explicit_ordering_overrides_rank(self):
+        self.assertEqual(self.search('shirt', ordering='-price'), [self.dress.id, self.shirt.id])
+
+    def test_index_follows_save_and_delete(self):
+        self.hat.name = 'Sun Shirt'
+        self.hat.save()
+        self.assertIn(self.hat.id, self.search('shirt'))
+        self.shirt.delete()
+        self.assertNotIn(self.shirt.id, self.search('shirt'))
+
+    def test_query_syntax_is_escaped(self):
+        self.assertEqual(self.search('"shirt OR'), [])
+
+    def test_ranked_results_paginate(self):
+        first = self.client.get(reverse('store:product-list'), {'search': 'shirt', 'page_size': 1})
+        second = self.client.get(first.data['next'])
+        self.assertEqual([first.data['results'][0]['id'], second.data['results'][0]['id']], [self.shirt.id, self.dress.id])
+
+class CatalogCacheTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.category = Category.objects.create(name='Tops')
+        self.product = Product.objects.create(name='Shirt', category=self.category, price=20, stock=10)
+        self.url = reverse('store:product-list')
+
+    def test_repeat_anonymous_read_is_served_from_cache(self):
+        first = self.client.get(self.url)
+        with CaptureQueriesContext(connection) as ctx:
+            second = self.client.get(self.url)
+        # Only the conditional GET validator aggregate hits the database
+        self.assertEqual(len(ctx.captured_queries), 1)
+        self.assertEqual(first.data, second.data)
+
+    def test_product_change_invalidates_cache(self):
+        self.client.get(self.url)
+        self.product.price = 25
+        self.product.save()
+        response = self.client.get(self.url)
+        self.assertEqual(response.data['results'][0]['price'], '25.00')
+
+    def test_size_change_invalidates_product_detail(self):
+        url = reverse('store:product-detail', args=[self.product.id])
+        self.client.get(url)
+        self.product.sizes.add(Size.objects.create(name='M'))
+        response = self.client.get(url)
+        self.assertEqual(len(response.data['sizes']), 1)
+
+    def test_authenticated_reads_bypass_cache(self):
+        self.client.get(self.url)
+        Product.objects.filter(pk=self.product.pk).update(name='Renamed')  # no signal
+        self.client.force_authenticate(user=User.objects.create_user('buyer', 'buyer@example.com', 'pass'))
+        response = self.client.get(self.url)
+        self.assertEqual(response.data['results'][0]['name'], 'Renamed')
+
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user('reviewer', 'reviewer@example.com', 'pass')
+        self.category = Category.objects.create(name='Tops')
+        self.product = Product.objects.create(name='Shirt', category=self.category, price=20, stock=10)
+        self.list_url = reverse('store:product-list')
+        self.detail_url = reverse('store:product-detail', args=[self.product.id])
+
+    def test_matching_etag_returns_304(self):
+        etag = self.client.get(self.list_url)['ETag']
+        response = self.client.get(self.list_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_review_changes_etag(self):
+        etag = self.client.get(self.detail_url)['ETag']
+        Review.objects.create(product=self.product, user=self.user, rating=4)
+        response = self.client.get(self.detail_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_image_changes_list_etag(self):
+        etag = self.client.get(self.list_url)['ETag']
+        ProductImage.objects.create(product=self.product, image='products/shirt.jpg')
+        response = self.client.get(self.list_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_detail_if_modified_since(self):
+        last_modified = self.client.get(self.detail_url)['Last-Modified']
+        response = self.client.get(self.detail_url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+
+    def test_missing_product_is_404(self):
+        response = self.client.get(reverse('store:product-detail', args=[self.product.id + 1]))
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(self.client.get(reverse('store:product-detail', args=['abc'])).status_code, 404)
+
+class ProductRatingAggregateTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.users = [User.objects.create_user(f'reviewer{i}', f'reviewer{i}@example.com', 'pass') for i in range(3)]
+        self.category = Category.objects.create(name='Tops')
+        self.product = Product.objects.create(name='Shirt', category=self.category, price=20, stock=10)
+        self.other = Product.objects.create(name='Hat', category=self.category, price=10, stock=10)
+
+    def assertRatings(self, product, count, total, histogram):
+        product.refresh_from_db()
+        self.assertEqual((product.rating_count, product.rating_sum), (count, total))
+        self.assertEqual(product.rating_histogram, histogram)
+
+    def test_review_create_edit_delete(self):
+        review = Review.objects.create(product=self.product, user=self.users[0], rating=5)
+        Review.objects.create(product=self.product, user=self.users[1], rating=3)
+        self.assertRatings(self.product, 2, 8, {1: 0, 2: 0, 3: 1, 4: 0, 5: 1})
+        self.assertEqual(self.product.rating_average, 4.0)
+        review.rating = 1
+        review.save()
+        self.assertRatings(self.product, 2, 4, {1: 1, 2: 0, 3: 1, 4: 0, 5: 0})
+        review.product = self.other
+        review.save()
+        self.assertRatings(self.product, 1, 3, {1: 0, 2: 0, 3: 1, 4: 0, 5: 0})
+        self.assertRatings(self.other, 1, 1, {1: 1, 2: 0, 3: 0, 4: 0, 5: 0})
+        review.delete()
+        self.assertRatings(self.other, 0, 0, {1: 0, 2: 0, 3: 0, 4: 0, 5: 0})
+
+    def test_stale_product_save_keeps_ratings(self):
+        stale = Product.objects.get(pk=self.product.pk)
+        Review.objects.create(product=self.product, user=self.users[0], rating=4)
+        stale.price = 25
+        stale.save()
+        self.assertRatings(self.product, 1, 4, {1: 0, 2: 0, 3: 0, 4: 1, 5: 0})
+
+    def test_rebuild_command(self):
+        Review.objects.create(product=self.product, user=self.users[0], rating=2)
+        Review.objects.create(product=self.product, user=self.users[1], rating=4)
+        Product.objects.update(rating_count=0, rating_sum=0, rating_2_count=0, rating_4_count=0)
+        call_command('rebuild_rating_aggregates', stdout=StringIO())
+        self.assertRatings(self.product, 2, 6, {1: 0, 2: 1, 3: 0, 4: 1, 5: 0})
+        self.assertRatings(self.other, 0, 0, {1: 0, 2: 0, 3: 0, 4: 0, 5: 0})
+
+    def test_order_and_filter_by_rating(self):
+        Review.objects.create(product=self.product, user=self.users[0], rating=2)
+        Review.objects.create(product=self.other, user=self.users[0], rating=5)
+        url = reverse('store:product-list')
+        response = self.client.get(url, {'ordering': '-rating_average'})
+        self.assertEqual([p['id'] for p in response.data['results']], [self.other.id, self.product.id])
+        response = self.client.get(url, {'min_rating': 4})
+        self.assertEqual([p['id'] for p in response.data['results']], [self.other.id])
+        detail = self.client.get(reverse('store:product-detail', args=[self.other.id]))
+        self.assertEqual(detail.data['rating_histogram'][5], 1)
+
+class ProductFacetTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.tops = Category.objects.create(name='Tops')
+        self.hats = Category.objects.create(name='Hats')
+        self.small, self.large = Size.objects.create(name='S'), Size.objects.create(name='L')
+        shirt = Product.objects.create(name='Red Shirt', category=self.tops, price=20, colors='Red, Blue')
+        shirt.sizes.set([self.small, self.large])
+        tee = Product.objects.create(name='Blue Tee', category=self.tops, price=60, colors='blue')
+        tee.sizes.set([self.small])
+        Product.objects.create(name='Red Hat', category=self.hats, price=250, colors='red,red')
+        self.url = reverse('store:product-facets')
+
+    def test_facet_counts(self):
+        response = self.client.get(self.url)
+        facets = response.data['facets']
+        self.assertEqual(len(response.data['results']), 3)
+        self.assertEqual([(c['name'], c['count']) for c in facets['categories']], [('Tops', 2), ('Hats', 1)])
+        self.assertEqual([(s['name'], s['count']) for s in facets['sizes']], [('S', 2), ('L', 1)])
+        self.assertEqual([(c['name'], c['count']) for c in facets['colors']], [('blue', 2), ('red', 2)])
+        self.assertEqual({p['label']: p['count'] for p in facets['price']}, {'0-25': 1, '25-50': 0, '50-100': 1, '100-200': 0, '200+': 1})
+
+    def test_facets_follow_filters(self):
+        response = self.client.get(self.url, {'color': 'RED'})
+        facets = response.data['facets']
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertEqual([(c['name'], c['count']) for c in facets['categories']], [('Hats', 1), ('Tops', 1)])
+        self.assertEqual([(c['name'], c['count']) for c in facets['colors']], [('red', 2), ('blue', 1)])
+
+    def test_facet_query_count_is_bounded(self):
+        for i in range(10):
+            Product.objects.create(name=f'Extra {i}', category=Category.objects.create(name=f'Cat {i}'), price=i, colors=f'c{i}')
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get(self.url, {'search': 'red'})
+        small = len(ctx.captured_queries)
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get(self.url, {'page_size': 2})
+        self.assertEqual(small, len(ctx.captured_queries))
+
+    def test_color_edit_resyncs_parsed_colors(self):
+        product = Product.objects.get(name='Blue Tee')
+        product.colors = 'green'
+        product.save()
+        self.assertEqual(list(product.parsed_colors.values_list('name', flat=True)), ['green'])
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class ProductImageDerivativeTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.category = Category.objects.create(name='Tops')
+        self.product = Product.objects.create(name='Shirt', category=self.category, price=20, stock=10)
+
+    def upload(self, size=(2000, 1000), mode='RGB'):
+        output = BytesIO()
+        PILImage.new(mode, size, 'red').save(output, format='PNG')
+        return SimpleUploadedFile('shirt.png', output.getvalue(), content_type='image/png')
+
+    def test_upload_schedules_derivatives_after_commit(self):
+        with patch('store.signals.schedule_derivatives') as schedule, self.captureOnCommitCallbacks(execute=True):
+            image = ProductImage.objects.create(product=self.product, image=self.upload())
+        schedule.assert_called_once_with(image.pk)
+
+    def test_renditions_are_resized_and_content_hashed(self):
+        image = ProductImage.objects.create(product=self.product, image=self.upload(mode='RGBA'))
+        derivatives = generate_derivatives(image)
+        self.assertEqual((derivatives['thumbnail']['width'], derivatives['thumbnail']['height']), (150, 75))
+        self.assertEqual(derivatives['large']['width'], 1200)
+        root = image.image.name.rsplit('.', 1)[0]
+        self.assertRegex(derivatives['medium']['webp'], rf'^{root}\.medium\.[0-9a-f]{{12}}\.webp$')
+        self.assertTrue(image.image.storage.exists(derivatives['medium']['jpeg']))
+        self.assertFalse(image.derivatives_pending)
+
+    def test_small_images_are_not_upscaled(self):
+        image = ProductImage.objects.create(product=self.product, image=self.upload(size=(400, 300)))
+        derivatives = generate_derivatives(image)
+        self.assertEqual((derivatives['large']['width'], derivatives['large']['height']), (400, 300))
+
+    def test_serializer_exposes_srcset(self):
+        image = ProductImage.objects.create(product=self.product, image=self.upload())
+        response = self.client.get(reverse('store:product-detail', args=[self.product.id]))
+        self.assertEqual(response.data['images'][0]['srcset'], {})
+        generate_derivatives(image)
+        response = self.client.get(reverse('store:product-detail', args=[self.product.id]))
+        srcset = response.data['images'][0]['srcset']['webp'].split(', ')
+        self.assertEqual([entry.rsplit(' ', 1)[1] for entry in srcset], ['150w', '600w', '1200w'])
+        listing = self.client.get(reverse('store:product-list'))
+        self.assertIn('.medium.', listing.data['results'][0]['image'])
+
+    def test_new_upload_replaces_old_renditions(self):
+        image = ProductImage.objects.create(product=self.product, image=self.upload())
+        old = generate_derivatives(image)
+        image.image = self.upload(size=(800, 800))
+        image.save()
+        self.assertTrue(image.derivatives_pending)
+        generate_derivatives(image)
+        self.assertFalse(image.image.storage.exists(old['thumbnail']['webp']))
+
+class CatalogImportExportTests(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.tops = Category.objects.create(name='Tops')
+        self.coupon = Coupon.objects.create(code='SAVE10', discount=10)
+
+    def write(self, name, content):
+        path = os.path.join(self.dir, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def test_csv_import_creates_and_updates(self):
+        Product.objects.create(name='Old Shirt', sku='SKU-1', category=self.tops, price=5, stock=1)
+        path = self.write('catalog.csv', (
+            'sku,name,description,price,category,sizes,stock,colors,discount,coupon\n'
+            'SKU-1,Shirt,Soft,20.00,Tops,S|M,10,"Red, Blue",0,SAVE10\n'
+            'SKU-2,Cap,Warm,8.50,Hats,L,3,green,5,\n'
+        ))
+        call_command('import_catalog', path, chunk_size=1, stdout=StringIO())
+        shirt = Product.objects.get(sku='SKU-1')
+        self.assertEqual((shirt.name, shirt.price, shirt.stock, shirt.coupon), ('Shirt', 20, 10, self.coupon))
+        self.assertEqual(sorted(shirt.sizes.values_list('name', flat=True)), ['M', 'S'])
+        self.assertEqual(sorted(shirt.parsed_colors.values_list('name', flat=True)), ['blue', 'red'])
+        cap = Product.objects.get(sku='SKU-2')
+        self.assertEqual(cap.category.name, 'Hats')
+        self.assertEqual(Product.objects.count(), 2)
+        self.assertFalse(os.path.exists(path + '.checkpoint'))
+
+    def test_bad_rows_are_rejected_and_import_continues(self):
+        path = self.write('catalog.jsonl', '\n'.join([
+            json.dumps({'sku': 'A', 'name': 'Shirt', 'price': '10', 'category': 'Tops'}),
+            'not json',
+            json.dumps({'sku': 'B', 'name': 'Pants', 'price': 'abc', 'category': 'Tops'}),
+            json.dumps({'sku': 'C', 'name': 'Dress', 'price': '30', 'category': 'Tops', 'coupon': 'NOPE'}),
+            json.dumps({'sku': 'D', 'name': 'Skirt', 'price': '25', 'category': 'Tops', 'sizes': ['S']}),
+        ]))
+        call_command('import_catalog', path, chunk_size=2, stdout=StringIO())
+        self.assertEqual(sorted(Product.objects.values_list('sku', flat=True)), ['A', 'D'])
+        with open(path + '.rejects.jsonl') as f:
+            self.assertEqual([json.loads(line)['row'] for line in f], [2, 3, 4])
+
+    def test_resume_skips_committed_rows(self):
+        path = self.write('catalog.csv', (
+            'sku,name,price,category\n'
+            'A,Shirt,10,Tops\n'
+            'B,Pants,20,Tops\n'
+        ))
+        self.write('catalog.csv.checkpoint', '1')
+        earlier = '{"row": 1, "error": "from the interrupted run", "data": {}}\n'
+        self.write('catalog.csv.rejects.jsonl', earlier)
+        call_command('import_catalog', path, resume=True, stdout=StringIO())
+        self.assertEqual(list(Product.objects.values_list('sku', flat=True)), ['B'])
+        # The rejects of the interrupted run are kept even though this run rejected nothing
+        with open(f'{path}.rejects.jsonl') as f:
+            self.assertEqual(f.read(), earlier)
+
+    def test_export_round_trips(self):
+        shirt = Product.objects.create(name='Shirt', sku='A', category=self.tops, price=10, stock=2, colors='red', coupon=self.coupon)
+        shirt.sizes.set([Size.objects.create(name='S'), Size.objects.create(name='M')])
+        path = os.path.join(self.dir, 'export.jsonl')
+        call_command('export_catalog', path, chunk_size=1, stdout=StringIO())
+        Product.objects.all().delete()
+        call_command('import_catalog', path, stdout=StringIO())
+        shirt = Product.objects.get(sku='A')
+        self.assertEqual((shirt.name, shirt.stock, shirt.colors, shirt.coupon), ('Shirt', 2, 'red', self.coupon))
+        self.assertEqual(shirt.sizes.count(), 2)
+
+    def test_size_stock_round_trips(self):
+        path = self.write('catalog.csv', 'sku,name,price,category,sizes,stock\nA,Shirt,10,Tops,S:4|M:0|L,99\n')
+        call_command('import_catalog', path, stdout=StringIO())
+        shirt = Product.objects.get(sku='A')
+        self.assertEqual(shirt.stock, 4)
+        self.assertEqual(dict(shirt.variants.values_list('size__name', 'stock')), {'S': 4, 'M': 0, 'L': 0})
+        export = os.path.join(self.dir, 'export.csv')
+        call_command('export_catalog', export, stdout=StringIO())
+        with open(export) as f:
+            self.assertIn('S:4|M:0|L:0', f.read())
+
+    def test_import_query_count_does_not_grow_with_chunk(self):
+        Size.objects.create(name='S')
+        header = 'sku,name,price,category,sizes\n'
+        counts = []
+        for rows in (1, 50):
+            path = self.write(f'{rows}.csv', header + ''.join(f'{rows}-{i},P{i},10,Tops,S\n' for i in range(rows)))
+            with CaptureQueriesContext(connection) as ctx:
+                call_command('import_catalog', path, stdout=StringIO())
+            counts.append(len(ctx.captured_queries))
+        self.assertEqual(counts[0], counts[1])
+
+class ProductVariantStockTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.admin = User.objects.create_superuser('admin', 'admin@example.com', 'adminpass')
+        self.category = Category.objects.create(name='Tops')
+        self.small, self.medium = Size.objects.create(name='S'), Size.objects.create(name='M')
+
+    def test_created_stock_goes_to_unsized_variant(self):
+        product = Product.objects.create(name='Shirt', category=self.category, price=20, stock=7)
+        self.assertEqual(list(product.variants.values_list('size', 'stock')), [(None, 7)])
+
+    def test_stock_is_rolled_up_from_variants(self):
+        product = Product.objects.create(name='Dress', category=self.category, price=50)
+        with self.captureOnCommitCallbacks(execute=True):
+            ProductVariant.objects.create(product=product, size=self.small, stock=2)
+            ProductVariant.objects.create(product=product, size=self.medium, stock=3)
+        product.refresh_from_db()
+        self.assertEqual(product.stock, 5)
+
+    def test_in_stock_size_filter(self):
+        dress = Product.objects.create(name='Dress', category=self.category, price=50)
+        ProductVariant.objects.create(product=dress, size=self.small, stock=0)
+        ProductVariant.objects.create(product=dress, size=self.medium, stock=1)
+        response = self.client.get(reverse('store:product-list'), {'in_stock_size': self.small.pk})
+        self.assertEqual(response.data['results'], [])
+        response = self.client.get(reverse('store:product-list'), {'in_stock_size': self.medium.pk})
+        self.assertEqual([row['id'] for row in response.data['results']], [dress.pk])
+
+    def test_stock_update_requires_unsized_product(self):
+        self.client.force_authenticate(user=self.admin)
+        shirt = Product.objects.create(name='Shirt', category=self.category, price=20, stock=1)
+        response = self.client.patch(reverse('store:product-detail', args=[shirt.pk]), {'stock': 9}, format='json')
+        self.assertEqual(response.data['stock'], 9)
+        self.assertEqual(shirt.variants.get().stock, 9)
+        ProductVariant.objects.create(product=shirt, size=self.small, stock=1)
+        response = self.client.patch(reverse('store:product-detail', args=[shirt.pk]), {'stock': 3}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_admin_stock_actions_skip_products_stocked_per_size(self):
+        shirt = Product.objects.create(name='Shirt', category=self.category, price=20, stock=1)
+        dress = Product.objects.create(name='Dress', category=self.category, price=50)
+        ProductVariant.objects.create(product=dress, size=self.small, stock=1)
+        ProductVariant.objects.create(product=dress, size=self.medium, stock=9)
+        self.client.force_login(self.admin)
+        url = reverse('admin:store_product_changelist')
+        response = self.client.get(url)
+        self.assertContains(response, 'LOW (S: 1)')  # The rollup (10) is not low
+        response = self.client.post(url, {'action': 'increase_stock', '_selected_action': [shirt.pk, dress.pk], 'amount': 3}, follow=True)
+        self.assertEqual([str(message) for message in response.context['messages']], [
+            'Increased stock by 3 for 1 products.',
+            'Stock not changed for products stocked per size: Dress. Edit their sizes instead.',
+        ])
+        self.assertEqual(list(shirt.variants.values_list('stock', flat=True)), [4])
+        self.assertEqual(sorted(dress.variants.values_list('stock', flat=True)), [1, 9])
+
+class ProductBatchTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.category = Category.objects.create(name='Tops')
+        self.products = [Product.objects.create(name=f'Product {i}', category=self.category, price=10 + i) for i in range(3)]
+        self.url = reverse('store:product-batch')
+
+    def ids(self, *ids):
+        return {'ids': ','.join(str(pk) for pk in ids)}
+
+    def test_results_follow_request_order_with_misses(self):
+        a, b, c = (product.id for product in self.products)
+        response = self.client.get(self.url, self.ids(c, 999, a, c))
+        self.assertEqual([item and item['id'] for item in response.data['results']], [c, None, a, c])
+        self.assertEqual(response.data['missing'], [999])
+
+    def test_products_are_cached_per_id(self):
+        a, b, c = (product.id for product in self.products)
+        with CaptureQueriesContext(connection) as cold:
+            self.client.get(self.url, self.ids(a, b))
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get(self.url, self.ids(b, a))
+        self.assertEqual(len(ctx.captured_queries), 0)
+        # Only c is loaded, with the same fixed number of queries (products + prefetches)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(self.url, self.ids(a, b, c))
+        self.assertEqual([item['id'] for item in response.data['results']], [a, b, c])
+        self.assertEqual(len(ctx.captured_queries), len(cold.captured_queries))
+        self.assertIn(f'({c})', ctx.captured_queries[0]['sql'])
+
+    def test_product_change_invalidates_batch_cache(self):
+        product = self.products[0]
+        self.client.get(self.url, self.ids(product.id))
+        product.price = 99
+        product.save()
+        response = self.client.get(self.url, self.ids(product.id))
+        self.assertEqual(response.data['results'][0]['price'], '99.00')
+
+    def test_invalid_and_oversized_requests(self):
+        self.assertEqual(self.client.get(self.url, {'ids': '1,x'}).status_code, 400)
+        self.assertEqual(self.client.get(self.url).status_code, 400)
+        self.assertEqual(self.client.get(self.url, self.ids(*range(1, 202))).status_code, 400)
@@ -5,10 +5,19 @@ from rest_framework.response import Response
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.filters import SearchFilter, OrderingFilter
 from .models import Category, Size, Product, ProductImage, Coupon, Review
-from .serializers import CategorySerializer, SizeSerializer, ProductSerializer, ProductImageSerializer, CouponSerializer, ReviewSerializer
+from .cache import cache_catalog_response, get_cached_catalog_objects
+from .conditional import ConditionalGetMixin, conditional_get
+from .facets import product_facets
+from .filters import ProductFilter
+from .pagination import CatalogCursorPagination
+from .search import ProductSearchFilter, RankedOrderingFilter
+from .serializers import CategorySerializer, SizeSerializer, ProductSerializer, ProductListSerializer, ProductImageSerializer, CouponSerializer, ReviewSerializer, includes_field
 from drf_yasg.utils import swagger_auto_schema
 from rest_framework.permissions import IsAuthenticatedOrReadOnly, IsAdminUser, SAFE_METHODS
 
+# Models a product representation is built from (for the catalog response cache)
+PRODUCT_CACHE_DEPENDENCIES = [Product, Category, Size, ProductImage, Coupon, Review]
+
 class AdminOrReadOnly(IsAuthenticatedOrReadOnly):
     def has_permission(self, request, view):
         if request.method in SAFE_METHODS:
@@ -29,13 +38,27 @@ class CategoryViewSet(viewsets.ModelViewSet):
     ordering_fields = ['name']
     swagger_tags = ['Store']
 
+    @cache_catalog_response(Category)
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @cache_catalog_response(Category)
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
     @action(detail=True, methods=['get'])
+    @cache_catalog_response(*PRODUCT_CACHE_DEPENDENCIES)
     def products(self, request, pk=None):
-        """List all products in this category."""
+        """List all products in this category (supports ?search= over products)."""
         category = self.get_object()
-        products = Product.objects.filter(category=category)
-        serializer = ProductSerializer(products, many=True)
-        return Response(serializer.data)
+        include_reviews = includes_field(request, 'reviews', default=False)
+        include_variants = includes_field(request, 'variants', default=False)
+        products = Product.objects.with_catalog_data(include_reviews=include_reviews, include_variants=include_variants).filter(category=category)
+        products = ProductSearchFilter().filter_queryset(request, products, self)
+        paginator = CatalogCursorPagination()
+        page = paginator.paginate_queryset(products, request, view=self)
+        serializer = ProductListSerializer(page, many=True, context=self.get_serializer_context())
+        return paginator.get_paginated_response(serializer.data)
 
 # Size API
 class SizeViewSet(viewsets.ModelViewSet):
@@ -50,6 +73,14 @@ class SizeViewSet(viewsets.ModelViewSet):
     ordering_fields = ['name']
     swagger_tags = ['Store']
 
+    @cache_catalog_response(Size)
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @cache_catalog_response(Size)
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
 # Coupon API (read-only)
 class CouponViewSet(viewsets.ReadOnlyModelViewSet):
     """
@@ -60,15 +91,24 @@ class CouponViewSet(viewsets.ReadOnlyModelViewSet):
     permission_classes = [permissions.AllowAny]
     swagger_tags = ['Store']
 
+    @cache_catalog_response(Coupon)
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @cache_catalog_response(Coupon)
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
 # Review API
 class ReviewViewSet(viewsets.ModelViewSet):
     """
     API endpoint for managing product reviews.
     Users can create, update, and delete their reviews.
     """
-    queryset = Review.objects.all()
+    queryset = Review.objects.select_related('user')
     serializer_class = ReviewSerializer
     permission_classes = [AdminOrReadOnly]
+    pagination_class = CatalogCursorPagination
     swagger_tags = ['Store']
 
     def perform_create(self, serializer):
@@ -79,45 +119,120 @@ class ReviewViewSet(viewsets.ModelViewSet):
         return super().list(request, *args, **kwargs)
 
 # Product API
-class ProductViewSet(viewsets.ModelViewSet):
+class ProductViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     """
     API endpoint for managing products.
     Supports filtering, searching, and custom actions for stock and category.
     """
-    queryset = Product.objects.all()
+    queryset = Product.objects.with_catalog_data()
     serializer_class = ProductSerializer
     permission_classes = [AdminOrReadOnly]
-    filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
-    filterset_fields = ['category', 'sizes', 'stock']
-    search_fields = ['name', 'description']
-    ordering_fields = ['name', 'price', 'created_at']
+    filter_backends = [DjangoFilterBackend, ProductSearchFilter, RankedOrderingFilter]
+    filterset_class = ProductFilter
+    ordering_fields = ['name', 'price', 'created_at', 'rating_average', 'rating_count']
+    pagination_class = CatalogCursorPagination
+    list_actions = ['list', 'in_stock', 'by_category', 'facets', 'batch']
+    max_batch_ids = 200
     swagger_tags = ['Store']
 
+    def get_serializer_class(self):
+        """Use the compact representation for product listings."""
+        if self.action in self.list_actions:
+            return ProductListSerializer
+        return ProductSerializer
+
+    def get_queryset(self):
+        """Only prefetch reviews when the response will include them."""
+        detail = self.action not in self.list_actions
+        include_reviews = includes_field(self.request, 'reviews', default=detail)
+        include_variants = includes_field(self.request, 'variants', default=detail)
+        return Product.objects.with_catalog_data(include_reviews=include_reviews, include_variants=include_variants)
+
+    def get_validator_queryset(self):
+        """Plain filtered products for ETag computation (no prefetches)."""
+        return self.filter_queryset(Product.objects.all())
+
+    @conditional_get
+    @cache_catalog_response(*PRODUCT_CACHE_DEPENDENCIES)
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @conditional_get
+    @cache_catalog_response(*PRODUCT_CACHE_DEPENDENCIES)
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
+    def paginated_response(self, queryset):
+        """Serialize one cursor page of queryset."""
+        page = self.paginate_queryset(queryset)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
     @action(detail=False, methods=['get'])
+    @cache_catalog_response(*PRODUCT_CACHE_DEPENDENCIES)
     def in_stock(self, request):
         """List all products that are in stock."""
-        products = Product.objects.filter(stock__gt=0)
-        serializer = self.get_serializer(products, many=True)
-        return Response(serializer.data)
+        products = self.filter_queryset(self.get_queryset()).filter(stock__gt=0)
+        return self.paginated_response(products)
 
     @action(detail=False, methods=['get'])
+    @cache_catalog_response(*PRODUCT_CACHE_DEPENDENCIES)
     def by_category(self, request):
         """List all products in a given category (by category_id)."""
         category_id = request.query_params.get('category_id')
         if category_id:
-            products = Product.objects.filter(category_id=category_id)
-            serializer = self.get_serializer(products, many=True)
-            return Response(serializer.data)
+            products = self.filter_queryset(self.get_queryset()).filter(category_id=category_id)
+            return self.paginated_response(products)
         return Response({'error': 'category_id parameter required'}, status=400)
 
+    @action(detail=False, methods=['get'])
+    def batch(self, request):
+        """
+        Look up several products by id (?ids=3,1,2) in one request.
+        Results follow the requested order, with null for ids that do not exist
+        (also listed in "missing"). Each product is cached separately.
+        """
+        try:
+            ids = [int(value) for value in request.query_params.get('ids', '').split(',') if value.strip()]
+        except ValueError:
+            return Response({'error': 'ids must be a comma-separated list of integers'}, status=400)
+        if not ids:
+            return Response({'error': 'ids parameter required'}, status=400)
+        unique_ids = list(dict.fromkeys(ids))
+        if len(unique_ids) > self.max_batch_ids:
+            return Response({'error': f'At most {self.max_batch_ids} ids per request'}, status=400)
+
+        def build(missing_ids):
+            products = self.get_queryset().in_bulk(missing_ids)
+            return {pk: self.get_serializer(product).data for pk, product in products.items()}
+
+        found = get_cached_catalog_objects(request, PRODUCT_CACHE_DEPENDENCIES, unique_ids, build, exclude_params=['ids'])
+        return Response({
+            'results': [found.get(pk) for pk in ids],
+            'missing': [pk for pk in unique_ids if pk not in found],
+        })
+
+    @action(detail=False, methods=['get'])
+    @cache_catalog_response(*PRODUCT_CACHE_DEPENDENCIES)
+    def facets(self, request):
+        """
+        First page of the filtered/searched products plus category, size,
+        color and price-bucket counts for the same filters.
+        """
+        response = self.paginated_response(self.filter_queryset(self.get_queryset()))
+        response.data['facets'] = product_facets(self.filter_queryset(Product.objects.all()))
+        return response
+
     @action(detail=True, methods=['get', 'post'], permission_classes=[permissions.IsAuthenticatedOrReadOnly])
     def reviews(self, request, pk=None):
         """Get or add reviews for a product."""
         product = self.get_object()
         if request.method == 'GET':
-            reviews = product.reviews.all()
-            serializer = ReviewSerializer(reviews, many=True)
-            return Response(serializer.data)
+            reviews = Review.objects.filter(product=product).select_related('user')
+            paginator = CatalogCursorPagination()
+            page = paginator.paginate_queryset(reviews, request, view=self)
+            serializer = ReviewSerializer(page, many=True)
+            return paginator.get_paginated_response(serializer.data)
         elif request.method == 'POST':
             serializer = ReviewSerializer(data=request.data)
             if serializer.is_valid():
@@ -1,3 +1,4 @@
+import logging
 from django.shortcuts import render
 from rest_framework import status, permissions
 from rest_framework.decorators import api_view, permission_classes
@@ -11,13 +12,37 @@ from .models import UserProfile
 from rest_framework.permissions import AllowAny
 from drf_yasg.utils import swagger_auto_schema
 from rest_framework_simplejwt.views import TokenObtainPairView
+from orders.guest_cart import TOKEN_HEADER, merge_guest_cart
+
+logger = logging.getLogger(__name__)
+
+def auth_response(request, user, status_code=status.HTTP_200_OK):
+    """
+    Return the user and JWT tokens, after merging the guest cart sent in the
+    X-Cart-Token header (if any) into the user's cart.
+    """
+    refresh = RefreshToken.for_user(user)
+    data = {
+        'user': UserSerializer(user).data,
+        'refresh': str(refresh),
+        'access': str(refresh.access_token),
+    }
+    token = request.headers.get(TOKEN_HEADER)
+    if token:
+        try:
+            data['cart_items_merged'] = merge_guest_cart(token, user)
+        except Exception:
+            # Logging in must not fail on the guest cart; its lines stay in the guest cart
+            logger.exception('Could not merge the guest cart of user %s', user.pk)
+            data['cart_items_merged'] = 0
+    return Response(data, status=status_code)
 
 # User registration API
 class RegisterView(APIView):
     """
     API endpoint for user registration.
     Accepts username, email, password, and creates a new user.
-    Returns JWT tokens on success.
+    Returns JWT tokens on success; a guest cart sent in X-Cart-Token is merged into the user's cart.
     """
     permission_classes = [AllowAny]
     swagger_tags = ['Users']
@@ -27,12 +52,7 @@ class RegisterView(APIView):
         serializer = RegisterSerializer(data=request.data)
         if serializer.is_valid():
             user = serializer.save()
-            refresh = RefreshToken.for_user(user)
-            return Response({
-                'user': UserSerializer(user).data,
-                'refresh': str(refresh),
-                'access': str(refresh.access_token),
-            }, status=status.HTTP_201_CREATED)
+            return auth_response(request, user, status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 # User login API
@@ -40,6 +60,7 @@ class LoginView(TokenObtainPairView):
     """
     API endpoint for user login.
     Accepts username and password, returns JWT tokens on success.
+    A guest cart sent in X-Cart-Token is merged into the user's cart.
     """
     permission_classes = [AllowAny]
     swagger_tags = ['Users']
@@ -49,12 +70,7 @@ class LoginView(TokenObtainPairView):
         password = request.data.get('password')
         user = authenticate(username=username, password=password)
         if user:
-            refresh = RefreshToken.for_user(user)
-            return Response({
-                'user': UserSerializer(user).data,
-                'refresh': str(refresh),
-                'access': str(refresh.access_token),
-            })
+            return auth_response(request, user)
         return Response({'error': 'Invalid credentials'}, status=status.HTTP_401_UNAUTHORIZED)
 
 # User profile API (view/update)